@@ -1,3 +1,5 @@
+from decimal import Decimal, InvalidOperation
+
 from django import forms
 from django.contrib import admin, messages
 from django.contrib.admin.helpers import ActionForm
@@ -5,13 +7,16 @@ from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import User
 from django.db import transaction
 from django.urls import reverse
+from django.utils import timezone
 from django.http import HttpResponseRedirect
 
 from .models import (
     Restaurante, Bar, Produto, RecebimentoEstoque,
     TransferenciaBar, ContagemBar, RequisicaoProduto,
     EstoqueBar, AcessoUsuarioBar, Evento, EventoProduto,
-    PermissaoPagina, Alimento, EventoAlimento, PerdaProduto
+    PermissaoPagina, Alimento, EventoAlimento, PerdaProduto,
+    MovimentoEstoque, CheckpointEstoque, UltimaContagem,
+    FechamentoTurno
 )
 
 # -------------------------------------------------------------------
@@ -84,38 +89,24 @@ class ProdutoAdmin(admin.ModelAdmin):
             return
 
         try:
-            q_g = float(request.POST.get('quantidade_garrafas') or 0)
-            q_d = float(request.POST.get('quantidade_doses') or 0)
-        except ValueError:
+            q_g = Decimal(request.POST.get('quantidade_garrafas') or 0)
+            q_d = Decimal(request.POST.get('quantidade_doses') or 0)
+        except InvalidOperation:
             messages.error(request, "Quantidades inválidas.")
             return
 
         bares = Bar.objects.filter(pk__in=bar_ids)
         produtos = list(queryset)
 
-        existentes = set(
-            EstoqueBar.objects
-            .filter(bar__in=bares, produto__in=produtos)
-            .values_list('bar_id', 'produto_id')
+        # só os pares que ainda não existem; o saldo inicial entra no livro de movimentos
+        criados = EstoqueBar.criar_faltantes(
+            bares.values_list('id', flat=True), [p.id for p in produtos],
+            garrafas=q_g, doses=q_d, tipo='AJUSTE', usuario=request.user,
         )
 
-        criar = []
-        for b in bares:
-            for p in produtos:
-                if (b.id, p.id) not in existentes:
-                    criar.append(EstoqueBar(
-                        bar=b, produto=p,
-                        quantidade_garrafas=q_g or 0,
-                        quantidade_doses=q_d or 0
-                    ))
-
-        with transaction.atomic():
-            if criar:
-                EstoqueBar.objects.bulk_create(criar, ignore_conflicts=True, batch_size=2000)
-
         messages.success(
             request,
-            f"Criados {len(criar)} estoques (Produtos: {len(produtos)} | Bares: {bares.count()})."
+            f"Criados {criados} estoques (Produtos: {len(produtos)} | Bares: {bares.count()})."
         )
 
 # -------------------------------------------------------------------
@@ -148,6 +139,54 @@ class ContagemBarAdmin(admin.ModelAdmin):
     list_filter = ('bar', 'produto', 'usuario')
     search_fields = ('bar__nome', 'produto__nome', 'usuario__username')
 
+    # Edições manuais podem mudar a ordem do histórico: recalcula UltimaContagem
+    # dos pares afetados (antes e depois da edição) e avisa quando a contagem já
+    # entrou num fechamento de turno, que só muda se for refeito.
+    def save_model(self, request, obj, form, change):
+        pares = {(obj.bar_id, obj.produto_id)}
+        datas = [obj.data_contagem]
+        if change:
+            for b, p, d in ContagemBar.objects.filter(pk=obj.pk).values_list('bar_id', 'produto_id', 'data_contagem'):
+                pares.add((b, p))
+                datas.append(d)
+        with transaction.atomic():
+            super().save_model(request, obj, form, change)
+            self._reconstruir(pares)
+        self._avisar_fechamentos(request, datas)
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            super().delete_model(request, obj)
+            self._reconstruir({(obj.bar_id, obj.produto_id)})
+        self._avisar_fechamentos(request, [obj.data_contagem])
+
+    def delete_queryset(self, request, queryset):
+        linhas = list(queryset.values_list('bar_id', 'produto_id', 'data_contagem'))
+        with transaction.atomic():
+            super().delete_queryset(request, queryset)
+            self._reconstruir({(b, p) for b, p, _ in linhas})
+        self._avisar_fechamentos(request, [d for _, _, d in linhas])
+
+    @staticmethod
+    def _reconstruir(pares):
+        if pares:
+            UltimaContagem.reconstruir(bar_ids={b for b, _ in pares}, produto_ids={p for _, p in pares})
+
+    @staticmethod
+    def _avisar_fechamentos(request, datas):
+        datas = [d for d in datas if d is not None]
+        if not datas:
+            return
+        afetado = (FechamentoTurno.objects.filter(data_referencia__gte=min(datas))
+                   .order_by('dia_operacional').values_list('dia_operacional', flat=True).first())
+        if afetado is not None:
+            messages.warning(
+                request,
+                f"Contagem já incluída em fechamento de turno: refaça os fechamentos a partir de "
+                f"{afetado:%d/%m/%Y} (ação \"Refazer\" ou manage.py fechar_turno --dia "
+                f"{afetado:%Y-%m-%d} --completo).",
+            )
+
 # -------------------------------------------------------------------
 # Requisição de produto
 # -------------------------------------------------------------------
@@ -160,11 +199,27 @@ class RequisicaoProdutoAdmin(admin.ModelAdmin):
 
     @admin.action(description="Aprovar requisições selecionadas")
     def aprovar_requisicao(self, request, queryset):
-        queryset.update(status='APROVADA')
+        # mesmo motor da tela de aprovação: debita o central e credita o bar
+        processadas = RequisicaoProduto.aprovar_lote(queryset, request.user)
+        aprovadas = sum(1 for r in processadas if r.status == 'APROVADA')
+        falhas = len(processadas) - aprovadas
+        messages.success(request, f"{aprovadas} requisição(ões) aprovada(s).")
+        if falhas:
+            messages.warning(request, f"{falhas} requisição(ões) sem estoque suficiente no central.")
 
     @admin.action(description="Negar requisições selecionadas")
     def negar_requisicao(self, request, queryset):
-        queryset.update(status='NEGADA')
+        # como a tela de aprovação: só pendentes, com aprovador/data, e invalida os relatórios
+        agora = timezone.now()
+        negadas = list(queryset.filter(status='PENDENTE'))
+        for requisicao in negadas:
+            requisicao.status = 'NEGADA'
+            requisicao.usuario_aprovador = request.user
+            requisicao.data_decisao = agora
+        if negadas:
+            RequisicaoProduto.objects.bulk_update(negadas, ['status', 'usuario_aprovador', 'data_decisao'])
+            Restaurante.invalidar_relatorios(bar_ids={r.bar_id for r in negadas})
+        messages.success(request, f"{len(negadas)} requisição(ões) negada(s).")
 
 # -------------------------------------------------------------------
 # Filtro lateral "Por produto" em ordem alfabética garantida
@@ -187,6 +242,119 @@ class EstoqueBarAdmin(admin.ModelAdmin):
     search_fields = ('bar__nome', 'produto__nome')
     autocomplete_fields = ('bar', 'produto')  # formulário com busca
 
+    readonly_fields = ('saldo_no_livro',)
+
+    @admin.display(description="Saldo no livro de movimentos")
+    def saldo_no_livro(self, obj):
+        # conferência: último checkpoint + movimentos posteriores (deve bater com o saldo acima)
+        if obj is None or obj.pk is None:
+            return "-"
+        g, d = MovimentoEstoque.saldo_em(obj.bar_id, obj.produto_id, timezone.now())
+        return f"{g} garrafas | {d} doses"
+
+    def save_model(self, request, obj, form, change):
+        # edição manual passa pelo mesmo caminho da contagem → gera movimento de AJUSTE
+        if change and not ({'bar', 'produto'} & set(form.changed_data)):
+            EstoqueBar.definir(obj.bar, obj.produto,
+                               garrafas=obj.quantidade_garrafas, doses=obj.quantidade_doses,
+                               tipo='AJUSTE', usuario=request.user)
+            return
+        with transaction.atomic():
+            # troca de bar/produto: o saldo sai do par antigo e entra no novo
+            antigo = EstoqueBar.objects.select_for_update().get(pk=obj.pk) if change else None
+            super().save_model(request, obj, form, change)
+            if antigo is not None:
+                self._lancar_saida([antigo], request.user)
+            MovimentoEstoque.registrar(obj.bar, obj.produto,
+                                       garrafas=obj.quantidade_garrafas, doses=obj.quantidade_doses,
+                                       tipo='AJUSTE', usuario=request.user)
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            self._lancar_saida([obj], request.user)
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            self._lancar_saida(queryset.select_for_update(of=('self',)).order_by('pk'), request.user)
+            super().delete_queryset(request, queryset)
+
+    @staticmethod
+    def _lancar_saida(estoques, usuario):
+        """Lança no livro a saída do saldo inteiro de linhas que deixam de existir."""
+        movimentos = [
+            MovimentoEstoque.novo(e.bar_id, e.produto_id, -e.quantidade_garrafas, -e.quantidade_doses,
+                                  tipo='AJUSTE', usuario=usuario)
+            for e in estoques
+        ]
+        MovimentoEstoque.objects.bulk_create([m for m in movimentos if m is not None], batch_size=2000)
+
+# -------------------------------------------------------------------
+# Livro de movimentos (somente leitura: é append-only)
+# -------------------------------------------------------------------
+@admin.register(MovimentoEstoque)
+class MovimentoEstoqueAdmin(admin.ModelAdmin):
+    list_display = ('data_movimento', 'tipo', 'bar', 'produto', 'delta_garrafas', 'delta_doses', 'usuario')
+    list_filter  = ('tipo', 'bar')
+    search_fields = ('produto__nome', 'bar__nome', 'usuario__username')
+    date_hierarchy = 'data_movimento'
+    list_select_related = ('bar', 'produto', 'usuario')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+@admin.register(CheckpointEstoque)
+class CheckpointEstoqueAdmin(admin.ModelAdmin):
+    list_display = ('data_referencia', 'bar', 'produto', 'quantidade_garrafas', 'quantidade_doses')
+    list_filter  = ('bar',)
+    search_fields = ('produto__nome', 'bar__nome')
+    list_select_related = ('bar', 'produto')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+@admin.register(UltimaContagem)
+class UltimaContagemAdmin(admin.ModelAdmin):
+    list_display = ('bar', 'produto', 'data_ultima', 'ultima', 'penultima')
+    list_filter  = ('bar',)
+    search_fields = ('produto__nome', 'bar__nome')
+    list_select_related = ('bar', 'produto', 'ultima__bar', 'ultima__produto',
+                           'penultima__bar', 'penultima__produto')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+@admin.register(FechamentoTurno)
+class FechamentoTurnoAdmin(admin.ModelAdmin):
+    list_display = ('dia_operacional', 'data_referencia', 'usuario', 'criado_em')
+    date_hierarchy = 'dia_operacional'
+    actions = ['refazer_fechamento']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    @admin.action(description="Refazer fechamento dos dias selecionados")
+    def refazer_fechamento(self, request, queryset):
+        # do histórico inteiro: contagens editadas antes do fechamento anterior entram
+        for dia in queryset.order_by('dia_operacional').values_list('dia_operacional', flat=True):
+            FechamentoTurno.fechar(dia, usuario=request.user, completo=True)
+        messages.success(request, f"{queryset.count()} fechamento(s) refeito(s).")
+
 # -------------------------------------------------------------------
 # Eventos
 # -------------------------------------------------------------------
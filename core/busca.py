@@ -0,0 +1,54 @@
+# core/busca.py
+"""Busca por trecho de texto (nome/código) sem diferença de acento nem de caixa.
+
+   `nome__icontains` vira `UPPER(nome) LIKE '%...%'`: com curinga no início nenhum
+   índice B-tree ajuda e a consulta varre a tabela inteira. Aqui o filtro é
+
+       core_sem_acento(coluna) ILIKE core_sem_acento('%termo%')
+
+   e cada coluna pesquisável tem um índice GIN de trigramas (pg_trgm) sobre
+   exatamente essa expressão — o PostgreSQL usa o índice para o ILIKE com curinga
+   dos dois lados. core_sem_acento é um invólucro IMMUTABLE de unaccent() (que
+   sozinho não pode ir para um índice), criado na migração 0051; assim "cachaca"
+   encontra "Cachaça" e vice-versa.
+
+       busca.filtrar(Produto.objects.all(), 'cachaca', 'nome', 'codigo')"""
+
+from functools import reduce
+from operator import or_
+
+from django.db.models import CharField, F, Func, Lookup, Q
+
+
+class SemAcento(Func):
+    """Texto sem acentos (core_sem_acento no banco). Usada nos índices e nas buscas."""
+    function = 'core_sem_acento'
+    output_field = CharField()
+
+
+class ContemSemAcento(Lookup):
+    """`lhs` contém `rhs` (trecho literal), ignorando acento e caixa."""
+    lookup_name = 'contem_sem_acento'
+    prepare_rhs = False
+
+    def get_db_prep_lookup(self, value, connection):
+        return '%s', ['%' + connection.ops.prep_for_like_query(value) + '%']
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'core_sem_acento({lhs}) ILIKE core_sem_acento({rhs})', [*lhs_params, *rhs_params]
+
+
+def condicao(termo, *campos):
+    """Q que casa `termo` em qualquer um dos `campos` (aceita caminhos com __)."""
+    return reduce(or_, (Q(ContemSemAcento(F(campo), termo)) for campo in campos))
+
+
+def filtrar(qs, termo, *campos):
+    """`qs` restrito aos registros com `termo` em algum dos `campos`; termo vazio não filtra."""
+    termo = (termo or '').strip()
+    if not termo:
+        return qs
+    return qs.filter(condicao(termo, *campos))
+
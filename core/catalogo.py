@@ -0,0 +1,91 @@
+# core/catalogo.py
+"""Catálogo de produtos e alimentos ativos em JSON compacto, para o autocomplete.
+
+   Em vez de cada formulário trazer os ~2.000 produtos como <option> no HTML, o
+   navegador baixa /catalogo/<tipo>/ uma vez e filtra localmente (ver
+   templates/core/_catalogo.html); nas próximas telas só revalida pelo ETag e
+   recebe 304.
+
+   O JSON fica pronto em memória (por processo), guardado com a versão dos dados:
+   (quantidade de registros, maior atualizado_em) da tabela inteira — uma consulta
+   de agregação por requisição. Qualquer save (admin, importação, views) muda
+   atualizado_em e um delete muda a quantidade, então todos os processos percebem
+   a mudança sem combinar nada entre si; no próprio processo os sinais ainda
+   descartam a entrada na hora (core/signals.py)."""
+
+import hashlib
+import json
+import threading
+from typing import NamedTuple
+
+from django.db.models import Count, Max
+
+from .models import Alimento, Produto
+
+
+class Catalogo(NamedTuple):
+    versao: tuple     # (registros, maior atualizado_em) da tabela
+    etag: str
+    corpo: bytes      # {"campos": [...], "itens": [[...], ...]}
+
+
+def _produtos():
+    itens = (Produto.objects.filter(ativo=True).order_by('nome')
+             .values_list('id', 'codigo', 'nome'))
+    return ['id', 'codigo', 'nome'], [list(i) for i in itens]
+
+
+def _alimentos():
+    unidades = dict(Alimento.UNIDADE_CHOICES)
+    itens = (Alimento.objects.filter(ativo=True).order_by('nome')
+             .values_list('id', 'codigo', 'nome', 'unidade'))
+    return ['id', 'codigo', 'nome', 'unidade'], [[i, c, n, unidades.get(u, u)] for i, c, n, u in itens]
+
+
+TIPOS = {
+    'produtos': (Produto, _produtos),
+    'alimentos': (Alimento, _alimentos),
+}
+
+_lock = threading.Lock()
+_catalogos = {}
+
+
+def existe(tipo):
+    return tipo in TIPOS
+
+
+def versao(tipo):
+    modelo, _ = TIPOS[tipo]
+    dados = modelo.objects.aggregate(n=Count('id'), ultima=Max('atualizado_em'))
+    return dados['n'], dados['ultima']
+
+
+def _montar(tipo, versao_atual):
+    campos, itens = TIPOS[tipo][1]()
+    corpo = json.dumps({'campos': campos, 'itens': itens}, ensure_ascii=False,
+                       separators=(',', ':')).encode('utf-8')
+    etag = '"%s"' % hashlib.sha1(corpo).hexdigest()[:20]
+    return Catalogo(versao_atual, etag, corpo)
+
+
+def obter(tipo):
+    """Catálogo `tipo` na versão atual do banco; remonta só quando ela mudou."""
+    versao_atual = versao(tipo)
+    with _lock:
+        catalogo = _catalogos.get(tipo)
+    if catalogo is not None and catalogo.versao == versao_atual:
+        return catalogo
+    catalogo = _montar(tipo, versao_atual)
+    with _lock:
+        _catalogos[tipo] = catalogo
+    return catalogo
+
+
+def descartar(tipo=None):
+    """Esquece o catálogo `tipo` (ou todos) neste processo."""
+    with _lock:
+        if tipo is None:
+            _catalogos.clear()
+        else:
+            _catalogos.pop(tipo, None)
@@ -0,0 +1,194 @@
+# core/condicional.py
+"""GET condicional (ETag/Last-Modified) das páginas de relatório e das exportações.
+
+   O validador sai da mesma geração que o cache dos relatórios já usa
+   (Restaurante/Bar.geracao_dados, que sobe no commit de qualquer gravação de
+   estoque/contagem), somada ao escopo e aos parâmetros da URL — e ao dia de hoje,
+   porque os filtros padrão são relativos a ele. Custa uma consulta por PK: se o
+   navegador já tem essa versão, a resposta é 304 sem rodar o relatório nem o
+   template. A geração é um instante em µs (ver Restaurante.invalidar_relatorios)
+   e vira o Last-Modified.
+
+   Na página o ETag inclui ainda o usuário e o cookie CSRF (o HTML é de quem pediu)
+   e, como as entradas do cache, vale no máximo RELATORIOS_CACHE_VALIDADE segundos:
+   o que não passa pela geração (nomes, permissões) se atualiza nesse prazo.
+
+   Nas exportações (guardar=True) o arquivo gerado fica no storage como uma
+   TarefaExportacao concluída: downloads repetidos com a mesma chave, dentro de
+   EXPORTACAO_REAPROVEITAR segundos, recebem a cópia guardada (apagada depois de
+   EXPORTACAO_MANTER_HORAS, ver TarefaExportacao.limpar_se_preciso). Nas que estão em
+   core/exportacoes.py a chave é a mesma da fila, então a cópia vale para os dois
+   lados. Relatórios globais (eventos) não têm geração e ficam de fora."""
+
+import hashlib
+import logging
+import time
+from functools import wraps
+from typing import NamedTuple, Optional
+
+from django.conf import settings
+from django.contrib import messages
+from django.core.files.base import ContentFile
+from django.http import FileResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_header_parameters
+
+from core import exportacoes, relatorios, relatorios_cache
+from .models import Bar, PermissaoPagina, TarefaExportacao
+
+logger = logging.getLogger(__name__)
+
+
+class Validador(NamedTuple):
+    chave: str                          # dados: relatório, escopo, filtros e geração
+    etag: str
+    modificado_em: Optional[int]        # timestamp (s) do Last-Modified
+    restaurante_id: Optional[int]       # escopo efetivo (o que entra nos dados)
+    bar_id: Optional[int]
+
+
+def _parametros(params):
+    return relatorios_cache.normalizar_filtros(dict(params.lists()) if hasattr(params, 'lists') else params)
+
+
+def _dados(nome, params, restaurante_id, bar_id):
+    """(chave, geração, restaurante_id, bar_id) dos dados de `nome`, ou None quando
+       não há geração: relatório global, escopo fora da sessão ou inexistente."""
+    if exportacoes.existe(nome):
+        restaurante_id, bar_id = exportacoes.escopo(nome, restaurante_id, bar_id)
+        if exportacoes.exige_restaurante(nome) and not restaurante_id:
+            return None
+        versao = exportacoes.geracao(nome, params, restaurante_id=restaurante_id)
+        if versao is None:
+            return None
+        chave = exportacoes.chave(nome, params, restaurante_id=restaurante_id, bar_id=bar_id, versao=versao)
+        return chave, versao, restaurante_id, bar_id
+
+    escopo = relatorios.escopo_de(nome, restaurante_id, bar_id)
+    if not escopo or None in escopo.values():
+        return None
+    versao = relatorios_cache.geracao(**escopo)
+    if versao is None:
+        return None
+    bruto = repr((nome, tuple(sorted(escopo.items())), _parametros(params),
+                  timezone.localdate().isoformat(), versao))
+    return hashlib.sha256(bruto.encode()).hexdigest(), versao, escopo.get('restaurante_id'), escopo.get('bar_id')
+
+
+def _modificado_em(versao):
+    if isinstance(versao, tuple):  # grupo: ((id, geração), ...)
+        versao = max((g for _, g in versao), default=0)
+    return versao // 1_000_000 or None
+
+
+def validador(request, nome, params=None, pagina=True):
+    """Validador da resposta de `nome` para este request, ou None quando não dá para
+       saber se os dados mudaram ou quando a página não pode vir do navegador
+       (mensagens pendentes de exibir)."""
+    params = request.GET if params is None else params
+    if pagina and len(messages.get_messages(request)):
+        return None
+    dados = _dados(nome, params, request.session.get('restaurante_id'), request.session.get('bar_id'))
+    if dados is None:
+        return None
+    chave, versao, restaurante_id, bar_id = dados
+
+    if pagina:
+        janela = int(time.time()) // max(1, relatorios_cache.validade_padrao())
+        csrf = request.COOKIES.get(settings.CSRF_COOKIE_NAME, '')
+        bruto = repr((chave, _parametros(params), request.user.pk, csrf, janela))
+        etag = hashlib.sha256(bruto.encode()).hexdigest()
+    else:
+        etag = chave
+    return Validador(chave, '"%s"' % etag[:32], _modificado_em(versao), restaurante_id, bar_id)
+
+
+def _marcar(resposta, v):
+    resposta['ETag'] = v.etag
+    if v.modificado_em is not None:
+        resposta['Last-Modified'] = http_date(v.modificado_em)
+    resposta['Cache-Control'] = 'private, no-cache'
+    return resposta
+
+
+def _copia_guardada(v):
+    tarefa = TarefaExportacao.guardada(v.chave)
+    if tarefa is None:
+        return None
+    try:
+        arquivo = tarefa.arquivo.open('rb')
+    except OSError:  # arquivo removido do storage: gera de novo
+        return None
+    return FileResponse(arquivo, as_attachment=True, filename=tarefa.nome_arquivo)
+
+
+def _restaurante_de(v):
+    """Restaurante da cópia guardada: o do escopo ou, nos relatórios por bar, o do
+       bar — _tarefa_do_usuario (views) confere o acesso por ele."""
+    if v.restaurante_id or not v.bar_id:
+        return v.restaurante_id
+    return Bar.objects.filter(id=v.bar_id).values_list('restaurante_id', flat=True).first()
+
+
+def _guardar(resposta, v, nome, request, params):
+    """Copia o anexo da resposta para o storage (TarefaExportacao concluída). O
+       FileResponse das planilhas já lê do temporário fechado (PlanilhaStream): ele
+       vai para o storage e volta ao início para o envio, sem segunda cópia; a
+       resposta em memória grava o próprio conteúdo. Se algo falhar, o download
+       segue sem cópia."""
+    _, disposicao = parse_header_parameters(resposta.get('Content-Disposition', ''))
+    nome_arquivo = disposicao.get('filename')
+    if not nome_arquivo:
+        return resposta
+
+    if resposta.streaming:
+        arquivo = getattr(resposta, 'file_to_stream', None)
+        if arquivo is None or not arquivo.seekable():  # gerador: não dá para reler
+            return resposta
+        posicao = arquivo.tell()
+    else:
+        arquivo, posicao = ContentFile(resposta.content), 0
+    try:
+        TarefaExportacao.guardar(
+            arquivo, nome_arquivo, tipo=nome, chave=v.chave, parametros=params.urlencode(),
+            usuario=request.user, restaurante_id=_restaurante_de(v), bar_id=v.bar_id,
+        )
+    except Exception:
+        logger.exception("Falha ao guardar a exportação %s", nome)
+    arquivo.seek(posicao)
+    return resposta
+
+
+def condicional(nome, *, permissao=None, guardar=False, params=None):
+    """Decora a view do relatório (ou da exportação, com guardar=True) `nome`.
+       `permissao`: página exigida (PermissaoPagina) antes de responder 304 ou a
+       cópia guardada — sem ela, a própria view decide (mensagem/redirect).
+       `params(request)`: parâmetros que a view realmente usa, se não forem o GET
+       (ex.: restaurantes do grupo restritos aos do usuário)."""
+    def decorar(view):
+        @wraps(view)
+        def envolvida(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            if permissao and not PermissaoPagina.objects.filter(
+                    user=request.user, nome_pagina=permissao).exists():
+                return view(request, *args, **kwargs)
+
+            dados_params = request.GET if params is None else params(request)
+            v = validador(request, nome, dados_params, pagina=not guardar)
+            if v is None:
+                return view(request, *args, **kwargs)
+
+            resposta = get_conditional_response(request, etag=v.etag, last_modified=v.modificado_em)
+            if resposta is None and guardar:
+                resposta = _copia_guardada(v)
+            if resposta is None:
+                resposta = view(request, *args, **kwargs)
+                if resposta.status_code != 200:
+                    return resposta
+                if guardar:
+                    resposta = _guardar(resposta, v, nome, request, dados_params)
+            return _marcar(resposta, v)
+        return envolvida
+    return decorar
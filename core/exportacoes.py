@@ -0,0 +1,507 @@
+# core/exportacoes.py
+"""Exportações Excel grandes: montagem da planilha e fila de geração em segundo plano.
+
+   Cada exportação se registra com @exportacao e recebe só os parâmetros GET e o
+   escopo (restaurante/bar), nunca o request: a mesma função atende o download
+   direto (views) e o worker (manage.py processar_exportacoes), que grava o arquivo
+   no storage e atualiza o progresso da TarefaExportacao. Pedidos iguais — mesmos
+   filtros já resolvidos e mesma geração dos dados — compartilham a tarefa e o
+   arquivo (ver TarefaExportacao.solicitar)."""
+
+import hashlib
+import logging
+from collections import defaultdict
+from decimal import Decimal
+from typing import NamedTuple
+
+from django.http import QueryDict
+from django.utils import timezone
+from django.utils.text import slugify
+
+from core import relatorios, relatorios_cache
+from core.planilhas import PlanilhaStream, TITULO, SUBTITULO, CABECALHO, CORPO, INTEIRO, DECIMAL
+from .models import PerdaProduto, Restaurante
+
+logger = logging.getLogger(__name__)
+
+
+class Exportacao(NamedTuple):
+    gerar: callable      # (params, restaurante_id, bar_id, progresso) -> (PlanilhaStream, nome do arquivo)
+    filtros: callable    # params -> filtros resolvidos (entram na chave de deduplicação)
+    escopo: str          # 'restaurante' | 'bar' | 'global' | 'grupo' (restaurantes nos parâmetros)
+
+
+_REGISTRO = {}
+
+
+def exportacao(tipo, *, filtros, escopo='restaurante'):
+    def registrar(gerar):
+        _REGISTRO[tipo] = Exportacao(gerar, filtros, escopo)
+        return gerar
+    return registrar
+
+
+def existe(tipo):
+    return tipo in _REGISTRO
+
+
+def exige_restaurante(tipo):
+    return _REGISTRO[tipo].escopo not in ('global', 'grupo')
+
+
+def por_grupo(tipo):
+    """A exportação junta vários restaurantes, listados em `restaurantes` nos parâmetros:
+       quem pede deve restringi-los aos que o usuário acessa (ver views)."""
+    return _REGISTRO[tipo].escopo == 'grupo'
+
+
+def escopo(tipo, restaurante_id=None, bar_id=None):
+    """(restaurante_id, bar_id) que a exportação usa, a partir dos da sessão: só o
+       que entra nos dados, para pedidos de bares diferentes caírem na mesma chave."""
+    definicao = _REGISTRO[tipo]
+    if definicao.escopo in ('global', 'grupo'):
+        return None, None
+    if definicao.escopo == 'restaurante':
+        return restaurante_id, None
+    return restaurante_id, bar_id
+
+
+def gerar(tipo, params, *, restaurante_id=None, bar_id=None, progresso=None):
+    """Monta a planilha. `progresso(pct)`, se informado, é chamado ao longo da geração."""
+    return _REGISTRO[tipo].gerar(params, restaurante_id=restaurante_id, bar_id=bar_id, progresso=progresso)
+
+
+def geracao(tipo, params, *, restaurante_id=None):
+    """Geração dos dados que a exportação lê: do restaurante ou, no grupo, de cada um
+       ((id, geração), ...). None na exportação global, que não tem geração."""
+    definicao = _REGISTRO[tipo]
+    if definicao.escopo == 'grupo':
+        return relatorios_cache.geracoes(relatorios.filtros_consolidado_grupo(params)['restaurante_ids'])
+    if definicao.escopo == 'global':
+        return None
+    return relatorios_cache.geracao(restaurante_id)
+
+
+def chave(tipo, params, *, restaurante_id=None, bar_id=None, versao=None):
+    """Identidade do arquivo: tipo, escopo, filtros resolvidos (datas padrão incluídas)
+       e geração dos dados do restaurante (de cada um, no grupo) — gravações novas mudam a chave.
+       `versao`: a geração, se quem chama já a leu (ver core/condicional.py)."""
+    definicao = _REGISTRO[tipo]
+    restaurante_id, bar_id = escopo(tipo, restaurante_id, bar_id)
+    filtros = definicao.filtros(params)
+    if versao is None:
+        versao = geracao(tipo, params, restaurante_id=restaurante_id)
+    bruto = repr((tipo, restaurante_id, bar_id, relatorios_cache.normalizar_filtros(filtros), versao))
+    return hashlib.sha256(bruto.encode()).hexdigest()
+
+
+def processar(tarefa):
+    """Gera o arquivo da tarefa (já reservada pelo worker) e grava no storage."""
+    try:
+        planilha, nome_arquivo = gerar(
+            tarefa.tipo, QueryDict(tarefa.parametros),
+            restaurante_id=tarefa.restaurante_id, bar_id=tarefa.bar_id,
+            progresso=tarefa.atualizar_progresso,
+        )
+        arquivo = planilha.fechar()
+        try:
+            tarefa.concluir(arquivo, nome_arquivo)
+        finally:
+            arquivo.close()
+    except Exception as exc:
+        logger.exception("Falha na exportação %s (tarefa %s)", tarefa.tipo, tarefa.pk)
+        tarefa.falhar(exc)
+
+
+def _com_progresso(itens, total, progresso, inicio=5, fim=95):
+    """Repassa `itens` chamando `progresso(pct)` a cada ~1% de `total`."""
+    if progresso is None or not total:
+        yield from itens
+        return
+    passo = max(1, total // 100)
+    for i, item in enumerate(itens, 1):
+        if i % passo == 0:
+            progresso(inicio + (fim - inicio) * i // total)
+        yield item
+
+
+# ---------------------------------------------------------------- consolidado do período
+
+def _texto_intervalo(ini_date, ini_time, fim_date, fim_time, incluir_central):
+    return (f"Intervalo: {ini_date.strftime('%d/%m/%Y')} {ini_time.strftime('%H:%M')} "
+            f"→ {fim_date.strftime('%d/%m/%Y')} {fim_time.strftime('%H:%M')} "
+            f"| Incluir central: {'Sim' if incluir_central else 'Não'}")
+
+
+def _tabela_periodo(planilha, ws, linhas, totais, congelar=False):
+    """Produto × Início/Entradas/Final/Saída (G e D), com cabeçalho em duas linhas e total."""
+    cab = {**CABECALHO, 'bg_color': '#F3F4F6'}
+    borda = {**CORPO, 'border_color': '#DDDDDD'}
+    g_fmt = {**borda, 'align': 'right', 'num_format': '0'}
+    d_fmt = {**borda, 'align': 'right', 'num_format': '#,##0.00'}
+
+    # Cabeçalhos em duas linhas (Produto ocupa as duas; cada bloco tem G/D)
+    fmt_cab = planilha.formato(cab)
+    linha = ws.linha
+    for col, texto in ((1, "Início"), (3, "Entradas"), (5, "Final"), (7, "Saída")):
+        ws.ws.merge_range(linha, col, linha, col + 1, texto, fmt_cab)
+    ws.ws.merge_range(linha, 0, linha + 1, 0, "Produto", fmt_cab)
+    ws.pular()
+    ws.escrever([None, "G", "D", "G", "D", "G", "D", "G", "D"], [None] + [cab] * 8)
+    if congelar:
+        ws.congelar()
+
+    # Dados
+    campos = relatorios.CAMPOS_PERIODO
+    formatos = [{**borda, 'valign': 'vcenter'}] + [g_fmt, d_fmt] * 4
+    for l in linhas:
+        ws.escrever([l['produto'].nome] + [float(l[c]) for c in campos], formatos)
+
+    # Totais
+    if linhas:
+        ws.escrever(["Total"] + [float(totais[c]) for c in campos],
+                    [{**f, 'bold': True} for f in formatos])
+
+
+def _filtros_consolidado_periodo(params):
+    *_, ini_dt, fim_dt = relatorios.intervalo(params)
+    return {**relatorios.ler_filtros('consolidado_periodo', params), 'ini_dt': ini_dt, 'fim_dt': fim_dt}
+
+
+@exportacao('consolidado_periodo', filtros=_filtros_consolidado_periodo)
+def consolidado_periodo(params, restaurante_id=None, bar_id=None, progresso=None):
+    restaurante = Restaurante.objects.get(id=restaurante_id)
+    filtros = relatorios.ler_filtros('consolidado_periodo', params)
+    incluir_central = filtros['incluir_central']
+
+    # Intervalo com horas e dados: os mesmos da página
+    ini_date, fim_date, ini_time, fim_time, ini_dt, fim_dt = relatorios.intervalo(params)
+    if progresso:
+        progresso(5)
+    dados = relatorios.obter('consolidado_periodo', restaurante_id=restaurante.id,
+                             ini_dt=ini_dt, fim_dt=fim_dt, **filtros)
+    linhas, totais = dados.linhas, dados.totais
+    if progresso:
+        progresso(80)
+
+    planilha = PlanilhaStream()
+    ws = planilha.aba("Consolidado")
+    ws.titulo(f"Consolidado do Período — {restaurante.nome}", 9)
+    ws.titulo(_texto_intervalo(ini_date, ini_time, fim_date, fim_time, incluir_central), 9, {'font_size': 11})
+    _tabela_periodo(planilha, ws, linhas, totais, congelar=True)
+
+    nome_arquivo = (
+        f"consolidado_{ini_date.strftime('%Y%m%d')}_{ini_time.strftime('%H%M')}"
+        f"__{fim_date.strftime('%Y%m%d')}_{fim_time.strftime('%H%M')}.xlsx"
+    )
+    return planilha, nome_arquivo
+
+
+# ---------------------------------------------------------------- consolidado do grupo
+
+def _filtros_consolidado_grupo(params):
+    *_, ini_dt, fim_dt = relatorios.intervalo(params)
+    return {**relatorios.filtros_consolidado_grupo(params), 'ini_dt': ini_dt, 'fim_dt': fim_dt}
+
+
+@exportacao('consolidado_grupo', filtros=_filtros_consolidado_grupo, escopo='grupo')
+def consolidado_grupo(params, restaurante_id=None, bar_id=None, progresso=None):
+    filtros = relatorios.filtros_consolidado_grupo(params)
+    ini_date, fim_date, ini_time, fim_time, ini_dt, fim_dt = relatorios.intervalo(params)
+    if progresso:
+        progresso(5)
+    dados = relatorios.consolidado_grupo(ini_dt=ini_dt, fim_dt=fim_dt, **filtros)
+    if progresso:
+        progresso(80)
+
+    planilha = PlanilhaStream()
+    intervalo_txt = _texto_intervalo(ini_date, ini_time, fim_date, fim_time, filtros['incluir_central'])
+
+    # Soma de todos os restaurantes
+    ws = planilha.aba("Consolidado")
+    ws.titulo(f"Consolidado do Grupo — {len(dados.restaurantes)} restaurante(s)", 9)
+    ws.titulo(intervalo_txt, 9, {'font_size': 11})
+    ws.titulo("Restaurantes: " + (", ".join(r.nome for r in dados.restaurantes) or "nenhum"), 9, SUBTITULO)
+    _tabela_periodo(planilha, ws, dados.linhas, dados.totais, congelar=True)
+
+    # Um bloco por restaurante, na mesma ordem de produtos
+    ws_r = planilha.aba("Por Restaurante")
+    for r in dados.restaurantes:
+        ws_r.titulo(r.nome, 9)
+        linhas = [l['por_restaurante'][r.id] for l in dados.linhas if r.id in l['por_restaurante']]
+        _tabela_periodo(planilha, ws_r, linhas, dados.totais_por_restaurante[r.id])
+        ws_r.pular()
+
+    nome_arquivo = (
+        f"consolidado_grupo_{ini_date.strftime('%Y%m%d')}_{ini_time.strftime('%H%M')}"
+        f"__{fim_date.strftime('%Y%m%d')}_{fim_time.strftime('%H%M')}.xlsx"
+    )
+    return planilha, nome_arquivo
+
+
+# ---------------------------------------------------------------- eventos
+
+@exportacao('eventos', filtros=lambda params: relatorios.ler_filtros('eventos', params), escopo='global')
+def relatorio_eventos(params, restaurante_id=None, bar_id=None, progresso=None):
+    # ✅ mesmos filtros da tela (DATA DO EVENTO)
+    filtros = relatorios.ler_filtros('eventos', params)
+    data_inicio, data_fim = filtros['data_inicio'], filtros['data_fim']
+    nome_evento = filtros['nome_evento']
+    restaurante_filtro_id = filtros['restaurante']
+
+    # Eventos da tela se ela acabou de montá-los; senão cursor no servidor, um evento por vez
+    dados = relatorios.em_cache('eventos', **filtros)
+    if dados is not None:
+        eventos, total_eventos = dados.eventos, len(dados.eventos)
+    else:
+        qs = relatorios.eventos_queryset(**filtros)
+        total_eventos = qs.count() if progresso else 0
+        eventos = (relatorios.resumo_evento(ev) for ev in qs.iterator(chunk_size=200))
+    eventos = _com_progresso(eventos, total_eventos, progresso)
+
+    # Texto do filtro
+    filtro_txt = f"Período: {data_inicio.strftime('%d/%m/%Y')} a {data_fim.strftime('%d/%m/%Y')}"
+    if nome_evento:
+        filtro_txt += f" | Evento contém: {nome_evento}"
+    if restaurante_filtro_id:
+        try:
+            rnome = Restaurante.objects.only('nome').get(id=restaurante_filtro_id).nome
+            filtro_txt += f" | Restaurante: {rnome}"
+        except Restaurante.DoesNotExist:
+            filtro_txt += " | Restaurante: (inválido)"
+
+    # === Workbook em streaming: abas na ordem final; as de evento são escritas durante a
+    # passada e os consolidados (que dependem de todos os eventos) no fim
+    planilha = PlanilhaStream()
+    ws1 = planilha.aba("Consolidado Bebidas")
+    wsA = planilha.aba("Consolidado Alimentos")
+    ws2 = planilha.aba("Detalhado")
+    ws3 = planilha.aba("Por Evento")
+    wsL = planilha.aba("Eventos (lista)")
+
+    # ---- cabeçalhos das abas escritas durante a passada
+    ws2.titulo("Relatório de Eventos — Detalhado (Bebidas e Alimentos)", 12)
+    ws2.titulo(filtro_txt, 12, SUBTITULO)
+    ws2.pular()
+    ws2.escrever([
+        "Evento", "Restaurante", "Data", "Pessoas", "Horas", "Tipo", "Item",
+        "Garrafas", "Doses", "Doses (ML)", "Quantidade", "Unidade"
+    ], CABECALHO)
+    ws2.congelar()
+    fmt_detalhe = [CORPO, CORPO, CORPO, INTEIRO, DECIMAL, CORPO, CORPO, INTEIRO, DECIMAL, DECIMAL, DECIMAL, CORPO]
+
+    col_count = 8
+    ws3.titulo("Relatório de Eventos — Por Evento", col_count)
+    ws3.titulo(filtro_txt, col_count, SUBTITULO)
+    ws3.pular()
+
+    wsL.titulo("Relatório de Eventos — Lista", 12)
+    wsL.titulo(filtro_txt, 12, SUBTITULO)
+    wsL.pular()
+    wsL.escrever([
+        "Evento", "Restaurante", "Data", "Status", "Baixado?",
+        "Responsável", "Pessoas", "Horas",
+        "Garrafas (tot)", "Doses (tot)", "ML (tot)", "Alimentos (qtd tot)"
+    ], CABECALHO)
+    wsL.congelar()
+    fmt_lista = [CORPO] * 6 + [INTEIRO, DECIMAL, INTEIRO, DECIMAL, DECIMAL, DECIMAL]
+
+    def _horas(valor):
+        try:
+            return float(valor) if valor is not None else None
+        except (TypeError, ValueError):
+            return None
+
+    consolidado = relatorios.ConsolidadoEventos()
+    total_eventos = 0
+
+    for ev in eventos:
+        total_eventos += 1
+        consolidado.somar(ev)
+        horas = _horas(ev['horas'])
+        data_txt = ev['data'].strftime("%d/%m/%Y")  # ✅ data_evento (somente data)
+        base = [ev['nome'], ev['restaurante_nome'] or "-", data_txt, ev['pessoas'], horas]
+
+        # ---- Detalhado
+        for it in ev['itens_bebidas']:
+            ws2.escrever(base + ['Bebida', it['produto'], it['garrafas'], it['doses'], it['ml'], None, None],
+                         fmt_detalhe)
+        for it in ev['itens_alimentos']:
+            ws2.escrever(base + ['Alimento', it['alimento'], None, None, None, it['quantidade'], it['unidade']],
+                         fmt_detalhe)
+
+        # ---- Por Evento
+        cab = f"Evento: {ev['nome']}  |  Data: {data_txt}"
+        if ev['responsavel']:
+            cab += f"  |  Resp.: {ev['responsavel']}"
+        if ev.get('pessoas') is not None:
+            cab += f"  |  Pessoas: {ev['pessoas']}"
+        if ev.get('horas') is not None:
+            cab += f"  |  Horas: {horas:.2f}" if horas is not None else "  |  Horas: -"
+        if ev.get('restaurante_nome'):
+            cab += f"  |  Restaurante: {ev['restaurante_nome']}"
+        ws3.titulo(cab, col_count, {'bold': True, 'font_size': 12})
+        ws3.pular()
+        ws3.escrever(["🍹 Bebidas", "", "", "", "", "", "", ""], CABECALHO)
+        ws3.escrever(["Produto", "Garrafas", "Doses", "Doses (ML)", "", "", "", ""], CABECALHO)
+        for it in ev['itens_bebidas']:
+            ws3.escrever([it['produto'], it['garrafas'], it['doses'], it['ml']], [CORPO, INTEIRO, DECIMAL, DECIMAL])
+        ws3.escrever(["Subtotal (bebidas)", ev['totais_bebidas']['garrafas'], ev['totais_bebidas']['doses'],
+                      ev['totais_bebidas']['ml']],
+                     [{**CORPO, 'bold': True}, INTEIRO, DECIMAL, DECIMAL])
+        ws3.pular()
+        ws3.escrever(["🍽️ Alimentos", "", "", "", "", "", "", ""], CABECALHO)
+        ws3.escrever(["Alimento", "Quantidade", "Unidade", "", "", "", "", ""], CABECALHO)
+        if ev['itens_alimentos']:
+            for it in ev['itens_alimentos']:
+                ws3.escrever([it['alimento'], it['quantidade'], it['unidade']], [CORPO, DECIMAL, CORPO])
+        else:
+            ws3.escrever(["Sem lançamentos de alimentos."], {'italic': True})
+        ws3.pular(2)
+
+        # ---- Eventos (lista)
+        wsL.escrever([
+            ev['nome'], ev['restaurante_nome'] or "-", data_txt, ev['status'],
+            "Sim" if ev['baixado'] else "Não",
+            str(ev['responsavel']) if ev['responsavel'] else "-",
+            ev['pessoas'], horas,
+            ev['totais_bebidas']['garrafas'], ev['totais_bebidas']['doses'],
+            ev['totais_bebidas']['ml'], ev['total_qtd_alimentos'],
+        ], fmt_lista)
+
+    wsL.pular()
+    wsL.escrever(["Total de eventos", total_eventos], [{'bold': True}, {'num_format': '0'}])
+
+    # ===================== Consolidado Bebidas =====================
+    ws1.titulo("Relatório de Eventos — Consolidado de Bebidas", 4)
+    ws1.titulo(filtro_txt, 4, SUBTITULO)
+    ws1.pular()
+    ws1.escrever(["Produto", "Garrafas", "Doses", "Doses (ML)"], CABECALHO)
+    ws1.congelar()
+    tot_g, tot_d, tot_ml = 0, Decimal('0'), Decimal('0')
+    for prod, d in consolidado.ordenado(consolidado.bebidas).items():
+        ws1.escrever([prod, d['garrafas'], d['doses'], d['ml']], [CORPO, INTEIRO, DECIMAL, DECIMAL])
+        tot_g += d['garrafas']; tot_d += d['doses']; tot_ml += d['ml']
+    ws1.escrever(["Total", tot_g, tot_d, tot_ml], [{**CORPO, 'bold': True}, INTEIRO, DECIMAL, DECIMAL])
+
+    # ===================== Consolidado Alimentos =====================
+    wsA.titulo("Relatório de Eventos — Consolidado de Alimentos", 3)
+    wsA.titulo(filtro_txt, 3, SUBTITULO)
+    wsA.pular()
+    wsA.escrever(["Alimento", "Quantidade", "Unidade"], CABECALHO)
+    wsA.congelar()
+    for ali, d in consolidado.ordenado(consolidado.alimentos).items():
+        wsA.escrever([ali, d['quantidade'], d['unidade']], [CORPO, DECIMAL, CORPO])
+
+    return planilha, f"relatorio_eventos_{slugify(data_inicio)}_a_{slugify(data_fim)}.xlsx"
+
+
+# ---------------------------------------------------------------- perdas
+
+@exportacao('perdas', filtros=lambda params: relatorios.ler_filtros('perdas', params))
+def relatorio_perdas(params, restaurante_id=None, bar_id=None, progresso=None):
+    # ===== filtros: os mesmos do relatório =====
+    filtros = relatorios.ler_filtros('perdas', params)
+    bar_id, q, motivo = filtros['bar_id'], filtros['produto'], filtros['motivo']
+    data_inicio, data_fim = filtros['data_inicio'], filtros['data_fim']
+
+    # Cursor no servidor, em ordem cronológica (a tela só guarda os consolidados)
+    qs = relatorios.perdas_queryset(restaurante_id, **filtros)
+    total_itens = qs.count() if progresso else 0
+    itens = qs.order_by('data_registro', 'id').iterator(chunk_size=2000)
+    itens = _com_progresso(itens, total_itens, progresso)
+
+    # map de rótulo do motivo
+    motivos_map = dict(PerdaProduto.MOTIVOS)
+
+    # ===== workbook em streaming: abas criadas na ordem final, detalhe escrito primeiro =====
+    planilha = PlanilhaStream()
+    cab = {**CABECALHO, 'bg_color': '#F2F2F2', 'border_color': '#DDDDDD'}
+    corpo = {**CORPO, 'border_color': '#DDDDDD'}
+    num = {**corpo, 'align': 'right', 'num_format': '0'}
+    total = {**num, 'bold': True, 'bg_color': '#EFEFEF'}
+    ws = planilha.aba("Resumo", largura_max=60)
+    ws_m = planilha.aba("Por Motivo", largura_max=60)
+    ws_p = planilha.aba("Por Produto", largura_max=60)
+    ws_b = planilha.aba("Por Bar", largura_max=60)
+    ws_d = planilha.aba("Detalhe", largura_max=60)
+
+    # --- Detalhe (e agregações na mesma passada) ---
+    ws_d.escrever(["Data", "Hora", "Restaurante", "Bar", "Produto", "Garrafas", "Doses", "Motivo", "Usuário", "Observação"], cab)
+
+    por_produto = defaultdict(lambda: {"garrafas": 0, "doses": 0})
+    por_bar = defaultdict(lambda: {"garrafas": 0, "doses": 0})
+    por_motivo = defaultdict(lambda: {"registros": 0, "garrafas": 0, "doses": 0})
+    total_registros = total_garrafas = total_doses = 0
+    formatos_detalhe = [corpo] * 5 + [num, num] + [corpo] * 3
+
+    for p in itens:
+        g = int(p.garrafas or 0)
+        d = int(p.doses or 0)
+        total_registros += 1
+        total_garrafas += g
+        total_doses += d
+
+        data_local = timezone.localtime(p.data_registro)
+        prod_label = f"[{p.produto.codigo}] {p.produto.nome}" if p.produto.codigo else p.produto.nome
+        por_produto[prod_label]["garrafas"] += g
+        por_produto[prod_label]["doses"] += d
+        por_bar[p.bar.nome]["garrafas"] += g
+        por_bar[p.bar.nome]["doses"] += d
+        por_motivo[p.motivo]["registros"] += 1
+        por_motivo[p.motivo]["garrafas"] += g
+        por_motivo[p.motivo]["doses"] += d
+
+        ws_d.escrever([
+            data_local.date().strftime("%d/%m/%Y"),
+            data_local.time().strftime("%H:%M"),
+            getattr(p.restaurante, "nome", ""),
+            p.bar.nome,
+            prod_label,
+            g,
+            d,
+            motivos_map.get(p.motivo, p.motivo),
+            getattr(p.usuario, "username", ""),
+            p.observacao or "",
+        ], formatos_detalhe)
+
+    # --- Resumo ---
+    ws.titulo(f"Relatório de Perdas — {data_inicio.strftime('%d/%m/%Y')} a {data_fim.strftime('%d/%m/%Y')}",
+              4, {**TITULO, 'align': 'center'})
+
+    # filtros ativos
+    filtros_txt = []
+    if restaurante_id:
+        filtros_txt.append(f"Restaurante ID: {restaurante_id}")
+    if bar_id:
+        filtros_txt.append(f"Bar ID: {bar_id}")
+    if q:
+        filtros_txt.append(f"Produto: {q}")
+    if motivo:
+        filtros_txt.append(f"Motivo: {motivos_map.get(motivo, motivo)}")
+    if filtros['somente_nao_baixados']:
+        filtros_txt.append("Somente não baixadas")
+
+    ws.pular()
+    metrica = [{'bold': True}, {'align': 'right'}]
+    ws.escrever(["Filtros aplicados", (", ".join(filtros_txt) or "Nenhum")], metrica)
+    ws.escrever(["Total de registros", total_registros], metrica)
+    ws.escrever(["Total de garrafas", total_garrafas], metrica)
+    ws.escrever(["Total de doses", total_doses], metrica)
+
+    # --- Por Motivo ---
+    ws_m.escrever(["Motivo", "Registros", "Garrafas", "Doses"], cab)
+    for cod, d in sorted(por_motivo.items(), key=lambda kv: motivos_map.get(kv[0], kv[0])):
+        ws_m.escrever([motivos_map.get(cod, cod), d["registros"], d["garrafas"], d["doses"]], [corpo, num, num, num])
+    if por_motivo:
+        ws_m.escrever(["TOTAL", total_registros, total_garrafas, total_doses], [{**corpo, 'bold': True, 'bg_color': '#EFEFEF'}, total, total, total])
+
+    # --- Por Produto / Por Bar ---
+    for aba, titulo_col, agregado in ((ws_p, "Produto", por_produto), (ws_b, "Bar", por_bar)):
+        aba.escrever([titulo_col, "Garrafas", "Doses"], cab)
+        for nome, d in sorted(agregado.items(), key=lambda kv: kv[0].lower()):
+            aba.escrever([nome, d["garrafas"], d["doses"]], [corpo, num, num])
+        if agregado:
+            aba.escrever(["TOTAL", total_garrafas, total_doses], [{**corpo, 'bold': True, 'bg_color': '#EFEFEF'}, total, total])
+
+    return planilha, f"relatorio_perdas_{data_inicio:%Y-%m-%d}_a_{data_fim:%Y-%m-%d}.xlsx"
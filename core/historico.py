@@ -0,0 +1,101 @@
+# core/historico.py
+"""Paginação dos históricos (contagens, requisições, transferências, entradas) por
+   dias operacionais, com cursor.
+
+   Uma página são os últimos N dias operacionais COM movimento (o dia D vai de
+   HORA_INICIO de D até HORA_INICIO de D+1, no fuso local), anteriores ao cursor.
+   Custa sempre duas consultas, qualquer que seja o tamanho do histórico:
+
+   1. os dias: uma CTE recursiva que salta de dia em dia pelo max(data) < limite —
+      cada passo é uma descida no índice (filtros, data), sem varrer o histórico;
+   2. os registros desses dias, com select_related e o dia operacional calculado
+      no banco (agrupamento no fuso local, não em UTC).
+
+   O cursor é o dia operacional mais antigo da página (YYYY-MM-DD)."""
+
+from collections import OrderedDict
+from datetime import timedelta
+from typing import NamedTuple, Optional
+
+from django.db import connection
+from django.db.models import DateTimeField, ExpressionWrapper, F, Value
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from core import janelas
+from .models import FechamentoTurno
+
+DIAS_POR_PAGINA = 10
+
+
+class PaginaHistorico(NamedTuple):
+    dias: dict                   # {dia operacional: [registros]}, mais recentes primeiro
+    proximo: Optional[str]       # cursor para os dias anteriores (None = não há mais)
+
+
+def dia_operacional(campo, hora_inicio=FechamentoTurno.HORA_INICIO):
+    """Expressão do dia operacional de `campo` (data/hora) no fuso local."""
+    return TruncDate(ExpressionWrapper(F(campo) - Value(timedelta(hours=hora_inicio)),
+                                       output_field=DateTimeField()))
+
+
+def _ler_cursor(cursor, hora_inicio):
+    """Início do dia operacional do cursor (os dias da página são anteriores a ele)."""
+    dia = janelas.de_texto(cursor)
+    return janelas.dia_operacional(dia, hora_inicio).de if dia else None
+
+
+def _inicios_dos_dias(qs, campo, limite, quantos, hora_inicio):
+    """Início (aware) de até `quantos` dias operacionais com registros antes de `limite`,
+       do mais recente para o mais antigo — um passo de índice por dia."""
+    base_sql, base_params = qs.order_by().values(momento=F(campo)).query.sql_with_params()
+    # início do dia operacional de um instante, no fuso local
+    inicio_dia = ("((date_trunc('day', ({m} AT TIME ZONE %s) - %s * interval '1 hour')"
+                  " + %s * interval '1 hour') AT TIME ZONE %s)")
+    tz = timezone.get_current_timezone_name()
+    inicio_params = [tz, hora_inicio, hora_inicio, tz]
+    sql = f"""
+        WITH RECURSIVE base AS NOT MATERIALIZED ({base_sql}),
+        dias(n, inicio) AS (
+            SELECT 1, (SELECT {inicio_dia.format(m='max(b.momento)')} FROM base b WHERE b.momento < %s)
+            UNION ALL
+            SELECT d.n + 1, (SELECT {inicio_dia.format(m='max(b.momento)')} FROM base b WHERE b.momento < d.inicio)
+              FROM dias d
+             WHERE d.inicio IS NOT NULL AND d.n < %s
+        )
+        SELECT inicio FROM dias WHERE inicio IS NOT NULL ORDER BY n
+    """
+    params = [*base_params, *inicio_params, limite, *inicio_params, quantos]
+    with connection.cursor() as cur:
+        cur.execute(sql, params)
+        return [linha[0] for linha in cur.fetchall()]
+
+
+def paginar(qs, campo, *, cursor=None, janela=None, dias=DIAS_POR_PAGINA,
+            hora_inicio=FechamentoTurno.HORA_INICIO):
+    """Últimos `dias` dias operacionais de `qs` anteriores ao `cursor`, dentro da
+       `janela` (janelas.Janela) opcional. `qs` já vem filtrado e com select_related do que
+       a página mostra; a ordem dentro do dia é `campo` decrescente."""
+    limite = _ler_cursor(cursor, hora_inicio)
+    if janela is not None:
+        de, ate = janela
+        qs = qs.filter(**{f'{campo}__gte': de})
+        limite = ate if limite is None else min(limite, ate)
+    if limite is None:
+        limite = timezone.now() + timedelta(days=1)
+
+    inicios = _inicios_dos_dias(qs, campo, limite, dias + 1, hora_inicio)
+    if not inicios:
+        return PaginaHistorico(OrderedDict(), None)
+    mais_antigo = inicios[min(dias, len(inicios)) - 1]
+
+    registros = (qs
+                 .filter(**{f'{campo}__gte': mais_antigo, f'{campo}__lt': limite})
+                 .annotate(dia_operacional=dia_operacional(campo, hora_inicio))
+                 .order_by(f'-{campo}', '-pk'))
+    agrupado = OrderedDict()
+    for registro in registros:
+        agrupado.setdefault(registro.dia_operacional, []).append(registro)
+
+    proximo = min(agrupado).isoformat() if len(inicios) > dias else None
+    return PaginaHistorico(agrupado, proximo)
@@ -0,0 +1,69 @@
+# core/janelas.py
+"""Janelas de data/hora para filtros: [de, até) aware no fuso local.
+
+   Filtrar `campo >= de AND campo < até` usa o índice da coluna; `__date`,
+   `__month`, `__year` envolvem a coluna numa função (conversão de fuso +
+   extração) e o PostgreSQL cai em varredura sequencial. Mês, dia, intervalo de
+   dias e dia operacional viram todos a mesma coisa aqui:
+
+       qs.filter(**janelas.mes(10, 2025).filtro('data_solicitacao'))"""
+
+from datetime import date, datetime, time, timedelta
+from typing import NamedTuple, Optional
+
+from django.utils import timezone
+
+
+class Janela(NamedTuple):
+    de: datetime      # inclusivo
+    ate: datetime     # exclusivo
+
+    def filtro(self, campo):
+        """kwargs de .filter() para `campo` dentro da janela."""
+        return {f'{campo}__gte': self.de, f'{campo}__lt': self.ate}
+
+    def contem(self, momento):
+        return self.de <= momento < self.ate
+
+
+def _inicio(dia, hora=time.min):
+    return timezone.make_aware(datetime.combine(dia, hora))
+
+
+def dias(inicio, fim):
+    """Do início do dia `inicio` ao início do dia seguinte a `fim` (ambos inclusivos)."""
+    return Janela(_inicio(inicio), _inicio(fim + timedelta(days=1)))
+
+
+def dia(d):
+    """O dia civil `d` inteiro."""
+    return dias(d, d)
+
+
+def dia_operacional(d, hora_inicio):
+    """Dia operacional `d`: de `hora_inicio` de d até `hora_inicio` de d+1."""
+    return Janela(_inicio(d, time(hora_inicio, 0)), _inicio(d + timedelta(days=1), time(hora_inicio, 0)))
+
+
+def mes(mes, ano):
+    """O mês inteiro; só `ano` = o ano inteiro. None se faltar o ano ou for inválido
+       (mês sem ano não é uma janela: ver saida_estoque_queryset)."""
+    try:
+        ano = int(ano)
+        mes = int(mes) if mes not in (None, '') else None
+        inicio = date(ano, mes or 1, 1)
+        if mes is None or mes == 12:
+            fim = date(ano + 1, 1, 1)
+        else:
+            fim = date(ano, mes + 1, 1)
+    except (TypeError, ValueError):
+        return None
+    return Janela(_inicio(inicio), _inicio(fim))
+
+
+def de_texto(valor) -> Optional[date]:
+    """YYYY-MM-DD -> date (None se vazio/inválido)."""
+    try:
+        return datetime.strptime(valor or '', '%Y-%m-%d').date()
+    except ValueError:
+        return None
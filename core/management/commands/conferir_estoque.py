@@ -0,0 +1,46 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core.models import EstoqueBar, MovimentoEstoque
+
+
+class Command(BaseCommand):
+    help = (
+        "Confere o saldo de EstoqueBar com o livro de movimentos (último checkpoint + "
+        "movimentos posteriores) e lista os pares bar x produto que divergem. "
+        "Falha se houver divergência."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bar', type=int, action='append', dest='bares',
+                            help="Restringe a um bar (pode repetir).")
+
+    def handle(self, *args, **opts):
+        bares = opts.get('bares')
+        agora = timezone.now()
+
+        estoque = EstoqueBar.objects.all()
+        if bares:
+            estoque = estoque.filter(bar_id__in=bares)
+        atuais = {
+            (b, p): (g, d)
+            for b, p, g, d in estoque.values_list('bar_id', 'produto_id', 'quantidade_garrafas', 'quantidade_doses')
+        }
+        livro = MovimentoEstoque.saldos_em(agora, bar_ids=bares)
+
+        zero = (Decimal('0'), Decimal('0'))
+        divergentes = []
+        for par in sorted(atuais.keys() | livro.keys()):
+            tabela, razao = atuais.get(par, zero), livro.get(par, zero)
+            if tabela != razao:
+                divergentes.append(par)
+                self.stdout.write(self.style.ERROR(
+                    f"  bar {par[0]} / produto {par[1]}: estoque {tabela[0]} g {tabela[1]} d "
+                    f"| livro {razao[0]} g {razao[1]} d"
+                ))
+
+        if divergentes:
+            raise CommandError(f"{len(divergentes)} par(es) com saldo diferente do livro de movimentos.")
+        self.stdout.write(self.style.SUCCESS(f"{len(atuais)} saldo(s) conferem com o livro de movimentos."))
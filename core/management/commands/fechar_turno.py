@@ -0,0 +1,49 @@
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import FechamentoTurno
+
+
+class Command(BaseCommand):
+    help = (
+        "Fecha o dia operacional (contagens congeladas por bar x produto no fim do turno). "
+        "Agende logo após o início do turno (ex.: cron diário às 19:05)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dia',
+            help="Dia operacional (YYYY-MM-DD). Padrão: último turno já encerrado.",
+        )
+        parser.add_argument(
+            '--ate',
+            help="Fecha de --dia até esta data (YYYY-MM-DD), inclusive. Útil para carga retroativa.",
+        )
+        parser.add_argument(
+            '--completo', action='store_true',
+            help="Refaz --dia a partir do histórico inteiro de contagens (e não do fechamento "
+                 "anterior); os dias seguintes até --ate partem dele. Use depois de editar ou "
+                 "apagar contagens já fechadas.",
+        )
+
+    def _data(self, valor):
+        try:
+            return datetime.strptime(valor, '%Y-%m-%d').date()
+        except ValueError:
+            raise CommandError("Use o formato YYYY-MM-DD.")
+
+    def handle(self, *args, **opts):
+        dia = self._data(opts['dia']) if opts.get('dia') else FechamentoTurno.ultimo_dia_encerrado()
+        ate = self._data(opts['ate']) if opts.get('ate') else dia
+        if ate < dia:
+            raise CommandError("--ate deve ser maior ou igual a --dia.")
+        if ate > FechamentoTurno.ultimo_dia_encerrado():
+            raise CommandError("Não é possível fechar um dia operacional que ainda não terminou.")
+
+        completo = opts['completo']
+        while dia <= ate:
+            _, itens = FechamentoTurno.fechar(dia, completo=completo)
+            self.stdout.write(self.style.SUCCESS(f"{dia:%d/%m/%Y}: {itens} item(ns) congelado(s)."))
+            completo = False  # os próximos partem do dia recém-refeito
+            dia += timedelta(days=1)
@@ -0,0 +1,32 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core.models import CheckpointEstoque
+
+
+class Command(BaseCommand):
+    help = (
+        "Gera checkpoints de saldo (bar x produto) a partir do livro de movimentos. "
+        "Agende periodicamente (ex.: cron diário) para manter o saldo histórico barato."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--momento',
+            help="Instante de referência (YYYY-MM-DD HH:MM, horário local). Padrão: agora.",
+        )
+
+    def handle(self, *args, **opts):
+        momento = timezone.now()
+        if opts.get('momento'):
+            try:
+                momento = timezone.make_aware(datetime.strptime(opts['momento'], '%Y-%m-%d %H:%M'))
+            except ValueError:
+                raise CommandError("Use o formato YYYY-MM-DD HH:MM.")
+
+        criados = CheckpointEstoque.gerar(momento)
+        self.stdout.write(self.style.SUCCESS(
+            f"{criados} checkpoint(s) gerado(s) em {timezone.localtime(momento):%d/%m/%Y %H:%M}."
+        ))
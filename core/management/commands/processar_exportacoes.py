@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core import exportacoes
+from core.models import TarefaExportacao
+
+
+class Command(BaseCommand):
+    help = (
+        "Worker das exportações em segundo plano: gera os arquivos pedidos pela tela "
+        "(TarefaExportacao) e os grava no storage. Deixe rodando como serviço ou use "
+        "--uma-vez num cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--uma-vez', action='store_true',
+            help="Processa o que estiver na fila e sai.",
+        )
+        parser.add_argument(
+            '--intervalo', type=float, default=2.0,
+            help="Segundos entre consultas à fila quando ela está vazia (padrão: 2).",
+        )
+        parser.add_argument(
+            '--manter-horas', type=int, default=None,
+            help="Apaga tarefas encerradas (e arquivos) há mais de N horas "
+                 "(padrão: EXPORTACAO_MANTER_HORAS, 24).",
+        )
+
+    def handle(self, *args, **opts):
+        removidas = TarefaExportacao.limpar_antigas(opts['manter_horas'])
+        if removidas:
+            self.stdout.write(f"{removidas} exportação(ões) antiga(s) removida(s).")
+
+        while True:
+            tarefa = TarefaExportacao.reservar()
+            if tarefa is None:
+                if opts['uma_vez']:
+                    return
+                TarefaExportacao.limpar_se_preciso()
+                time.sleep(opts['intervalo'])
+                continue
+
+            inicio = time.monotonic()
+            exportacoes.processar(tarefa)
+            duracao = time.monotonic() - inicio
+            if tarefa.status == 'CONCLUIDA':
+                self.stdout.write(self.style.SUCCESS(
+                    f"#{tarefa.pk} {tarefa.tipo}: {tarefa.nome_arquivo} ({duracao:.1f}s)"))
+            else:
+                self.stdout.write(self.style.ERROR(f"#{tarefa.pk} {tarefa.tipo}: {tarefa.erro}"))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from core.models import UltimaContagem
+
+
+class Command(BaseCommand):
+    help = (
+        "Recalcula a tabela UltimaContagem (última/penúltima contagem por bar x produto) "
+        "a partir do histórico de ContagemBar."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bar', type=int, action='append', dest='bares',
+                            help="Restringe a um bar (pode repetir).")
+
+    def handle(self, *args, **opts):
+        linhas = UltimaContagem.reconstruir(bar_ids=opts.get('bares'))
+        self.stdout.write(self.style.SUCCESS(f"{linhas} linha(s) de UltimaContagem recalculada(s)."))
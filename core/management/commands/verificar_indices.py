@@ -0,0 +1,101 @@
+import json
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from core import busca, janelas, relatorios
+from core.models import Alimento, Bar, ContagemBar, Evento, Produto, RequisicaoProduto, TransferenciaBar
+
+
+def _consultas(restaurante_id, bar_id):
+    """(nome, queryset) das consultas quentes das telas, como as views as montam.
+       Nos históricos, o passo da paginação: o registro mais recente antes do cursor."""
+    agora = timezone.now()
+    hoje = timezone.localdate()
+    mes = janelas.mes(hoje.month, hoje.year)
+    return [
+        ('aprovação de requisições (pendentes)',
+         RequisicaoProduto.objects.filter(restaurante_id=restaurante_id, status='PENDENTE')
+         .order_by('data_solicitacao', 'id')),
+        ('histórico de requisições',
+         RequisicaoProduto.objects.filter(restaurante_id=restaurante_id, bar_id=bar_id, data_solicitacao__lt=agora)
+         .order_by('-data_solicitacao')[:1]),
+        ('dashboard: últimas requisições',
+         RequisicaoProduto.objects.filter(bar_id=bar_id).order_by('-data_solicitacao')[:5]),
+        ('saída de estoque (mês/ano)', relatorios.saida_estoque_queryset(bar_id, hoje.month, hoje.year)),
+        ('saída de estoque (mês, todos os anos)', relatorios.saida_estoque_queryset(bar_id, mes=hoje.month)),
+        ('consolidado de diferença: requisitado',
+         RequisicaoProduto.objects.filter(bar_id=bar_id, status='APROVADA', **mes.filtro('data_solicitacao'))),
+        ('histórico de transferências',
+         TransferenciaBar.objects.filter(restaurante_id=restaurante_id, data_transferencia__lt=agora)
+         .filter(Q(origem_id=bar_id) | Q(destino_id=bar_id)).order_by('-data_transferencia')[:1]),
+        ('dashboard: últimas transferências',
+         TransferenciaBar.objects.filter(origem_id=bar_id).order_by('-data_transferencia')[:5]),
+        ('histórico de contagens',
+         ContagemBar.objects.filter(bar_id=bar_id, data_contagem__lt=agora).order_by('-data_contagem')[:1]),
+        ('eventos em aberto', Evento.objects.exclude(status='FINALIZADO').order_by('data_evento', 'data_criacao')),
+        ('eventos finalizados hoje',
+         Evento.objects.filter(status='FINALIZADO', **janelas.dia(hoje).filtro('finalizado_em'))),
+        ('relatório de eventos', relatorios.eventos_queryset(hoje - timedelta(days=30), hoje)),
+        ('relatório de perdas', relatorios.perdas_queryset(restaurante_id, hoje.replace(day=1), hoje)),
+        ('busca de produtos', busca.filtrar(Produto.objects.all(), 'cachaca', 'nome', 'codigo')),
+        ('busca de alimentos', busca.filtrar(Alimento.objects.all(), 'pao', 'nome', 'codigo')),
+        ('busca de eventos', busca.filtrar(Evento.objects.all(), 'casamento', 'nome')),
+    ]
+
+
+def _varreduras_sequenciais(plano, tabela):
+    if plano.get('Node Type') == 'Seq Scan' and plano.get('Relation Name') == tabela:
+        yield plano
+    for filho in plano.get('Plans', ()):
+        yield from _varreduras_sequenciais(filho, tabela)
+
+
+def _indices(plano):
+    if 'Index Name' in plano:
+        yield plano['Index Name']
+    for filho in plano.get('Plans', ()):
+        yield from _indices(filho)
+
+
+class Command(BaseCommand):
+    help = (
+        "Roda EXPLAIN nas consultas quentes das telas (aprovação, históricos, dashboard, "
+        "relatórios, buscas) e falha se alguma ler a tabela principal por varredura sequencial. "
+        "Por padrão desliga enable_seqscan (só na transação): o que se verifica é que existe "
+        "um índice utilizável, mesmo num banco pequeno, onde a varredura seria mais barata."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bar', type=int, help="Bar usado nos filtros (padrão: o primeiro).")
+        parser.add_argument(
+            '--planejador-livre', action='store_true',
+            help="Não desliga enable_seqscan: mostra o plano real (use num banco com volume de produção).",
+        )
+
+    def handle(self, *args, **opts):
+        bar = (Bar.objects.filter(id=opts['bar']) if opts.get('bar') else Bar.objects.order_by('id')).first()
+        if bar is None:
+            raise CommandError("Nenhum bar cadastrado: popule o banco antes de verificar os planos.")
+
+        falhas = []
+        with transaction.atomic():
+            if not opts['planejador_livre']:
+                with connection.cursor() as cur:
+                    cur.execute("SET LOCAL enable_seqscan = off")
+            for nome, qs in _consultas(bar.restaurante_id, bar.id):
+                plano = json.loads(qs.explain(format='json'))[0]['Plan']
+                tabela = qs.model._meta.db_table
+                if any(_varreduras_sequenciais(plano, tabela)):
+                    falhas.append(nome)
+                    self.stdout.write(self.style.ERROR(f"  {nome}: varredura sequencial em {tabela}"))
+                else:
+                    indices = ', '.join(dict.fromkeys(_indices(plano))) or '-'
+                    self.stdout.write(f"  {nome}: {indices}")
+
+        if falhas:
+            raise CommandError(f"{len(falhas)} consulta(s) sem índice: {', '.join(falhas)}.")
+        self.stdout.write(self.style.SUCCESS("Todas as consultas usam índice."))
@@ -8,6 +8,13 @@ ALLOWLIST = {
     'exportar_consolidado_eventos_excel',
     'relatorio_eventos', 'exportar_relatorio_eventos_excel',
     'marcar_evento_baixado', 'desmarcar_evento_baixado',
+    # a view confere o escopo de cada exportação
+    'solicitar_exportacao', 'status_exportacao', 'baixar_exportacao',
+    'exportar_dados_relatorio',
+    # relatório do grupo: restaurantes vêm dos acessos do usuário, não da sessão
+    'relatorio_consolidado_grupo', 'exportar_consolidado_grupo_excel',
+    # catálogo do autocomplete (também nas telas de eventos)
+    'catalogo',
     # estáticos / dashboard neutro (se optar)
     'relatorios',
 }
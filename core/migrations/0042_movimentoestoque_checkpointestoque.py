@@ -0,0 +1,86 @@
+# Generated by Django 5.2.4 on 2026-10-18 10:34
+
+import django.db.models.deletion
+import django.utils.timezone
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+
+
+def criar_saldo_abertura(apps, schema_editor):
+    """Checkpoint inicial = saldo atual de EstoqueBar (abertura do livro de movimentos)."""
+    EstoqueBar = apps.get_model('core', 'EstoqueBar')
+    CheckpointEstoque = apps.get_model('core', 'CheckpointEstoque')
+    agora = django.utils.timezone.now()
+    CheckpointEstoque.objects.bulk_create(
+        [
+            CheckpointEstoque(
+                bar_id=e.bar_id, produto_id=e.produto_id, data_referencia=agora,
+                quantidade_garrafas=e.quantidade_garrafas, quantidade_doses=e.quantidade_doses,
+            )
+            for e in EstoqueBar.objects.all().iterator(chunk_size=2000)
+        ],
+        batch_size=2000,
+        ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0041_alter_contagembar_options_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='perdaproduto',
+            name='sem_baixa',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='produto',
+            name='controla_estoque_no_bar',
+            field=models.BooleanField(default=True, help_text='Se desmarcado, perdas serão registradas sem debitar estoque do bar.'),
+        ),
+        migrations.AlterField(
+            model_name='perdaproduto',
+            name='motivo',
+            field=models.CharField(choices=[('QUEBRA', 'Quebra de garrafa'), ('DERRAMAMENTO', 'Derramamento'), ('SOBRA', 'Descarte de sobra'), ('QUALIDADE', 'Produto impróprio'), ('CONGELADA', 'Congelada'), ('LATA AMASSADA', 'Lata amassada'), ('LATA FURADA', 'Lata furada'), ('VENCIDO', 'Vencido'), ('BEBIDA QUENTE', 'Bebida Quente'), ('ERRO DE LANÇAMENTO', 'Erro de Lançamento'), ('DEVOLUÇÃO DO CLIENTE', 'Devolução do Cliente'), ('CERVEJA CHOCA', 'Cerveja Choca'), ('BEBIDA SEM GÁS', 'Bebida Sem Gás'), ('QUEBRA AO ABASTECER', 'Quebra ao Abastece'), ('QUEBRA NO SALÃO', 'Quebra no Salão'), ('GARÇOM ABRIU ERRADO', 'Garçom Abriu Errado'), ('OUTRO', 'Outro')], max_length=20),
+        ),
+        migrations.CreateModel(
+            name='CheckpointEstoque',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data_referencia', models.DateTimeField()),
+                ('quantidade_garrafas', models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=12)),
+                ('quantidade_doses', models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=12)),
+                ('criado_em', models.DateTimeField(auto_now_add=True)),
+                ('bar', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkpoints_estoque', to='core.bar')),
+                ('produto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkpoints_estoque', to='core.produto')),
+            ],
+            options={
+                'ordering': ['-data_referencia'],
+                'indexes': [models.Index(fields=['bar', 'produto', '-data_referencia'], name='ix_ckpt_bar_prod_dt_desc')],
+                'constraints': [models.UniqueConstraint(fields=('bar', 'produto', 'data_referencia'), name='uniq_ckpt_bar_prod_data')],
+            },
+        ),
+        migrations.CreateModel(
+            name='MovimentoEstoque',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('ENTRADA', 'Entrada de mercadoria'), ('TRANSFERENCIA', 'Transferência entre bares'), ('REQUISICAO', 'Requisição aprovada'), ('PERDA', 'Perda'), ('ESTORNO_PERDA', 'Estorno de perda'), ('CONTAGEM', 'Ajuste por contagem'), ('AJUSTE', 'Ajuste manual')], max_length=20)),
+                ('delta_garrafas', models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=10)),
+                ('delta_doses', models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=10)),
+                ('data_movimento', models.DateTimeField(default=django.utils.timezone.now)),
+                ('bar', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movimentos', to='core.bar')),
+                ('produto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movimentos', to='core.produto')),
+                ('usuario', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-data_movimento', '-id'],
+                'indexes': [models.Index(fields=['bar', 'produto', 'data_movimento'], name='ix_mov_bar_prod_data'), models.Index(fields=['data_movimento'], name='ix_mov_data')],
+            },
+        ),
+        migrations.RunPython(criar_saldo_abertura, migrations.RunPython.noop),
+    ]
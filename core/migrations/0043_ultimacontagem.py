@@ -0,0 +1,51 @@
+# Generated by Django 5.2.4 on 2026-10-18 10:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def preencher_ultimas_contagens(apps, schema_editor):
+    """Carga inicial: última e penúltima contagem de cada (bar, produto)."""
+    ContagemBar = apps.get_model('core', 'ContagemBar')
+    UltimaContagem = apps.get_model('core', 'UltimaContagem')
+    with schema_editor.connection.cursor() as cur:
+        cur.execute(f"""
+            WITH ranked AS (
+                SELECT id, bar_id, produto_id, data_contagem,
+                       ROW_NUMBER() OVER (PARTITION BY bar_id, produto_id
+                                          ORDER BY data_contagem DESC, id DESC) AS rn
+                  FROM {ContagemBar._meta.db_table}
+            )
+            INSERT INTO {UltimaContagem._meta.db_table}
+                   (bar_id, produto_id, ultima_id, penultima_id, data_ultima)
+            SELECT u.bar_id, u.produto_id, u.id, p.id, u.data_contagem
+              FROM ranked u
+              LEFT JOIN ranked p
+                ON p.bar_id = u.bar_id AND p.produto_id = u.produto_id AND p.rn = 2
+             WHERE u.rn = 1
+        """)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0042_movimentoestoque_checkpointestoque'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UltimaContagem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data_ultima', models.DateTimeField()),
+                ('bar', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ultimas_contagens', to='core.bar')),
+                ('penultima', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.contagembar')),
+                ('produto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.produto')),
+                ('ultima', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.contagembar')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('bar', 'produto'), name='uniq_ultcont_bar_prod')],
+            },
+        ),
+        migrations.RunPython(preencher_ultimas_contagens, migrations.RunPython.noop),
+    ]
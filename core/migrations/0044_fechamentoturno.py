@@ -0,0 +1,50 @@
+# Generated by Django 5.2.4 on 2026-10-18 10:44
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0043_ultimacontagem'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FechamentoTurno',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dia_operacional', models.DateField(unique=True)),
+                ('data_referencia', models.DateTimeField()),
+                ('criado_em', models.DateTimeField(auto_now=True)),
+                ('usuario', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-dia_operacional'],
+            },
+        ),
+        migrations.CreateModel(
+            name='FechamentoTurnoItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantidade_garrafas_cheias', models.PositiveIntegerField(default=0)),
+                ('quantidade_doses_restantes', models.DecimalField(decimal_places=2, default=0, max_digits=6)),
+                ('data_contagem', models.DateTimeField()),
+                ('bar', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.bar')),
+                ('contagem', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.contagembar')),
+                ('fechamento', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='itens', to='core.fechamentoturno')),
+                ('produto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.produto')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='fechamentoturno',
+            index=models.Index(fields=['data_referencia'], name='ix_fech_data_ref'),
+        ),
+        migrations.AddConstraint(
+            model_name='fechamentoturnoitem',
+            constraint=models.UniqueConstraint(fields=('fechamento', 'bar', 'produto'), name='uniq_fech_item_bar_prod'),
+        ),
+    ]
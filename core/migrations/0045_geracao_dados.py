@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-18 10:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0044_fechamentoturno'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bar',
+            name='geracao_dados',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='restaurante',
+            name='geracao_dados',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.4 on 2026-10-18 11:03
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0045_geracao_dados'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TarefaExportacao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(max_length=30)),
+                ('chave', models.CharField(max_length=64)),
+                ('parametros', models.TextField(blank=True)),
+                ('status', models.CharField(choices=[('PENDENTE', 'Pendente'), ('PROCESSANDO', 'Processando'), ('CONCLUIDA', 'Concluída'), ('ERRO', 'Erro')], default='PENDENTE', max_length=12)),
+                ('progresso', models.PositiveSmallIntegerField(default=0)),
+                ('arquivo', models.FileField(blank=True, upload_to='exportacoes/%Y/%m/')),
+                ('nome_arquivo', models.CharField(blank=True, max_length=200)),
+                ('erro', models.TextField(blank=True)),
+                ('criado_em', models.DateTimeField(auto_now_add=True)),
+                ('iniciado_em', models.DateTimeField(blank=True, null=True)),
+                ('concluido_em', models.DateTimeField(blank=True, null=True)),
+                ('bar', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='core.bar')),
+                ('restaurante', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='core.restaurante')),
+                ('usuario', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-criado_em'],
+                'indexes': [models.Index(fields=['chave', 'status'], name='ix_export_chave'), models.Index(fields=['status', 'criado_em'], name='ix_export_fila')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('status__in', ('PENDENTE', 'PROCESSANDO'))), fields=('chave',), name='uniq_export_chave_ativa')],
+            },
+        ),
+    ]
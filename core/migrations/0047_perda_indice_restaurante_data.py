@@ -0,0 +1,19 @@
+# Generated by Django 5.2.4 on 2026-10-18 11:13
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0046_tarefaexportacao'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='perdaproduto',
+            index=models.Index(fields=['restaurante', '-data_registro', '-id'], name='ix_perda_rest_dt_desc'),
+        ),
+    ]
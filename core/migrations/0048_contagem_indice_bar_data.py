@@ -0,0 +1,19 @@
+# Generated by Django 5.2.4 on 2026-10-18 11:20
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0047_perda_indice_restaurante_data'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='contagembar',
+            index=models.Index(fields=['bar', '-data_contagem'], name='ix_cont_bar_dt_desc'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.4 on 2026-10-18 11:26
+
+import django.db.models.functions.datetime
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0048_contagem_indice_bar_data'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='requisicaoproduto',
+            index=models.Index(models.F('bar'), django.db.models.functions.datetime.ExtractMonth('data_solicitacao'), name='ix_req_bar_mes_local'),
+        ),
+    ]
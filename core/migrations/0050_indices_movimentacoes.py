@@ -0,0 +1,39 @@
+# Generated by Django 5.2.4 on 2026-10-18 11:29
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0049_requisicao_indice_bar_mes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='evento',
+            index=models.Index(fields=['status', 'finalizado_em'], name='ix_evento_status_fim'),
+        ),
+        migrations.AddIndex(
+            model_name='evento',
+            index=models.Index(condition=models.Q(('status', 'FINALIZADO'), _negated=True), fields=['data_evento', 'data_criacao'], name='ix_evento_abertos'),
+        ),
+        migrations.AddIndex(
+            model_name='requisicaoproduto',
+            index=models.Index(fields=['bar', '-data_solicitacao'], name='ix_req_bar_dt_desc'),
+        ),
+        migrations.AddIndex(
+            model_name='requisicaoproduto',
+            index=models.Index(condition=models.Q(('status', 'PENDENTE')), fields=['restaurante', 'data_solicitacao', 'id'], name='ix_req_pendentes'),
+        ),
+        migrations.AddIndex(
+            model_name='transferenciabar',
+            index=models.Index(fields=['origem', '-data_transferencia'], name='ix_transf_origem_dt_desc'),
+        ),
+        migrations.AddIndex(
+            model_name='transferenciabar',
+            index=models.Index(fields=['destino', '-data_transferencia'], name='ix_transf_destino_dt_desc'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.4 on 2026-10-18 11:31
+
+import core.busca
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import TrigramExtension, UnaccentExtension
+from django.conf import settings
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0050_indices_movimentacoes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        UnaccentExtension(),
+        # unaccent() é STABLE (depende do search_path); com o dicionário explícito o
+        # resultado é fixo e a função pode entrar em índices (core/busca.py)
+        migrations.RunSQL(
+            """
+            CREATE OR REPLACE FUNCTION core_sem_acento(text) RETURNS text
+                LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE
+                AS $$ SELECT public.unaccent('public.unaccent'::regdictionary, $1) $$;
+            """,
+            reverse_sql="DROP FUNCTION IF EXISTS core_sem_acento(text);",
+        ),
+        migrations.AddIndex(
+            model_name='alimento',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(core.busca.SemAcento('nome'), name='gin_trgm_ops'), name='ix_alimento_nome_trgm'),
+        ),
+        migrations.AddIndex(
+            model_name='alimento',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(core.busca.SemAcento('codigo'), name='gin_trgm_ops'), name='ix_alimento_codigo_trgm'),
+        ),
+        migrations.AddIndex(
+            model_name='evento',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(core.busca.SemAcento('nome'), name='gin_trgm_ops'), name='ix_evento_nome_trgm'),
+        ),
+        migrations.AddIndex(
+            model_name='produto',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(core.busca.SemAcento('nome'), name='gin_trgm_ops'), name='ix_produto_nome_trgm'),
+        ),
+        migrations.AddIndex(
+            model_name='produto',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(core.busca.SemAcento('codigo'), name='gin_trgm_ops'), name='ix_produto_codigo_trgm'),
+        ),
+    ]
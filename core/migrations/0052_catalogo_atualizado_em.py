@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-18 11:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0051_busca_trigramas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='alimento',
+            name='atualizado_em',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='produto',
+            name='atualizado_em',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -4,21 +4,74 @@ from django.db import models
 from django.utils import timezone
 from django.contrib.auth.models import User
 from decimal import Decimal
-from django.db import transaction
-from django.db.models import F, Q
+from typing import NamedTuple
+from collections import defaultdict
+from datetime import timedelta
+from time import monotonic, time_ns
+import numpy as np
+from django.conf import settings
+from django.core.files import File
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.db import IntegrityError, transaction, connection
+from django.db.models import F, Q, Sum, Value
+from django.db.models.functions import Cast, ExtractMonth, Greatest, Round
 
+from core import janelas
+from core.busca import SemAcento
+
+
+
+class SaldoMovimentado(NamedTuple):
+    """Saldo de EstoqueBar antes/depois de um EstoqueBar.movimentar."""
+    antes_garrafas: Decimal
+    antes_doses: Decimal
+    depois_garrafas: Decimal
+    depois_doses: Decimal
 
 
 class Restaurante(models.Model):
     nome = models.CharField(max_length=100)
+    # versão dos dados de estoque/contagem: sobe a cada gravação (chave do cache de relatórios)
+    geracao_dados = models.BigIntegerField(default=0, editable=False)
 
     def __str__(self):
         return self.nome
 
+    @classmethod
+    def do_usuario(cls, user):
+        """Restaurantes em que o usuário tem algum acesso (AcessoUsuarioBar), por nome."""
+        return (cls.objects
+                .filter(id__in=AcessoUsuarioBar.objects.filter(user=user).values('restaurante_id'))
+                .order_by('nome'))
+
+    @classmethod
+    def invalidar_relatorios(cls, bar_ids=(), restaurante_ids=(), todos=False):
+        """Sobe a geração dos bares e dos seus restaurantes depois do commit da
+           transação corrente (sem segurar lock nas linhas durante a gravação).
+           `todos=True` invalida tudo (ex.: produto alterado)."""
+        bar_ids = {getattr(b, 'pk', b) for b in bar_ids if b is not None}
+        restaurante_ids = {getattr(r, 'pk', r) for r in restaurante_ids if r is not None}
+        if not (bar_ids or restaurante_ids or todos):
+            return
+
+        def _subir():
+            # nunca volta para um valor já usado, mesmo se um save() antigo sobrescrever o campo
+            mais_um = Greatest(F('geracao_dados') + 1, Value(time_ns() // 1000))
+            if todos:
+                Bar.objects.update(geracao_dados=mais_um)
+                cls.objects.update(geracao_dados=mais_um)
+                return
+            if bar_ids:
+                Bar.objects.filter(id__in=bar_ids).update(geracao_dados=mais_um)
+            cls.objects.filter(Q(id__in=restaurante_ids) | Q(bares__id__in=bar_ids)).update(geracao_dados=mais_um)
+
+        transaction.on_commit(_subir)
+
 class Bar(models.Model):
     nome = models.CharField(max_length=100)
     restaurante = models.ForeignKey(Restaurante, on_delete=models.CASCADE, related_name='bares')
     is_estoque_central = models.BooleanField(default=False)
+    geracao_dados = models.BigIntegerField(default=0, editable=False)
 
     class Meta:
         indexes = [
@@ -64,9 +117,16 @@ class Produto(models.Model):
     dose_padrao_ml = models.PositiveIntegerField(default=50, help_text="Tamanho da dose padrão em mL (padrão 50)")
 
     ativo = models.BooleanField(default=True)
+    # versão do catálogo (core/catalogo.py): muda a cada save, em qualquer processo
+    atualizado_em = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['nome']
+        indexes = [
+            # busca por trecho sem acento (core/busca.py)
+            GinIndex(OpClass(SemAcento('nome'), name='gin_trgm_ops'), name='ix_produto_nome_trgm'),
+            GinIndex(OpClass(SemAcento('codigo'), name='gin_trgm_ops'), name='ix_produto_codigo_trgm'),
+        ]
 
     def __str__(self):
         return self.nome
@@ -107,7 +167,44 @@ class RecebimentoEstoque(models.Model):
 
     def __str__(self):
         return f"{self.produto.nome} - {self.quantidade} un - {self.bar.nome}"
-    
+
+    @classmethod
+    @transaction.atomic
+    def registrar_lote(cls, restaurante, bar, itens, usuario=None) -> list:
+        """Registra um recebimento inteiro numa transação.
+           `itens` = iterável de (produto_id, quantidade); produtos repetidos são
+           somados e quantidades <= 0 descartadas. Produtos validados numa consulta,
+           recebimentos com bulk_create e estoque do `bar` creditado com um único
+           upsert (EstoqueBar.adicionar_lote). Levanta Produto.DoesNotExist se
+           algum produto não existir."""
+        totais = {}
+        for produto_id, quantidade in itens:
+            produto_id = int(produto_id)
+            totais[produto_id] = totais.get(produto_id, Decimal('0')) + Decimal(quantidade or 0)
+        totais = {pid: qtd for pid, qtd in totais.items() if qtd > 0}
+        if not totais:
+            return []
+
+        existentes = set(Produto.objects.filter(id__in=totais).values_list('id', flat=True))
+        faltando = set(totais) - existentes
+        if faltando:
+            raise Produto.DoesNotExist(
+                f"Produto(s) inexistente(s): {', '.join(map(str, sorted(faltando)))}"
+            )
+
+        agora = timezone.now()
+        recebimentos = cls.objects.bulk_create([
+            cls(restaurante=restaurante, bar=bar, produto_id=pid, quantidade=qtd,
+                usuario=usuario, data_recebimento=agora)
+            for pid, qtd in totais.items()
+        ])
+        EstoqueBar.adicionar_lote(
+            bar, {pid: (qtd, Decimal('0')) for pid, qtd in totais.items()},
+            tipo='ENTRADA', usuario=usuario,
+        )
+        Restaurante.invalidar_relatorios(bar_ids=[bar], restaurante_ids=[restaurante])
+        return recebimentos
+
 
 
 
@@ -120,6 +217,14 @@ class TransferenciaBar(models.Model):
     usuario = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
     data_transferencia = models.DateTimeField(default=timezone.now)
 
+    class Meta:
+        indexes = [
+            # histórico do bar (origem OU destino, dia a dia) e últimas saídas do dashboard;
+            # o restaurante fica de fora: cada bar pertence a um só
+            models.Index(fields=['origem', '-data_transferencia'], name='ix_transf_origem_dt_desc'),
+            models.Index(fields=['destino', '-data_transferencia'], name='ix_transf_destino_dt_desc'),
+        ]
+
     def __str__(self):
         return f"{self.produto.nome} | {self.quantidade} un | {self.origem.nome} → {self.destino.nome}"
 
@@ -143,11 +248,431 @@ class ContagemBar(models.Model):
             models.Index(fields=['bar', 'produto', '-data_contagem'], name='ix_cont_bar_prod_dt_desc'),
             # útil para buscas por produto em geral
             models.Index(fields=['produto', '-data_contagem'], name='ix_cont_prod_dt_desc'),
+            # histórico do bar (core/historico): max(data) < limite, um dia por vez
+            models.Index(fields=['bar', '-data_contagem'], name='ix_cont_bar_dt_desc'),
+            # fechamento do turno: só as contagens desde o fechamento anterior
+            models.Index(fields=['data_contagem'], name='ix_cont_dt'),
         ]
 
     def __str__(self):
         return f"{self.bar.nome} - {self.produto.nome}"
 
+    @classmethod
+    @transaction.atomic
+    def registrar_lote(cls, bar, itens: dict, usuario=None) -> list:
+        """Registra uma contagem inteira de forma atômica.
+           `itens` = {produto_id: (garrafas, doses)}. Todas as linhas recebem o mesmo
+           data_contagem; contagens via bulk_create e saldo do bar sobrescrito com
+           um único upsert (EstoqueBar.definir_lote)."""
+        if not itens:
+            return []
+        agora = timezone.now()
+        contagens = cls.objects.bulk_create([
+            cls(bar=bar, produto_id=pid, quantidade_garrafas_cheias=g, quantidade_doses_restantes=d,
+                usuario=usuario, data_contagem=agora)
+            for pid, (g, d) in itens.items()
+        ])
+        EstoqueBar.definir_lote(bar, itens, tipo='CONTAGEM', usuario=usuario, momento=agora)
+        UltimaContagem.atualizar(contagens)
+        Restaurante.invalidar_relatorios(bar_ids=[bar])
+        return contagens
+
+    @classmethod
+    def contagens_em(cls, momentos, bar_ids=None, produto_ids=None, centesimos=False) -> list:
+        """Última contagem <= T por (bar, produto) para VÁRIOS instantes numa query só
+           (DISTINCT ON sobre ix_cont_bar_prod_dt_desc, um LATERAL por instante).
+           Retorna uma lista alinhada com `momentos`: [{(bar_id, produto_id): (g, d)}, ...].
+           Com `centesimos=True` cada item é um array int64 n × 4 (bar_id, produto_id,
+           garrafas e doses em centésimos), convertido no banco: sem um Decimal por célula."""
+        momentos = list(momentos)
+        if not momentos:
+            return []
+        filtros, params = [], [momentos]
+        if bar_ids is not None:
+            filtros.append('bar_id = ANY(%s)'); params.append(list(bar_ids))
+        if produto_ids is not None:
+            filtros.append('produto_id = ANY(%s)'); params.append(list(produto_ids))
+        extra = ''.join(f' AND {f}' for f in filtros)
+
+        colunas = ('c.quantidade_garrafas_cheias::bigint * 100, round(c.quantidade_doses_restantes * 100)::bigint'
+                   if centesimos else 'c.quantidade_garrafas_cheias, c.quantidade_doses_restantes')
+        sql = f"""
+            SELECT m.idx, c.bar_id, c.produto_id, {colunas}
+              FROM unnest(%s::timestamptz[]) WITH ORDINALITY AS m(momento, idx)
+             CROSS JOIN LATERAL (
+                SELECT DISTINCT ON (bar_id, produto_id)
+                       bar_id, produto_id, quantidade_garrafas_cheias, quantidade_doses_restantes
+                  FROM {cls._meta.db_table}
+                 WHERE data_contagem <= m.momento{extra}
+                 ORDER BY bar_id, produto_id, data_contagem DESC, id DESC
+             ) c
+        """
+        with connection.cursor() as cur:
+            cur.execute(sql, params)
+            linhas = cur.fetchall()
+        if centesimos:
+            tabela = np.array(linhas, dtype=np.int64).reshape(-1, 5)
+            return [tabela[tabela[:, 0] == i, 1:] for i in range(1, len(momentos) + 1)]
+
+        mapas = [{} for _ in momentos]
+        for idx, b, p, g, d in linhas:
+            mapas[idx - 1][(b, p)] = (Decimal(g), d)
+        return mapas
+
+    @classmethod
+    def recentes(cls, bar_ids, n: int = 2) -> dict:
+        """As N contagens mais recentes de cada (bar, produto) dos bares, numa query:
+           para cada par de UltimaContagem, um LATERAL pega N+1 linhas pelo índice
+           ix_cont_bar_prod_dt_desc e LAG() calcula a variação para a contagem anterior.
+           Retorna {(bar_id, produto_id): [ContagemBar, ...]} (mais recente primeiro),
+           cada uma com `diff_g`/`diff_d` (None na mais antiga sem anterior) e com
+           produto/usuário já carregados."""
+        n = max(int(n), 1)
+        tabela = cls._meta.db_table
+        sql = f"""
+            SELECT x.*
+              FROM {UltimaContagem._meta.db_table} uc
+             CROSS JOIN LATERAL (
+                SELECT t.*,
+                       ROW_NUMBER() OVER (ORDER BY t.data_contagem DESC, t.id DESC) AS rn,
+                       t.quantidade_garrafas_cheias
+                         - LAG(t.quantidade_garrafas_cheias) OVER asc_w AS diff_g,
+                       t.quantidade_doses_restantes
+                         - LAG(t.quantidade_doses_restantes) OVER asc_w AS diff_d
+                  FROM (SELECT c.*
+                          FROM {tabela} c
+                         WHERE c.bar_id = uc.bar_id AND c.produto_id = uc.produto_id
+                         ORDER BY c.data_contagem DESC, c.id DESC
+                         LIMIT %(limite)s) t
+                WINDOW asc_w AS (ORDER BY t.data_contagem, t.id)
+             ) x
+             WHERE uc.bar_id = ANY(%(bares)s) AND x.rn <= %(n)s
+             ORDER BY x.bar_id, x.produto_id, x.rn
+        """
+        linhas = list(cls.objects.raw(sql, {'bares': list(bar_ids), 'n': n, 'limite': n + 1}))
+        models.prefetch_related_objects(linhas, 'produto', 'usuario')
+        resultado = defaultdict(list)
+        for c in linhas:
+            resultado[(c.bar_id, c.produto_id)].append(c)
+        return resultado
+
+    @classmethod
+    def ultimas_por_bar(cls, bar_ids, inicio, fim) -> dict:
+        """{bar_id: [ContagemBar, ...]} com a última contagem de cada produto feita
+           em [inicio, fim), para todos os bares numa query (DISTINCT ON), já com
+           produto/usuário carregados. Listas ordenadas da mais recente para a mais antiga."""
+        resultado = defaultdict(list)
+        qs = (cls.objects
+              .filter(bar_id__in=list(bar_ids), data_contagem__gte=inicio, data_contagem__lt=fim)
+              .select_related('produto', 'usuario')
+              .order_by('bar_id', 'produto_id', '-data_contagem', '-id')
+              .distinct('bar_id', 'produto_id'))
+        for c in sorted(qs, key=lambda c: (c.data_contagem, c.pk), reverse=True):
+            resultado[c.bar_id].append(c)
+        return resultado
+
+
+class UltimaContagem(models.Model):
+    """Última e penúltima contagem por (bar, produto), mantida junto com cada
+       gravação de ContagemBar. Relatórios do "estado atual" leem daqui
+       (bares × produtos linhas) em vez de varrer todo o histórico."""
+    bar = models.ForeignKey(Bar, on_delete=models.CASCADE, related_name='ultimas_contagens')
+    produto = models.ForeignKey(Produto, on_delete=models.CASCADE)
+    ultima = models.ForeignKey(ContagemBar, on_delete=models.CASCADE, related_name='+')
+    penultima = models.ForeignKey(ContagemBar, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    data_ultima = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['bar', 'produto'], name='uniq_ultcont_bar_prod'),
+        ]
+
+    def __str__(self):
+        return f"{self.bar.nome} - {self.produto.nome} @ {self.data_ultima:%d/%m/%Y %H:%M}"
+
+    @classmethod
+    def atualizar(cls, contagens) -> int:
+        """Empurra contagens recém-gravadas para a tabela num único upsert:
+           a última vira penúltima e a nova assume (só se não for mais antiga).
+           Deve rodar na mesma transação que grava as contagens."""
+        novas = {}
+        for c in contagens:
+            chave = (c.bar_id, c.produto_id)
+            atual = novas.get(chave)
+            if atual is None or (c.data_contagem, c.pk) > (atual.data_contagem, atual.pk):
+                novas[chave] = c
+        if not novas:
+            return 0
+
+        linhas = [novas[k] for k in sorted(novas)]
+        tabela = cls._meta.db_table
+        sql = f"""
+            INSERT INTO {tabela} (bar_id, produto_id, ultima_id, penultima_id, data_ultima)
+            SELECT bar_id, produto_id, contagem_id, NULL, data_contagem
+              FROM unnest(%(bares)s::bigint[], %(produtos)s::bigint[],
+                          %(contagens)s::bigint[], %(datas)s::timestamptz[])
+                   AS t(bar_id, produto_id, contagem_id, data_contagem)
+            ON CONFLICT (bar_id, produto_id) DO UPDATE
+               SET penultima_id = {tabela}.ultima_id,
+                   ultima_id    = EXCLUDED.ultima_id,
+                   data_ultima  = EXCLUDED.data_ultima
+             WHERE EXCLUDED.data_ultima >= {tabela}.data_ultima
+               AND EXCLUDED.ultima_id <> {tabela}.ultima_id
+        """
+        with connection.cursor() as cur:
+            cur.execute(sql, {
+                'bares': [c.bar_id for c in linhas],
+                'produtos': [c.produto_id for c in linhas],
+                'contagens': [c.pk for c in linhas],
+                'datas': [c.data_contagem for c in linhas],
+            })
+            return cur.rowcount
+
+    @classmethod
+    def reconstruir(cls, bar_ids=None, produto_ids=None) -> int:
+        """Recalcula a partir do histórico (ROW_NUMBER por bar/produto).
+           Sem filtros, refaz a tabela inteira. Usado após edições/exclusões
+           manuais de contagens e pelo comando `reconstruir_ultimas_contagens`."""
+        tabela = cls._meta.db_table
+        sql = f"""
+            WITH ranked AS (
+                SELECT id, bar_id, produto_id, data_contagem,
+                       ROW_NUMBER() OVER (PARTITION BY bar_id, produto_id
+                                          ORDER BY data_contagem DESC, id DESC) AS rn
+                  FROM {ContagemBar._meta.db_table}
+                 WHERE (%(bares)s::bigint[] IS NULL OR bar_id = ANY(%(bares)s::bigint[]))
+                   AND (%(produtos)s::bigint[] IS NULL OR produto_id = ANY(%(produtos)s::bigint[]))
+            )
+            INSERT INTO {tabela} (bar_id, produto_id, ultima_id, penultima_id, data_ultima)
+            SELECT u.bar_id, u.produto_id, u.id, p.id, u.data_contagem
+              FROM ranked u
+              LEFT JOIN ranked p
+                ON p.bar_id = u.bar_id AND p.produto_id = u.produto_id AND p.rn = 2
+             WHERE u.rn = 1
+             ORDER BY u.bar_id, u.produto_id
+            ON CONFLICT (bar_id, produto_id) DO UPDATE
+               SET ultima_id    = EXCLUDED.ultima_id,
+                   penultima_id = EXCLUDED.penultima_id,
+                   data_ultima  = EXCLUDED.data_ultima
+        """
+        with connection.cursor() as cur:
+            cur.execute(sql, {
+                'bares': list(bar_ids) if bar_ids is not None else None,
+                'produtos': list(produto_ids) if produto_ids is not None else None,
+            })
+            return cur.rowcount
+
+    @classmethod
+    def por_bar(cls, bar_ids, com_penultima: bool = False) -> dict:
+        """{bar_id: [UltimaContagem, ...]} (mais recentes primeiro) numa consulta,
+           com a última contagem (produto/usuário) já carregada."""
+        relacionados = ['ultima__produto', 'ultima__usuario']
+        if com_penultima:
+            relacionados.append('penultima__usuario')
+        resultado = defaultdict(list)
+        for uc in (cls.objects
+                   .filter(bar_id__in=list(bar_ids))
+                   .select_related(*relacionados)
+                   .order_by('-data_ultima', '-ultima_id')):
+            resultado[uc.bar_id].append(uc)
+        return resultado
+
+
+
+class FechamentoTurno(models.Model):
+    """Fechamento de um dia operacional (HORA_INICIO de D até HORA_INICIO de D+1):
+       congela a última contagem de cada bar x produto no fim do turno.
+       Relatórios por dia/período leem os itens em vez do histórico bruto."""
+    HORA_INICIO = 19  # mantenha igual a SHIFT_START_HOUR das views
+
+    dia_operacional = models.DateField(unique=True)
+    data_referencia = models.DateTimeField()   # fim do dia operacional
+    usuario = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    criado_em = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-dia_operacional']
+        indexes = [models.Index(fields=['data_referencia'], name='ix_fech_data_ref')]
+
+    def __str__(self):
+        return f"Fechamento {self.dia_operacional:%d/%m/%Y}"
+
+    @classmethod
+    def limites(cls, dia):
+        """(início, fim) aware do dia operacional `dia`."""
+        return janelas.dia_operacional(dia, cls.HORA_INICIO)
+
+    @classmethod
+    def ultimo_dia_encerrado(cls, agora=None):
+        """Dia operacional mais recente cujo turno já terminou."""
+        agora = timezone.localtime(agora or timezone.now())
+        dia = agora.date() - timedelta(days=1)
+        if agora.hour < cls.HORA_INICIO:
+            dia -= timedelta(days=1)
+        return dia
+
+    @classmethod
+    @transaction.atomic
+    def fechar(cls, dia, usuario=None, completo=False):
+        """Fecha (ou refaz) o dia operacional para TODOS os bares. Parte do fechamento
+           anterior (data_referencia < fim) e só lê do histórico as contagens feitas
+           depois dele; sem fechamento anterior ou com `completo=True`, varre o
+           histórico até o fim do turno — use ao refazer, para pegar contagens
+           editadas/apagadas antes do fechamento anterior. Itens que já estavam
+           certos não são regravados, e só os bares com item novo vindo do histórico
+           ou com item alterado têm os relatórios invalidados.
+           Retorna (fechamento, nº de itens)."""
+        _, fim = cls.limites(dia)
+        anterior = None if completo else (
+            cls.objects.filter(data_referencia__lt=fim)
+            .exclude(dia_operacional=dia)
+            .order_by('-data_referencia')
+            .values_list('id', 'data_referencia')
+            .first())
+        fechamento, _ = cls.objects.update_or_create(
+            dia_operacional=dia,
+            defaults={'data_referencia': fim, 'usuario': usuario},
+        )
+
+        tabela_item = FechamentoTurnoItem._meta.db_table
+        params = {'fechamento': fechamento.pk, 'fim': fim}
+        desde = carregados = ''
+        if anterior:
+            params['anterior'], params['desde'] = anterior
+            desde = 'AND data_contagem > %(desde)s'
+            carregados = f"""
+                UNION ALL
+                SELECT a.bar_id, a.produto_id, a.contagem_id,
+                       a.quantidade_garrafas_cheias, a.quantidade_doses_restantes, a.data_contagem
+                  FROM {tabela_item} a
+                 WHERE a.fechamento_id = %(anterior)s
+                   AND NOT EXISTS (SELECT 1 FROM novas n
+                                    WHERE n.bar_id = a.bar_id AND n.produto_id = a.produto_id)
+            """
+        # retrato no fim do turno: contagens novas por cima do fechamento anterior
+        retrato = f"""
+            WITH novas AS (
+                SELECT DISTINCT ON (bar_id, produto_id)
+                       bar_id, produto_id, id AS contagem_id,
+                       quantidade_garrafas_cheias, quantidade_doses_restantes, data_contagem
+                  FROM {ContagemBar._meta.db_table}
+                 WHERE data_contagem <= %(fim)s {desde}
+                 ORDER BY bar_id, produto_id, data_contagem DESC, id DESC
+            ), retrato AS (
+                SELECT * FROM novas
+                {carregados}
+            )
+        """
+        mesmo_item = """
+            r.bar_id = i.bar_id AND r.produto_id = i.produto_id
+            AND (r.contagem_id, r.quantidade_garrafas_cheias, r.quantidade_doses_restantes, r.data_contagem)
+                IS NOT DISTINCT FROM
+                (i.contagem_id, i.quantidade_garrafas_cheias, i.quantidade_doses_restantes, i.data_contagem)
+        """
+        with connection.cursor() as cur:
+            # ao refazer: remove só os itens que mudaram
+            cur.execute(f"""
+                {retrato}
+                DELETE FROM {tabela_item} i
+                 WHERE i.fechamento_id = %(fechamento)s
+                   AND NOT EXISTS (SELECT 1 FROM retrato r WHERE {mesmo_item})
+             RETURNING i.bar_id
+            """, params)
+            bares = {b for (b,) in cur.fetchall()}
+            cur.execute(f"""
+                {retrato}, inseridos AS (
+                    INSERT INTO {tabela_item}
+                           (fechamento_id, bar_id, produto_id, contagem_id,
+                            quantidade_garrafas_cheias, quantidade_doses_restantes, data_contagem)
+                    SELECT %(fechamento)s, r.*
+                      FROM retrato r
+                     WHERE NOT EXISTS (SELECT 1 FROM {tabela_item} i
+                                        WHERE i.fechamento_id = %(fechamento)s AND {mesmo_item})
+                 RETURNING bar_id, produto_id
+                )
+                SELECT DISTINCT bar_id FROM inseridos JOIN novas USING (bar_id, produto_id)
+            """, params)
+            bares.update(b for (b,) in cur.fetchall())
+        itens = fechamento.itens.count()
+        if bares:
+            Restaurante.invalidar_relatorios(bar_ids=bares)
+        return fechamento, itens
+
+    @classmethod
+    def contagens_em(cls, momentos, bar_ids=None, produto_ids=None, centesimos=False) -> list:
+        """Mesmo contrato de ContagemBar.contagens_em, mas instantes que coincidem
+           com um fechamento são lidos dos itens congelados; só o resto vai ao histórico."""
+        momentos = list(momentos)
+        fechamentos = dict(
+            cls.objects.filter(data_referencia__in=momentos).values_list('data_referencia', 'id')
+        )
+        mapas = [None] * len(momentos)
+
+        if fechamentos:
+            itens = FechamentoTurnoItem.objects.filter(fechamento_id__in=fechamentos.values())
+            if bar_ids is not None:
+                itens = itens.filter(bar_id__in=list(bar_ids))
+            if produto_ids is not None:
+                itens = itens.filter(produto_id__in=list(produto_ids))
+            por_fechamento = defaultdict(dict)
+            linhas = itens.values_list('fechamento_id', 'bar_id', 'produto_id',
+                                       'quantidade_garrafas_cheias', 'quantidade_doses_restantes')
+            if centesimos:
+                linhas = linhas.annotate(
+                    g_c=F('quantidade_garrafas_cheias') * 100,
+                    d_c=Cast(Round(F('quantidade_doses_restantes') * 100), models.BigIntegerField()),
+                ).values_list('fechamento_id', 'bar_id', 'produto_id', 'g_c', 'd_c')
+                tabela = np.array(list(linhas), dtype=np.int64).reshape(-1, 5)
+                por_fechamento = {fid: tabela[tabela[:, 0] == fid, 1:] for fid in fechamentos.values()}
+            else:
+                for fid, b, p, g, d in linhas:
+                    por_fechamento[fid][(b, p)] = (Decimal(g), d)
+            for i, m in enumerate(momentos):
+                if m in fechamentos:
+                    mapas[i] = por_fechamento[fechamentos[m]]
+
+        faltando = [i for i, mp in enumerate(mapas) if mp is None]
+        if faltando:
+            brutos = ContagemBar.contagens_em([momentos[i] for i in faltando], bar_ids, produto_ids,
+                                              centesimos=centesimos)
+            for i, mp in zip(faltando, brutos):
+                mapas[i] = mp
+        return mapas
+
+    @classmethod
+    def contagens_do_dia(cls, dia, bar_ids):
+        """{bar_id: [ContagemBar, ...]} com a última contagem FEITA dentro do dia
+           operacional `dia`, lida do fechamento. None se o dia não foi fechado."""
+        fechamento = cls.objects.filter(dia_operacional=dia).first()
+        if fechamento is None:
+            return None
+        inicio, _ = cls.limites(dia)
+        resultado = defaultdict(list)
+        for item in (fechamento.itens
+                     .filter(bar_id__in=list(bar_ids), data_contagem__gte=inicio, contagem__isnull=False)
+                     .select_related('contagem__produto', 'contagem__usuario')
+                     .order_by('-data_contagem', '-contagem_id')):
+            resultado[item.bar_id].append(item.contagem)
+        return resultado
+
+
+class FechamentoTurnoItem(models.Model):
+    fechamento = models.ForeignKey(FechamentoTurno, on_delete=models.CASCADE, related_name='itens')
+    bar = models.ForeignKey(Bar, on_delete=models.CASCADE)
+    produto = models.ForeignKey(Produto, on_delete=models.CASCADE)
+    contagem = models.ForeignKey(ContagemBar, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    quantidade_garrafas_cheias = models.PositiveIntegerField(default=0)
+    quantidade_doses_restantes = models.DecimalField(max_digits=6, decimal_places=2, default=0)
+    data_contagem = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['fechamento', 'bar', 'produto'], name='uniq_fech_item_bar_prod'),
+        ]
+
+    def __str__(self):
+        return f"{self.fechamento} - {self.bar.nome} - {self.produto.nome}"
+
 
 
 from django.contrib.auth.models import User
@@ -179,9 +704,73 @@ class RequisicaoProduto(models.Model):
     motivo_negativa = models.TextField(blank=True, null=True)
     data_decisao = models.DateTimeField(blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            # saída de estoque filtrada só por mês (todos os anos): data_solicitacao__month
+            # não vira faixa, então o índice é da própria expressão (mês no fuso local)
+            models.Index(F('bar'), ExtractMonth('data_solicitacao'), name='ix_req_bar_mes_local'),
+            # histórico, dashboard, saída de estoque e consolidado de diferença: bar + faixa de datas
+            models.Index(fields=['bar', '-data_solicitacao'], name='ix_req_bar_dt_desc'),
+            # tela de aprovação e aprovar_lote: só as pendentes, em ordem de chegada
+            models.Index(fields=['restaurante', 'data_solicitacao', 'id'], name='ix_req_pendentes',
+                         condition=Q(status='PENDENTE')),
+        ]
+
     def __str__(self):
         return f"{self.produto.nome} - {self.quantidade_solicitada} un ({self.status})"
 
+    @classmethod
+    @transaction.atomic
+    def aprovar_lote(cls, requisicoes, usuario) -> list:
+        """Aprova as requisições PENDENTES de `requisicoes` (queryset) em ordem de chegada,
+           transferindo do estoque central de cada restaurante para o bar solicitante
+           via EstoqueBar.transferir_lote. Status gravados com um único bulk_update.
+           Retorna as requisições processadas, já com o status final."""
+        reqs = list(
+            requisicoes
+            .filter(status='PENDENTE')
+            .select_for_update(of=('self',))
+            .select_related('produto', 'bar')
+            .order_by('data_solicitacao', 'id')
+        )
+        if not reqs:
+            return []
+
+        centrais = dict(
+            Bar.objects
+            .filter(restaurante_id__in={r.restaurante_id for r in reqs}, is_estoque_central=True)
+            .values_list('restaurante_id', 'id')
+        )
+
+        agora = timezone.now()
+        itens, a_transferir = [], []
+        for r in reqs:
+            r.usuario_aprovador = usuario
+            r.data_decisao = agora
+            qtd = Decimal(r.quantidade_solicitada or 0)
+            central_id = centrais.get(r.restaurante_id)
+            if qtd <= 0:
+                r.status = 'FALHA_ESTOQUE'
+                r.motivo_negativa = "Quantidade inválida."
+            elif central_id is None:
+                r.status = 'FALHA_ESTOQUE'
+                r.motivo_negativa = "Estoque central não encontrado para o restaurante."
+            else:
+                itens.append((central_id, r.bar_id, r.produto_id, qtd, Decimal('0')))
+                a_transferir.append(r)
+
+        resultados = EstoqueBar.transferir_lote(itens, tipo='REQUISICAO', usuario=usuario)
+        for r, ok in zip(a_transferir, resultados):
+            if ok:
+                r.status = 'APROVADA'
+            else:
+                r.status = 'FALHA_ESTOQUE'
+                r.motivo_negativa = "Produto insuficiente no estoque central."
+
+        cls.objects.bulk_update(reqs, ['status', 'motivo_negativa', 'usuario_aprovador', 'data_decisao'])
+        Restaurante.invalidar_relatorios(bar_ids={r.bar_id for r in reqs})
+        return reqs
+
 
 
 
@@ -209,39 +798,183 @@ class EstoqueBar(models.Model):
         return f"{self.bar.nome} - {self.produto.nome}: {self.quantidade_garrafas} garrafas | {self.quantidade_doses} doses"
 
     @classmethod
-    @transaction.atomic
-    def retirar(cls, bar, produto, garrafas: Decimal = Decimal('0'), doses: Decimal = Decimal('0')) -> bool:
-        """Debita SOMENTE os campos com quantidade > 0.
-           Usa lock de linha + F() para evitar race/lost update."""
+    def movimentar(cls, bar, produto, garrafas: Decimal = Decimal('0'), doses: Decimal = Decimal('0'),
+                   *, tipo: str = 'AJUSTE', usuario=None) -> 'SaldoMovimentado | None':
+        """Aplica um delta (positivo = crédito, negativo = débito) numa ÚNICA instrução SQL:
+           - só créditos: INSERT ... ON CONFLICT DO UPDATE (cria a linha se faltar);
+           - com débito: UPDATE ... WHERE quantidade + delta >= 0 (débito condicional);
+           ambos com RETURNING e com o lançamento no livro de movimentos no mesmo statement.
+           Retorna SaldoMovimentado (antes/depois) ou None se o saldo for insuficiente."""
         garrafas = Decimal(garrafas or 0)
         doses    = Decimal(doses or 0)
+        params = {
+            'bar': getattr(bar, 'pk', bar), 'produto': getattr(produto, 'pk', produto),
+            'g': garrafas, 'd': doses,
+            'tipo': tipo, 'usuario': getattr(usuario, 'pk', usuario), 'momento': timezone.now(),
+            'registrar': garrafas != 0 or doses != 0,
+        }
+        tabela = cls._meta.db_table
+
+        if garrafas >= 0 and doses >= 0:
+            alvo = f"""
+                INSERT INTO {tabela} (bar_id, produto_id, quantidade_garrafas, quantidade_doses)
+                VALUES (%(bar)s, %(produto)s, %(g)s, %(d)s)
+                ON CONFLICT (bar_id, produto_id) DO UPDATE
+                   SET quantidade_garrafas = {tabela}.quantidade_garrafas + EXCLUDED.quantidade_garrafas,
+                       quantidade_doses    = {tabela}.quantidade_doses + EXCLUDED.quantidade_doses
+                RETURNING bar_id, produto_id, quantidade_garrafas, quantidade_doses
+            """
+        else:
+            alvo = f"""
+                UPDATE {tabela}
+                   SET quantidade_garrafas = quantidade_garrafas + %(g)s,
+                       quantidade_doses    = quantidade_doses + %(d)s
+                 WHERE bar_id = %(bar)s AND produto_id = %(produto)s
+                   AND quantidade_garrafas + %(g)s >= 0
+                   AND quantidade_doses + %(d)s >= 0
+                RETURNING bar_id, produto_id, quantidade_garrafas, quantidade_doses
+            """
+        sql = f"""
+            WITH alvo AS ({alvo}),
+            mov AS (
+                INSERT INTO {MovimentoEstoque._meta.db_table}
+                       (bar_id, produto_id, tipo, delta_garrafas, delta_doses, usuario_id, data_movimento)
+                SELECT bar_id, produto_id, %(tipo)s, %(g)s, %(d)s, %(usuario)s, %(momento)s
+                  FROM alvo
+                 WHERE %(registrar)s
+            )
+            SELECT quantidade_garrafas, quantidade_doses FROM alvo
+        """
+        with connection.cursor() as cur:
+            cur.execute(sql, params)
+            row = cur.fetchone()
+        if row is None:
+            return None
+        Restaurante.invalidar_relatorios(bar_ids=[params['bar']])
+        depois_g, depois_d = row
+        return SaldoMovimentado(depois_g - garrafas, depois_d - doses, depois_g, depois_d)
 
-        est, _ = (cls.objects
-                  .select_for_update()
-                  .get_or_create(bar=bar, produto=produto,
-                                 defaults={'quantidade_garrafas': Decimal('0'),
-                                           'quantidade_doses': Decimal('0')}))
+    @classmethod
+    def retirar(cls, bar, produto, garrafas: Decimal = Decimal('0'), doses: Decimal = Decimal('0'),
+                *, tipo: str = 'AJUSTE', usuario=None) -> bool:
+        """Debita SOMENTE os campos com quantidade > 0, de forma condicional
+           (uma instrução: UPDATE ... WHERE quantidade >= x). O débito é
+           registrado no livro de movimentos (MovimentoEstoque)."""
+        garrafas = max(Decimal(garrafas or 0), Decimal('0'))
+        doses    = max(Decimal(doses or 0), Decimal('0'))
+        return cls.movimentar(bar, produto, -garrafas, -doses, tipo=tipo, usuario=usuario) is not None
 
-        # validações por campo (independentes)
-        if garrafas > 0 and est.quantidade_garrafas < garrafas:
-            return False
-        if doses > 0 and est.quantidade_doses < doses:
-            return False
+    @classmethod
+    def adicionar(cls, bar, produto, garrafas: Decimal = Decimal('0'), doses: Decimal = Decimal('0'),
+                  *, tipo: str = 'AJUSTE', usuario=None) -> None:
+        garrafas = max(Decimal(garrafas or 0), Decimal('0'))
+        doses    = max(Decimal(doses or 0), Decimal('0'))
+        cls.movimentar(bar, produto, garrafas, doses, tipo=tipo, usuario=usuario)
 
-        # atualizações atômicas
-        if garrafas > 0:
-            cls.objects.filter(pk=est.pk).update(
-                quantidade_garrafas=F('quantidade_garrafas') - garrafas
+    @classmethod
+    def adicionar_lote(cls, bar, itens: dict, *, tipo: str = 'AJUSTE', usuario=None) -> int:
+        """Credita vários produtos no mesmo bar numa ÚNICA instrução:
+           INSERT ... SELECT unnest(...) ON CONFLICT DO UPDATE, com os lançamentos
+           do livro de movimentos no mesmo statement.
+           `itens` = {produto_id: (garrafas, doses)}; valores <= 0 são ignorados.
+           Retorna o número de linhas de estoque afetadas."""
+        produtos, gs, ds = [], [], []
+        for produto_id, (garrafas, doses) in itens.items():
+            garrafas = max(Decimal(garrafas or 0), Decimal('0'))
+            doses    = max(Decimal(doses or 0), Decimal('0'))
+            if garrafas == 0 and doses == 0:
+                continue
+            produtos.append(int(getattr(produto_id, 'pk', produto_id)))
+            gs.append(garrafas)
+            ds.append(doses)
+        if not produtos:
+            return 0
+
+        tabela = cls._meta.db_table
+        sql = f"""
+            WITH entrada AS (
+                SELECT * FROM unnest(%(produtos)s::bigint[], %(g)s::numeric[], %(d)s::numeric[])
+                       AS t(produto_id, g, d)
+            ),
+            alvo AS (
+                INSERT INTO {tabela} (bar_id, produto_id, quantidade_garrafas, quantidade_doses)
+                SELECT %(bar)s, produto_id, g, d FROM entrada
+                ORDER BY produto_id
+                ON CONFLICT (bar_id, produto_id) DO UPDATE
+                   SET quantidade_garrafas = {tabela}.quantidade_garrafas + EXCLUDED.quantidade_garrafas,
+                       quantidade_doses    = {tabela}.quantidade_doses + EXCLUDED.quantidade_doses
+                RETURNING produto_id
+            ),
+            mov AS (
+                INSERT INTO {MovimentoEstoque._meta.db_table}
+                       (bar_id, produto_id, tipo, delta_garrafas, delta_doses, usuario_id, data_movimento)
+                SELECT %(bar)s, produto_id, %(tipo)s, g, d, %(usuario)s, %(momento)s
+                  FROM entrada
             )
-        if doses > 0:
-            cls.objects.filter(pk=est.pk).update(
-                quantidade_doses=F('quantidade_doses') - doses
+            SELECT count(*) FROM alvo
+        """
+        params = {
+            'bar': getattr(bar, 'pk', bar),
+            'produtos': produtos, 'g': gs, 'd': ds,
+            'tipo': tipo, 'usuario': getattr(usuario, 'pk', usuario), 'momento': timezone.now(),
+        }
+        with connection.cursor() as cur:
+            cur.execute(sql, params)
+            afetadas = cur.fetchone()[0]
+        Restaurante.invalidar_relatorios(bar_ids=[params['bar']])
+        return afetadas
+
+    @classmethod
+    def criar_faltantes(cls, bar_ids, produto_ids, garrafas: Decimal = Decimal('0'),
+                        doses: Decimal = Decimal('0'), *, tipo: str = 'AJUSTE', usuario=None) -> int:
+        """Cria, com o saldo inicial informado, as linhas (bar, produto) que ainda não
+           existem — INSERT ... ON CONFLICT DO NOTHING RETURNING — e lança no livro de
+           movimentos só as que foram de fato inseridas, no mesmo statement.
+           Retorna quantas linhas foram criadas."""
+        garrafas = max(Decimal(garrafas or 0), Decimal('0'))
+        doses    = max(Decimal(doses or 0), Decimal('0'))
+        bar_ids = sorted({int(getattr(b, 'pk', b)) for b in bar_ids})
+        produto_ids = sorted({int(getattr(p, 'pk', p)) for p in produto_ids})
+        if not bar_ids or not produto_ids:
+            return 0
+
+        tabela = cls._meta.db_table
+        sql = f"""
+            WITH alvo AS (
+                INSERT INTO {tabela} (bar_id, produto_id, quantidade_garrafas, quantidade_doses)
+                SELECT b, p, %(g)s, %(d)s
+                  FROM unnest(%(bares)s::bigint[]) AS b CROSS JOIN unnest(%(produtos)s::bigint[]) AS p
+                 ORDER BY b, p
+                ON CONFLICT (bar_id, produto_id) DO NOTHING
+                RETURNING bar_id, produto_id
+            ),
+            mov AS (
+                INSERT INTO {MovimentoEstoque._meta.db_table}
+                       (bar_id, produto_id, tipo, delta_garrafas, delta_doses, usuario_id, data_movimento)
+                SELECT bar_id, produto_id, %(tipo)s, %(g)s, %(d)s, %(usuario)s, %(momento)s
+                  FROM alvo
+                 WHERE %(registrar)s
             )
-        return True
+            SELECT count(*) FROM alvo
+        """
+        params = {
+            'bares': bar_ids, 'produtos': produto_ids, 'g': garrafas, 'd': doses,
+            'tipo': tipo, 'usuario': getattr(usuario, 'pk', usuario), 'momento': timezone.now(),
+            'registrar': garrafas != 0 or doses != 0,
+        }
+        with connection.cursor() as cur:
+            cur.execute(sql, params)
+            criadas = cur.fetchone()[0]
+        if criadas:
+            Restaurante.invalidar_relatorios(bar_ids=bar_ids)
+        return criadas
 
     @classmethod
     @transaction.atomic
-    def adicionar(cls, bar, produto, garrafas: Decimal = Decimal('0'), doses: Decimal = Decimal('0')) -> None:
+    def definir(cls, bar, produto, garrafas: Decimal = Decimal('0'), doses: Decimal = Decimal('0'),
+                *, tipo: str = 'CONTAGEM', usuario=None) -> None:
+        """Sobrescreve o saldo (ex.: contagem física) e lança a diferença
+           como ajuste no livro de movimentos."""
         garrafas = Decimal(garrafas or 0)
         doses    = Decimal(doses or 0)
 
@@ -250,57 +983,333 @@ class EstoqueBar(models.Model):
                   .get_or_create(bar=bar, produto=produto,
                                  defaults={'quantidade_garrafas': Decimal('0'),
                                            'quantidade_doses': Decimal('0')}))
-        if garrafas > 0:
-            cls.objects.filter(pk=est.pk).update(
-                quantidade_garrafas=F('quantidade_garrafas') + garrafas
-            )
-        if doses > 0:
-            cls.objects.filter(pk=est.pk).update(
-                quantidade_doses=F('quantidade_doses') + doses
-            )
+        delta_g = garrafas - Decimal(est.quantidade_garrafas)
+        delta_d = doses - Decimal(est.quantidade_doses)
+
+        cls.objects.filter(pk=est.pk).update(
+            quantidade_garrafas=garrafas,
+            quantidade_doses=doses,
+        )
+        MovimentoEstoque.registrar(bar, produto, garrafas=delta_g, doses=delta_d,
+                                   tipo=tipo, usuario=usuario)
+        Restaurante.invalidar_relatorios(bar_ids=[est.bar_id])
 
     @classmethod
     @transaction.atomic
+    def definir_lote(cls, bar, itens: dict, *, tipo: str = 'CONTAGEM', usuario=None, momento=None) -> int:
+        """Versão em lote de `definir`: trava os saldos atuais numa consulta,
+           sobrescreve todos com um único INSERT ... ON CONFLICT DO UPDATE e lança
+           no livro de movimentos (bulk_create) só as diferenças != 0.
+           `itens` = {produto_id: (garrafas, doses)}. Retorna o nº de linhas gravadas."""
+        bar_id = getattr(bar, 'pk', bar)
+        novos = {
+            int(getattr(pid, 'pk', pid)): (Decimal(g or 0), Decimal(d or 0))
+            for pid, (g, d) in itens.items()
+        }
+        if not novos:
+            return 0
+        momento = momento or timezone.now()
+
+        atuais = {
+            pid: (g, d)
+            for pid, g, d in (cls.objects
+                              .select_for_update()
+                              .filter(bar_id=bar_id, produto_id__in=novos)
+                              .order_by('produto_id')
+                              .values_list('produto_id', 'quantidade_garrafas', 'quantidade_doses'))
+        }
+
+        produtos = sorted(novos)
+        tabela = cls._meta.db_table
+        sql = f"""
+            INSERT INTO {tabela} (bar_id, produto_id, quantidade_garrafas, quantidade_doses)
+            SELECT %(bar)s, produto_id, g, d
+              FROM unnest(%(produtos)s::bigint[], %(g)s::numeric[], %(d)s::numeric[]) AS t(produto_id, g, d)
+            ON CONFLICT (bar_id, produto_id) DO UPDATE
+               SET quantidade_garrafas = EXCLUDED.quantidade_garrafas,
+                   quantidade_doses    = EXCLUDED.quantidade_doses
+        """
+        with connection.cursor() as cur:
+            cur.execute(sql, {
+                'bar': bar_id, 'produtos': produtos,
+                'g': [novos[pid][0] for pid in produtos],
+                'd': [novos[pid][1] for pid in produtos],
+            })
+            gravadas = cur.rowcount
+
+        zero = (Decimal('0'), Decimal('0'))
+        movimentos = [
+            MovimentoEstoque.novo(bar_id, pid,
+                                  garrafas=novos[pid][0] - atuais.get(pid, zero)[0],
+                                  doses=novos[pid][1] - atuais.get(pid, zero)[1],
+                                  tipo=tipo, usuario=usuario, momento=momento)
+            for pid in produtos
+        ]
+        MovimentoEstoque.objects.bulk_create([m for m in movimentos if m is not None], batch_size=2000)
+        Restaurante.invalidar_relatorios(bar_ids=[bar_id])
+        return gravadas
+
+    @classmethod
     def transferir(cls, origem, destino, produto,
-                   garrafas: Decimal = Decimal('0'), doses: Decimal = Decimal('0')) -> bool:
-        """Débito e crédito na MESMA transação e com as duas linhas travadas."""
+                   garrafas: Decimal = Decimal('0'), doses: Decimal = Decimal('0'),
+                   *, tipo: str = 'TRANSFERENCIA', usuario=None) -> bool:
+        """Débito e crédito na MESMA transação e com as duas linhas travadas
+           (em ordem fixa, via transferir_lote)."""
+        return cls.transferir_lote(
+            [(getattr(origem, 'pk', origem), getattr(destino, 'pk', destino),
+              getattr(produto, 'pk', produto), garrafas, doses)],
+            tipo=tipo, usuario=usuario,
+        )[0]
+
+    @classmethod
+    def _travar(cls, chaves) -> dict:
+        """Linhas existentes de `chaves` [(bar_id, produto_id)], travadas num único
+           SELECT ... FOR UPDATE em ordem fixa (bar, produto): evita deadlock entre lotes."""
+        if not chaves:
+            return {}
+        filtro = Q()
+        for b, p in chaves:
+            filtro |= Q(bar_id=b, produto_id=p)
+        return {
+            (e.bar_id, e.produto_id): e
+            for e in cls.objects.select_for_update().filter(filtro).order_by('bar_id', 'produto_id')
+        }
+
+    @classmethod
+    @transaction.atomic
+    def transferir_lote(cls, itens, *, tipo: str = 'TRANSFERENCIA', usuario=None) -> list:
+        """Transferências em lote.
+           itens: sequência de (origem_id, destino_id, produto_id, garrafas, doses),
+           já na ordem de prioridade (quem vem primeiro é atendido primeiro).
+           Trava as linhas existentes num único SELECT ... FOR UPDATE ordenado, decide
+           em memória (origem sem linha = saldo zero) e só então cria as linhas de
+           destino que faltam — apenas para as transferências atendidas. Débitos e
+           créditos vão num único UPDATE (bulk_update).
+           Retorna list[bool] alinhada com `itens`."""
+        itens = [(o, d, p, max(Decimal(g or 0), Decimal('0')), max(Decimal(dd or 0), Decimal('0')))
+                 for o, d, p, g, dd in itens]
+        if not itens:
+            return []
+
+        chaves = sorted({(o, p) for o, _, p, _, _ in itens} | {(d, p) for _, d, p, _, _ in itens})
+        linhas = cls._travar(chaves)
+
+        zero = (Decimal('0'), Decimal('0'))
+        saldos = {k: (e.quantidade_garrafas, e.quantidade_doses) for k, e in linhas.items()}
+        deltas = defaultdict(lambda: zero)
+        resultado, movimentos = [], []
+        for o, d, p, g, dd in itens:
+            saldo_g, saldo_d = saldos.get((o, p), zero)
+            if saldo_g < g or saldo_d < dd:
+                resultado.append(False)
+                continue
+            for chave, sinal in (((o, p), -1), ((d, p), 1)):
+                atual_g, atual_d = saldos.get(chave, zero)
+                saldos[chave] = (atual_g + sinal * g, atual_d + sinal * dd)
+                delta_g, delta_d = deltas[chave]
+                deltas[chave] = (delta_g + sinal * g, delta_d + sinal * dd)
+            movimentos.append(MovimentoEstoque.novo(o, p, garrafas=-g, doses=-dd, tipo=tipo, usuario=usuario))
+            movimentos.append(MovimentoEstoque.novo(d, p, garrafas=g, doses=dd, tipo=tipo, usuario=usuario))
+            resultado.append(True)
+
+        alteradas = sorted(k for k, (g, d) in deltas.items() if g or d)
+        if alteradas:
+            # linhas de destino que ainda não existem: só as das transferências atendidas
+            faltantes = [k for k in alteradas if k not in linhas]
+            if faltantes:
+                cls.objects.bulk_create([cls(bar_id=b, produto_id=p) for b, p in faltantes],
+                                        ignore_conflicts=True, batch_size=2000)
+                linhas.update(cls._travar(faltantes))
+            for chave in alteradas:
+                linha = linhas[chave]
+                linha.quantidade_garrafas += deltas[chave][0]
+                linha.quantidade_doses    += deltas[chave][1]
+            cls.objects.bulk_update([linhas[k] for k in alteradas], ['quantidade_garrafas', 'quantidade_doses'])
+            MovimentoEstoque.objects.bulk_create([m for m in movimentos if m is not None], batch_size=2000)
+            Restaurante.invalidar_relatorios(bar_ids={b for b, _ in alteradas})
+        return resultado
+
+
+
+
+class MovimentoEstoque(models.Model):
+    """Livro de movimentos do estoque (append-only).
+       Toda alteração em EstoqueBar gera uma linha com o delta aplicado."""
+    TIPOS = (
+        ('ENTRADA', 'Entrada de mercadoria'),
+        ('TRANSFERENCIA', 'Transferência entre bares'),
+        ('REQUISICAO', 'Requisição aprovada'),
+        ('PERDA', 'Perda'),
+        ('ESTORNO_PERDA', 'Estorno de perda'),
+        ('CONTAGEM', 'Ajuste por contagem'),
+        ('AJUSTE', 'Ajuste manual'),
+    )
+
+    bar = models.ForeignKey(Bar, on_delete=models.CASCADE, related_name='movimentos')
+    produto = models.ForeignKey(Produto, on_delete=models.CASCADE, related_name='movimentos')
+    tipo = models.CharField(max_length=20, choices=TIPOS)
+    delta_garrafas = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0'))
+    delta_doses    = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0'))
+    usuario = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    data_movimento = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['-data_movimento', '-id']
+        indexes = [
+            # saldo num instante: checkpoint + soma dos deltas da janela
+            models.Index(fields=['bar', 'produto', 'data_movimento'], name='ix_mov_bar_prod_data'),
+            models.Index(fields=['data_movimento'], name='ix_mov_data'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} | {self.bar.nome} | {self.produto.nome}: {self.delta_garrafas} g / {self.delta_doses} d"
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("MovimentoEstoque é somente inclusão; lance um novo movimento para corrigir.")
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValueError("MovimentoEstoque é somente inclusão; lance um novo movimento para corrigir.")
+
+    @classmethod
+    def novo(cls, bar, produto, garrafas=Decimal('0'), doses=Decimal('0'), *,
+             tipo='AJUSTE', usuario=None, momento=None):
+        """Monta (sem salvar) o movimento; devolve None se não houver delta.
+           bar/produto podem ser instâncias ou ids."""
         garrafas = Decimal(garrafas or 0)
         doses    = Decimal(doses or 0)
+        if garrafas == 0 and doses == 0:
+            return None
+        return cls(
+            bar_id=getattr(bar, 'pk', bar), produto_id=getattr(produto, 'pk', produto), tipo=tipo,
+            delta_garrafas=garrafas, delta_doses=doses,
+            usuario=usuario, data_movimento=momento or timezone.now(),
+        )
 
-        # trava as duas linhas envolvidas
-        est_origem, _ = (cls.objects.select_for_update()
-                         .get_or_create(bar=origem, produto=produto,
-                                        defaults={'quantidade_garrafas': Decimal('0'),
-                                                  'quantidade_doses': Decimal('0')}))
-        est_dest, _   = (cls.objects.select_for_update()
-                         .get_or_create(bar=destino, produto=produto,
-                                        defaults={'quantidade_garrafas': Decimal('0'),
-                                                  'quantidade_doses': Decimal('0')}))
-
-        # checa disponibilidade independente
-        if garrafas > 0 and est_origem.quantidade_garrafas < garrafas:
-            return False
-        if doses > 0 and est_origem.quantidade_doses < doses:
-            return False
-
-        # faz as duas pernas com F() (atômico)
-        if garrafas > 0:
-            cls.objects.filter(pk=est_origem.pk).update(
-                quantidade_garrafas=F('quantidade_garrafas') - garrafas
-            )
-            cls.objects.filter(pk=est_dest.pk).update(
-                quantidade_garrafas=F('quantidade_garrafas') + garrafas
-            )
-        if doses > 0:
-            cls.objects.filter(pk=est_origem.pk).update(
-                quantidade_doses=F('quantidade_doses') - doses
-            )
-            cls.objects.filter(pk=est_dest.pk).update(
-                quantidade_doses=F('quantidade_doses') + doses
+    @classmethod
+    def registrar(cls, bar, produto, garrafas=Decimal('0'), doses=Decimal('0'), *,
+                  tipo='AJUSTE', usuario=None, momento=None):
+        mov = cls.novo(bar, produto, garrafas, doses, tipo=tipo, usuario=usuario, momento=momento)
+        if mov is not None:
+            mov.save()
+        return mov
+
+    @classmethod
+    def saldo_em(cls, bar, produto, momento):
+        """Saldo (garrafas, doses) de um bar/produto no instante `momento`:
+           último checkpoint <= momento + soma dos deltas posteriores a ele."""
+        ck = (CheckpointEstoque.objects
+              .filter(bar=bar, produto=produto, data_referencia__lte=momento)
+              .order_by('-data_referencia')
+              .first())
+        movs = cls.objects.filter(bar=bar, produto=produto, data_movimento__lte=momento)
+        g = d = Decimal('0')
+        if ck:
+            movs = movs.filter(data_movimento__gt=ck.data_referencia)
+            g, d = ck.quantidade_garrafas, ck.quantidade_doses
+        agg = movs.aggregate(g=Sum('delta_garrafas'), d=Sum('delta_doses'))
+        return g + (agg['g'] or Decimal('0')), d + (agg['d'] or Decimal('0'))
+
+    @classmethod
+    def saldos_em(cls, momento, bar_ids=None, produto_ids=None):
+        """Versão em lote de saldo_em: {(bar_id, produto_id): (g, d)} numa query só."""
+        filtros_ck, filtros_mov, params_ck, params_mov = [], [], [], []
+        if bar_ids is not None:
+            filtros_ck.append('bar_id = ANY(%s)'); params_ck.append(list(bar_ids))
+            filtros_mov.append('m.bar_id = ANY(%s)'); params_mov.append(list(bar_ids))
+        if produto_ids is not None:
+            filtros_ck.append('produto_id = ANY(%s)'); params_ck.append(list(produto_ids))
+            filtros_mov.append('m.produto_id = ANY(%s)'); params_mov.append(list(produto_ids))
+        extra_ck = ''.join(f' AND {f}' for f in filtros_ck)
+        extra_mov = ''.join(f' AND {f}' for f in filtros_mov)
+
+        sql = f"""
+            WITH ck AS (
+                SELECT DISTINCT ON (bar_id, produto_id)
+                       bar_id, produto_id, data_referencia, quantidade_garrafas, quantidade_doses
+                  FROM {CheckpointEstoque._meta.db_table}
+                 WHERE data_referencia <= %s{extra_ck}
+                 ORDER BY bar_id, produto_id, data_referencia DESC
+            ), mov AS (
+                SELECT m.bar_id, m.produto_id,
+                       SUM(m.delta_garrafas) AS g, SUM(m.delta_doses) AS d
+                  FROM {cls._meta.db_table} m
+                  LEFT JOIN ck ON ck.bar_id = m.bar_id AND ck.produto_id = m.produto_id
+                 WHERE m.data_movimento <= %s{extra_mov}
+                   AND (ck.data_referencia IS NULL OR m.data_movimento > ck.data_referencia)
+                 GROUP BY m.bar_id, m.produto_id
             )
-        return True
+            SELECT COALESCE(ck.bar_id, mov.bar_id), COALESCE(ck.produto_id, mov.produto_id),
+                   COALESCE(ck.quantidade_garrafas, 0) + COALESCE(mov.g, 0),
+                   COALESCE(ck.quantidade_doses, 0) + COALESCE(mov.d, 0)
+              FROM ck FULL OUTER JOIN mov
+                ON mov.bar_id = ck.bar_id AND mov.produto_id = ck.produto_id
+        """
+        with connection.cursor() as cur:
+            cur.execute(sql, [momento, *params_ck, momento, *params_mov])
+            return {(b, p): (g, d) for b, p, g, d in cur.fetchall()}
+
 
+class CheckpointEstoque(models.Model):
+    """Saldo consolidado por bar/produto num instante (gerado periodicamente),
+       para que o saldo histórico não precise somar o livro desde o início."""
+    bar = models.ForeignKey(Bar, on_delete=models.CASCADE, related_name='checkpoints_estoque')
+    produto = models.ForeignKey(Produto, on_delete=models.CASCADE, related_name='checkpoints_estoque')
+    data_referencia = models.DateTimeField()
+    quantidade_garrafas = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0'))
+    quantidade_doses    = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0'))
+    criado_em = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        ordering = ['-data_referencia']
+        constraints = [
+            models.UniqueConstraint(fields=['bar', 'produto', 'data_referencia'], name='uniq_ckpt_bar_prod_data'),
+        ]
+        indexes = [
+            models.Index(fields=['bar', 'produto', '-data_referencia'], name='ix_ckpt_bar_prod_dt_desc'),
+        ]
+
+    def __str__(self):
+        return f"{self.bar.nome} - {self.produto.nome} @ {self.data_referencia:%d/%m/%Y %H:%M}"
+
+    @classmethod
+    def gerar(cls, momento=None) -> int:
+        """Gera checkpoints em `momento` (padrão: agora) para os pares que tiveram
+           movimento desde o checkpoint anterior. Um único INSERT ... SELECT.
+           Retorna a quantidade de checkpoints criados."""
+        momento = momento or timezone.now()
+        ck_table = cls._meta.db_table
+        mov_table = MovimentoEstoque._meta.db_table
+        sql = f"""
+            WITH ck AS (
+                SELECT DISTINCT ON (bar_id, produto_id)
+                       bar_id, produto_id, data_referencia, quantidade_garrafas, quantidade_doses
+                  FROM {ck_table}
+                 WHERE data_referencia <= %s
+                 ORDER BY bar_id, produto_id, data_referencia DESC
+            ), mov AS (
+                SELECT m.bar_id, m.produto_id,
+                       SUM(m.delta_garrafas) AS g, SUM(m.delta_doses) AS d
+                  FROM {mov_table} m
+                  LEFT JOIN ck ON ck.bar_id = m.bar_id AND ck.produto_id = m.produto_id
+                 WHERE m.data_movimento <= %s
+                   AND (ck.data_referencia IS NULL OR m.data_movimento > ck.data_referencia)
+                 GROUP BY m.bar_id, m.produto_id
+            )
+            INSERT INTO {ck_table}
+                   (bar_id, produto_id, data_referencia, quantidade_garrafas, quantidade_doses, criado_em)
+            SELECT mov.bar_id, mov.produto_id, %s,
+                   COALESCE(ck.quantidade_garrafas, 0) + mov.g,
+                   COALESCE(ck.quantidade_doses, 0) + mov.d,
+                   %s
+              FROM mov
+              LEFT JOIN ck ON ck.bar_id = mov.bar_id AND ck.produto_id = mov.produto_id
+            ON CONFLICT (bar_id, produto_id, data_referencia) DO NOTHING
+        """
+        with connection.cursor() as cur:
+            cur.execute(sql, [momento, momento, momento, timezone.now()])
+            return cur.rowcount
 
 
 class AcessoUsuarioBar(models.Model):
@@ -353,6 +1362,12 @@ class Evento(models.Model):
     class Meta:
         indexes = [
             models.Index(fields=['data_evento', 'baixado_estoque']),
+            # consolidado dos finalizados (hoje / depois das 06:00)
+            models.Index(fields=['status', 'finalizado_em'], name='ix_evento_status_fim'),
+            # lista de eventos em aberto, na ordem da página
+            models.Index(fields=['data_evento', 'data_criacao'], name='ix_evento_abertos',
+                         condition=~Q(status='FINALIZADO')),
+            GinIndex(OpClass(SemAcento('nome'), name='gin_trgm_ops'), name='ix_evento_nome_trgm'),
         ]
 
 
@@ -383,6 +1398,13 @@ class Alimento(models.Model):
     codigo = models.CharField(max_length=30, unique=True)  # usado no autocomplete
     unidade = models.CharField(max_length=10, choices=UNIDADE_CHOICES, default='un')
     ativo = models.BooleanField(default=True)
+    atualizado_em = models.DateTimeField(auto_now=True)  # versão do catálogo
+
+    class Meta:
+        indexes = [
+            GinIndex(OpClass(SemAcento('nome'), name='gin_trgm_ops'), name='ix_alimento_nome_trgm'),
+            GinIndex(OpClass(SemAcento('codigo'), name='gin_trgm_ops'), name='ix_alimento_codigo_trgm'),
+        ]
 
     def __str__(self):
         return f"[{self.codigo}] {self.nome}"
@@ -476,7 +1498,168 @@ class PerdaProduto(models.Model):
         ordering = ['-data_registro']
         indexes = [
             models.Index(fields=['baixado', 'data_registro']),
+            # detalhe do relatório de perdas: restaurante + janela de datas, paginado por (data, id)
+            models.Index(fields=['restaurante', '-data_registro', '-id'], name='ix_perda_rest_dt_desc'),
         ]
 
     def __str__(self):
-        return f"{self.bar.nome} | {self.produto.nome} (-{self.garrafas} garrafas, -{self.doses} doses)"
\ No newline at end of file
+        return f"{self.bar.nome} | {self.produto.nome} (-{self.garrafas} garrafas, -{self.doses} doses)"
+
+
+class TarefaExportacao(models.Model):
+    """Exportação Excel gerada fora do request por um worker local
+       (manage.py processar_exportacoes); a tela acompanha pelo status e baixa o
+       arquivo do storage. Pedidos com a mesma `chave` (core/exportacoes.chave) em
+       andamento ou concluídos há pouco reaproveitam a tarefa e o arquivo."""
+    STATUS_CHOICES = (
+        ('PENDENTE', 'Pendente'),
+        ('PROCESSANDO', 'Processando'),
+        ('CONCLUIDA', 'Concluída'),
+        ('ERRO', 'Erro'),
+    )
+    ATIVOS = ('PENDENTE', 'PROCESSANDO')
+    _proxima_limpeza = 0.0  # monotonic(): ver limpar_se_preciso
+
+    tipo = models.CharField(max_length=30)
+    chave = models.CharField(max_length=64)
+    parametros = models.TextField(blank=True)   # querystring do pedido
+    restaurante = models.ForeignKey(Restaurante, on_delete=models.CASCADE, null=True, blank=True)
+    bar = models.ForeignKey(Bar, on_delete=models.CASCADE, null=True, blank=True)
+    usuario = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+
+    status = models.CharField(max_length=12, choices=STATUS_CHOICES, default='PENDENTE')
+    progresso = models.PositiveSmallIntegerField(default=0)
+    arquivo = models.FileField(upload_to='exportacoes/%Y/%m/', blank=True)
+    nome_arquivo = models.CharField(max_length=200, blank=True)
+    erro = models.TextField(blank=True)
+
+    criado_em = models.DateTimeField(auto_now_add=True)
+    iniciado_em = models.DateTimeField(null=True, blank=True)
+    concluido_em = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-criado_em']
+        indexes = [
+            models.Index(fields=['chave', 'status'], name='ix_export_chave'),
+            models.Index(fields=['status', 'criado_em'], name='ix_export_fila'),
+        ]
+        constraints = [
+            # no máximo uma tarefa ativa por chave, mesmo com pedidos simultâneos
+            models.UniqueConstraint(fields=['chave'], condition=Q(status__in=('PENDENTE', 'PROCESSANDO')),
+                                    name='uniq_export_chave_ativa'),
+        ]
+
+    def __str__(self):
+        return f"Exportação {self.tipo} #{self.pk} ({self.get_status_display()})"
+
+    @staticmethod
+    def _recente():
+        return timezone.now() - timedelta(seconds=getattr(settings, 'EXPORTACAO_REAPROVEITAR', 900))
+
+    @classmethod
+    def solicitar(cls, *, tipo, chave, parametros='', usuario=None, restaurante_id=None, bar_id=None):
+        """Tarefa ativa ou concluída há menos de EXPORTACAO_REAPROVEITAR segundos com a
+           mesma chave; senão enfileira uma nova. Retorna (tarefa, criada)."""
+        recente = cls._recente()
+        existente = (cls.objects
+                     .filter(Q(status__in=cls.ATIVOS) | Q(status='CONCLUIDA', concluido_em__gte=recente),
+                             chave=chave)
+                     .order_by('-criado_em').first())
+        if existente is not None:
+            return existente, False
+        try:
+            with transaction.atomic():
+                return cls.objects.create(
+                    tipo=tipo, chave=chave, parametros=parametros, usuario=usuario,
+                    restaurante_id=restaurante_id, bar_id=bar_id,
+                ), True
+        except IntegrityError:  # pedido igual enfileirado entre a busca e o INSERT
+            return cls.objects.get(chave=chave, status__in=cls.ATIVOS), False
+
+    @classmethod
+    def guardada(cls, chave):
+        """Arquivo concluído há menos de EXPORTACAO_REAPROVEITAR segundos com esta chave
+           (pela fila ou por um download direto), ou None."""
+        return (cls.objects.filter(chave=chave, status='CONCLUIDA', concluido_em__gte=cls._recente())
+                .exclude(arquivo='').order_by('-concluido_em').first())
+
+    @classmethod
+    def guardar(cls, arquivo, nome_arquivo, *, tipo, chave, parametros='', usuario=None,
+                restaurante_id=None, bar_id=None):
+        """Registra, já concluída, uma exportação gerada no próprio request (download
+           direto): o arquivo vai para o storage e serve os próximos pedidos iguais."""
+        agora = timezone.now()
+        tarefa = cls(
+            tipo=tipo, chave=chave, parametros=parametros, usuario=usuario,
+            restaurante_id=restaurante_id, bar_id=bar_id, status='CONCLUIDA', progresso=100,
+            nome_arquivo=nome_arquivo, iniciado_em=agora, concluido_em=agora,
+        )
+        tarefa.arquivo.save(nome_arquivo, File(arquivo))  # save=True: grava a linha junto
+        cls.limpar_se_preciso()
+        return tarefa
+
+    @classmethod
+    def reservar(cls):
+        """Próxima tarefa da fila, já marcada PROCESSANDO. SKIP LOCKED deixa vários
+           workers rodarem juntos; tarefas PROCESSANDO há mais de
+           EXPORTACAO_TEMPO_MAXIMO segundos (worker interrompido) voltam para a fila."""
+        abandonada = timezone.now() - timedelta(seconds=getattr(settings, 'EXPORTACAO_TEMPO_MAXIMO', 1800))
+        with transaction.atomic():
+            tarefa = (cls.objects.select_for_update(skip_locked=True)
+                      .filter(Q(status='PENDENTE') | Q(status='PROCESSANDO', iniciado_em__lt=abandonada))
+                      .order_by('criado_em').first())
+            if tarefa is None:
+                return None
+            tarefa.status = 'PROCESSANDO'
+            tarefa.progresso = 0
+            tarefa.iniciado_em = timezone.now()
+            tarefa.save(update_fields=['status', 'progresso', 'iniciado_em'])
+        return tarefa
+
+    def atualizar_progresso(self, pct):
+        """Grava o progresso (0–99) só quando muda: no máximo ~100 UPDATEs por tarefa."""
+        pct = max(0, min(99, int(pct)))
+        if pct != self.progresso:
+            self.progresso = pct
+            type(self).objects.filter(pk=self.pk).update(progresso=pct)
+
+    def concluir(self, arquivo, nome_arquivo):
+        self.arquivo.save(nome_arquivo, File(arquivo), save=False)
+        self.nome_arquivo = nome_arquivo
+        self.status = 'CONCLUIDA'
+        self.progresso = 100
+        self.concluido_em = timezone.now()
+        self.save(update_fields=['arquivo', 'nome_arquivo', 'status', 'progresso', 'concluido_em'])
+
+    def falhar(self, erro):
+        self.status = 'ERRO'
+        self.erro = str(erro)[:2000]
+        self.concluido_em = timezone.now()
+        self.save(update_fields=['status', 'erro', 'concluido_em'])
+
+    @classmethod
+    def limpar_antigas(cls, horas=None):
+        """Apaga tarefas encerradas há mais de `horas` horas (padrão:
+           EXPORTACAO_MANTER_HORAS, 24) e seus arquivos. Retorna quantas."""
+        if horas is None:
+            horas = getattr(settings, 'EXPORTACAO_MANTER_HORAS', 24)
+        limite = timezone.now() - timedelta(hours=horas)
+        antigas = cls.objects.filter(status__in=('CONCLUIDA', 'ERRO'), concluido_em__lt=limite)
+        total = 0
+        for tarefa in antigas.iterator():
+            if tarefa.arquivo:
+                tarefa.arquivo.delete(save=False)
+            tarefa.delete()
+            total += 1
+        return total
+
+    @classmethod
+    def limpar_se_preciso(cls):
+        """limpar_antigas no máximo a cada EXPORTACAO_LIMPEZA_INTERVALO segundos (por
+           processo). Chamada ao guardar downloads diretos e pelo worker ocioso: a
+           retenção vale com ou sem o worker rodando."""
+        agora = monotonic()
+        if agora < cls._proxima_limpeza:
+            return 0
+        cls._proxima_limpeza = agora + getattr(settings, 'EXPORTACAO_LIMPEZA_INTERVALO', 3600)
+        return cls.limpar_antigas()
@@ -0,0 +1,128 @@
+# core/planilhas.py
+"""Exportação Excel em streaming, com memória constante.
+
+   O xlsxwriter em modo `constant_memory` mantém só a linha corrente de cada aba;
+   o arquivo final vai para um SpooledTemporaryFile (memória até
+   EXPORTACAO_SPOOL_MAX_BYTES, disco acima disso) e sai em blocos por FileResponse.
+   As larguras das colunas são calculadas enquanto as linhas são escritas, sem a
+   segunda passada sobre as células que o openpyxl exige (auto_fit).
+
+   Restrição do modo: em cada aba as linhas só podem ser escritas em ordem
+   crescente. Abas diferentes podem ser intercaladas à vontade."""
+
+import tempfile
+from datetime import date, datetime
+from decimal import Decimal
+
+import xlsxwriter
+from django.conf import settings
+from django.http import FileResponse
+
+CONTENT_TYPE_XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# formatos reaproveitados pelos exportadores (equivalentes aos estilos openpyxl das views)
+TITULO = {'bold': True, 'font_size': 14}
+SUBTITULO = {'italic': True, 'font_size': 11}
+CABECALHO = {
+    'bold': True, 'align': 'center', 'valign': 'vcenter',
+    'bg_color': '#F1F5FF', 'border': 1, 'border_color': '#DDDDDD',
+}
+CORPO = {'border': 1, 'border_color': '#EEEEEE'}
+INTEIRO = {**CORPO, 'num_format': '0'}
+DECIMAL = {**CORPO, 'num_format': '0.00'}
+TOTAL = {**CORPO, 'bold': True, 'bg_color': '#EFEFEF'}
+
+
+def _texto(valor):
+    if valor is None:
+        return ''
+    if isinstance(valor, float):
+        return f'{valor:.2f}'
+    return str(valor)
+
+
+class Aba:
+    """Uma worksheet escrita linha a linha; `linha` é a próxima linha livre (0-based)."""
+
+    def __init__(self, planilha, worksheet, largura_min=10, largura_max=45):
+        self._planilha = planilha
+        self.ws = worksheet
+        self.linha = 0
+        self._larguras = {}
+        self._largura_min = largura_min
+        self._largura_max = largura_max
+
+    def titulo(self, texto, colunas, formato=TITULO):
+        """Linha mesclada de 0 a `colunas`-1 (não entra no cálculo das larguras)."""
+        fmt = self._planilha.formato(formato)
+        if colunas > 1:
+            self.ws.merge_range(self.linha, 0, self.linha, colunas - 1, texto, fmt)
+        else:
+            self.ws.write(self.linha, 0, texto, fmt)
+        self.linha += 1
+
+    def escrever(self, valores, formatos=None):
+        """Escreve a próxima linha. `formatos` é um dict de formato para a linha toda
+           ou uma lista (um por coluna, None = sem formato)."""
+        if formatos is None or isinstance(formatos, dict):
+            formatos = [formatos] * len(valores)
+        for col, (valor, formato) in enumerate(zip(valores, formatos)):
+            if valor is None and formato is None:
+                continue
+            if isinstance(valor, Decimal):
+                valor = float(valor)
+            elif isinstance(valor, (date, datetime)):
+                valor = valor.strftime('%d/%m/%Y %H:%M' if isinstance(valor, datetime) else '%d/%m/%Y')
+            fmt = self._planilha.formato(formato) if formato else None
+            if valor is None:
+                self.ws.write_blank(self.linha, col, None, fmt)
+            else:
+                self.ws.write(self.linha, col, valor, fmt)
+            tamanho = len(_texto(valor))
+            if tamanho > self._larguras.get(col, 0):
+                self._larguras[col] = tamanho
+        self.linha += 1
+
+    def pular(self, linhas=1):
+        self.linha += linhas
+
+    def congelar(self):
+        """Congela as linhas acima da próxima linha livre (cabeçalho)."""
+        self.ws.freeze_panes(self.linha, 0)
+
+    def _aplicar_larguras(self):
+        for col, tamanho in self._larguras.items():
+            self.ws.set_column(col, col, max(self._largura_min, min(self._largura_max, tamanho + 2)))
+
+
+class PlanilhaStream:
+    def __init__(self):
+        limite = getattr(settings, 'EXPORTACAO_SPOOL_MAX_BYTES', 8 * 1024 * 1024)
+        self._arquivo = tempfile.SpooledTemporaryFile(max_size=limite)
+        self.workbook = xlsxwriter.Workbook(self._arquivo, {'constant_memory': True})
+        self._formatos = {}
+        self._abas = []
+
+    def formato(self, props):
+        chave = tuple(sorted(props.items()))
+        if chave not in self._formatos:
+            self._formatos[chave] = self.workbook.add_format(props)
+        return self._formatos[chave]
+
+    def aba(self, nome, **kwargs):
+        aba = Aba(self, self.workbook.add_worksheet(nome[:31]), **kwargs)
+        self._abas.append(aba)
+        return aba
+
+    def fechar(self):
+        """Aplica as larguras, fecha o workbook e devolve o arquivo já no início."""
+        for aba in self._abas:
+            aba._aplicar_larguras()
+        self.workbook.close()
+        self._arquivo.seek(0)
+        return self._arquivo
+
+    def resposta(self, nome_arquivo):
+        """Fecha o arquivo e o devolve em blocos (o FileResponse fecha o temporário)."""
+        return FileResponse(self.fechar(), as_attachment=True, filename=nome_arquivo,
+                            content_type=CONTENT_TYPE_XLSX)
@@ -0,0 +1,856 @@
+# core/relatorios.py
+"""Conjuntos de dados dos relatórios, compartilhados entre a tela e a exportação.
+
+   Cada relatório se registra uma vez com @relatorio: uma função que lê os filtros
+   dos parâmetros GET e outra que monta o conjunto de dados (um NamedTuple) a partir deles.
+   A view e o exportador chamam `obter(...)` com os mesmos filtros e recebem o mesmo
+   objeto: quem exporta logo depois de ver a tela não refaz as consultas (ver
+   core/relatorios_cache.py). Os conjuntos são somente leitura para quem consome."""
+
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import MAXYEAR, MINYEAR, datetime, time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from time import perf_counter
+from typing import NamedTuple, Optional
+
+import numpy as np
+from django.conf import settings
+from django.db import connection, connections
+from django.db.models import F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from core import busca, janelas, relatorios_cache
+from core.utils import calcular_totais_ml_e_doses
+from .models import (
+    Bar, ContagemBar, EstoqueBar, Evento, FechamentoTurno, PerdaProduto, Produto,
+    RecebimentoEstoque, RequisicaoProduto, Restaurante, UltimaContagem,
+)
+
+DOSE_ML = Decimal('50')  # ml por dose (mesmo valor das views)
+
+
+class Definicao(NamedTuple):
+    calcular: callable
+    filtros: callable
+    escopo: str                  # 'restaurante' | 'bar' | 'global'
+    validade: Optional[int]      # segundos; None = RELATORIOS_CACHE_VALIDADE
+
+
+_REGISTRO = {}
+
+
+def relatorio(nome, *, filtros, escopo='restaurante', validade=None):
+    """Registra o montador do conjunto de dados `nome`.
+       `filtros(params)` recebe os parâmetros GET e devolve o dict de filtros que o montador recebe como kwargs
+       (além de restaurante_id/bar_id, conforme o escopo)."""
+    def registrar(calcular):
+        _REGISTRO[nome] = Definicao(calcular, filtros, escopo, validade)
+        return calcular
+    return registrar
+
+
+def ler_filtros(nome, request):
+    """Filtros do relatório a partir do request ou só dos parâmetros (QueryDict/dict),
+       como fazem as exportações em segundo plano (core/exportacoes.py)."""
+    return _REGISTRO[nome].filtros(getattr(request, 'GET', request))
+
+
+def _escopo(definicao, restaurante_id, bar_id):
+    if definicao.escopo == 'restaurante':
+        return {'restaurante_id': restaurante_id}
+    if definicao.escopo == 'bar':
+        return {'bar_id': bar_id}
+    return {}
+
+
+def escopo_de(nome, restaurante_id=None, bar_id=None):
+    """restaurante_id/bar_id (kwargs) que o relatório `nome` usa; {} no relatório global."""
+    return _escopo(_REGISTRO[nome], restaurante_id, bar_id)
+
+
+def obter(nome, *, restaurante_id=None, bar_id=None, **filtros):
+    """Conjunto de dados `nome` para o escopo/filtros informados, via cache."""
+    definicao = _REGISTRO[nome]
+    escopo = _escopo(definicao, restaurante_id, bar_id)
+    return relatorios_cache.obter(
+        nome, filtros, lambda: definicao.calcular(**escopo, **filtros),
+        validade=definicao.validade, **escopo,
+    )
+
+
+def em_cache(nome, *, restaurante_id=None, bar_id=None, **filtros):
+    """O conjunto de dados se a tela acabou de montá-lo; None caso contrário.
+       Exportações grandes usam isso para não materializar o período inteiro:
+       sem cache, leem direto do banco em streaming (ver core/planilhas.py)."""
+    definicao = _REGISTRO[nome]
+    return relatorios_cache.consultar(
+        nome, filtros, validade=definicao.validade, **_escopo(definicao, restaurante_id, bar_id),
+    )
+
+
+# ---------------------------------------------------------------- helpers de filtro
+
+def _data(s, padrao=None):
+    try:
+        return datetime.strptime(s, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return padrao
+
+
+def _inteiro(s):
+    try:
+        return int(s) if s not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _hora(s, padrao):
+    try:
+        return datetime.strptime(s, '%H:%M').time()
+    except (TypeError, ValueError):
+        return padrao
+
+
+def intervalo(params):
+    """Lê inicio/fim (datas) e inicio_hora/fim_hora; padrão hoje 00:00 → 23:59.
+       Se o fim for menor/igual ao início, o intervalo cruza a meia-noite.
+       Retorna (ini_date, fim_date, ini_time, fim_time, start_dt, end_dt)."""
+    hoje = timezone.localdate()
+    ini_date = _data(params.get('inicio') or str(hoje), hoje)
+    fim_date = _data(params.get('fim') or str(hoje), hoje)
+    ini_time = _hora(params.get('inicio_hora') or '00:00', time(0, 0))
+    fim_time = _hora(params.get('fim_hora') or '23:59', time(23, 59))
+
+    start_dt = timezone.make_aware(datetime.combine(ini_date, ini_time))
+    end_dt = timezone.make_aware(datetime.combine(fim_date, fim_time))
+    if end_dt <= start_dt:
+        end_dt += timedelta(days=1)
+    return ini_date, fim_date, ini_time, fim_time, start_dt, end_dt
+
+
+def _periodo_mes_atual(inicio_str, fim_str):
+    """(início, fim) informados ou, se faltar/for inválido, do dia 1º do mês até hoje."""
+    hoje = timezone.localdate()
+    inicio, fim = _data(inicio_str), _data(fim_str)
+    if inicio is None or fim is None:
+        return hoje.replace(day=1), hoje
+    return inicio, fim
+
+
+# ---------------------------------------------------------------- saída de estoque
+
+class SaidaEstoque(NamedTuple):
+    requisicoes: list
+    total_quantidade: Decimal
+
+
+def _filtros_saida_estoque(params):
+    return {
+        'mes': _inteiro(params.get('mes')),
+        'ano': _inteiro(params.get('ano')),
+        'produto': (params.get('produto') or '').strip(),
+    }
+
+
+def saida_estoque_queryset(bar_id, mes=None, ano=None, produto=''):
+    """Requisições decididas do bar, mais recentes primeiro."""
+    qs = (RequisicaoProduto.objects
+          .filter(bar_id=bar_id, status__in=['APROVADA', 'NEGADA', 'FALHA_ESTOQUE'])
+          .select_related('produto', 'usuario', 'usuario_aprovador'))
+    qs = busca.filtrar(qs, produto, 'produto__nome')
+    janela = janelas.mes(mes, ano) if ano else None
+    if janela:
+        qs = qs.filter(**janela.filtro('data_solicitacao'))
+    elif mes:
+        # o mesmo mês em todos os anos não é uma faixa: fica a extração, coberta
+        # pelo índice de expressão (bar, mês local) de RequisicaoProduto
+        qs = qs.filter(data_solicitacao__month=mes)
+    return qs.order_by('-data_solicitacao')
+
+
+@relatorio('saida_estoque', filtros=_filtros_saida_estoque, escopo='bar')
+def saida_estoque(bar_id, mes=None, ano=None, produto=''):
+    """Requisições decididas do bar, mais recentes primeiro. A chave no cache são
+       só os filtros: a tela corta as 50 últimas e as exportações (Excel, CSV,
+       Parquet) reaproveitam a mesma entrada."""
+    requisicoes = list(saida_estoque_queryset(bar_id, mes, ano, produto))
+    total = sum((r.quantidade_solicitada or Decimal('0') for r in requisicoes), Decimal('0'))
+    return SaidaEstoque(requisicoes, total)
+
+
+# ---------------------------------------------------------------- perdas
+
+class Perdas(NamedTuple):
+    por_produto: list    # [{produto__id, produto__nome, produto__codigo, garrafas, doses}]
+    por_bar: list        # [{bar__id, bar__nome, garrafas, doses}]
+    por_motivo: list     # [{motivo, rotulo, registros, garrafas, doses}]
+    registros: int
+    total_garrafas: int
+    total_doses: int
+
+
+def _filtros_perdas(params):
+    # a exportação antiga usava q/data_inicio/data_fim; continuam aceitos
+    # cada limite tem seu padrão (1º do mês / hoje), como na exportação antiga
+    g = params
+    hoje = timezone.localdate()
+    inicio = _data(g.get('inicio') or g.get('data_inicio'), hoje.replace(day=1))
+    fim = _data(g.get('fim') or g.get('data_fim'), hoje)
+    return {
+        'bar_id': _inteiro((g.get('bar') or '').strip()),
+        'produto': (g.get('produto') or g.get('q') or '').strip(),
+        'motivo': (g.get('motivo') or '').strip(),
+        'somente_nao_baixados': g.get('pendentes') in ('1', 'true', 'on'),
+        'data_inicio': inicio,
+        'data_fim': fim,
+    }
+
+
+def perdas_queryset(restaurante_id, data_inicio, data_fim, bar_id=None, produto='', motivo='',
+                    somente_nao_baixados=False):
+    """Perdas filtradas, mais recentes primeiro."""
+    qs = (PerdaProduto.objects
+          .filter(**janelas.dias(data_inicio, data_fim).filtro('data_registro'))
+          .select_related('bar', 'produto', 'usuario', 'restaurante', 'baixado_por')
+          .order_by('-data_registro', '-id'))
+    if restaurante_id:
+        qs = qs.filter(restaurante_id=restaurante_id)
+    if bar_id:
+        qs = qs.filter(bar_id=bar_id)
+    qs = busca.filtrar(qs, produto, 'produto__nome', 'produto__codigo')
+    if motivo:
+        qs = qs.filter(motivo=motivo)
+    if somente_nao_baixados:
+        qs = qs.filter(baixado=False)
+    return qs
+
+
+@relatorio('perdas', filtros=_filtros_perdas)
+def perdas(restaurante_id, **filtros):
+    """Totais e consolidados por produto, bar e motivo numa única consulta
+       (GROUPING SETS sobre as perdas filtradas). O detalhe é paginado à parte
+       (perdas_pagina) e não entra no cache."""
+    base = (perdas_queryset(restaurante_id, **filtros)
+            .order_by()
+            .values(pid=F('produto_id'), pnome=F('produto__nome'), pcodigo=F('produto__codigo'),
+                    bid=F('bar_id'), bnome=F('bar__nome'), mot=F('motivo'), g=F('garrafas'), d=F('doses')))
+    sql, params = base.query.sql_with_params()
+    with connection.cursor() as cur:
+        cur.execute(f"""
+            SELECT GROUPING(f.pid, f.bid, f.mot), f.pid, f.pnome, f.pcodigo, f.bid, f.bnome, f.mot,
+                   COUNT(*), COALESCE(SUM(f.g), 0), COALESCE(SUM(f.d), 0)
+              FROM ({sql}) AS f
+             GROUP BY GROUPING SETS ((), (f.pid, f.pnome, f.pcodigo), (f.bid, f.bnome), (f.mot))
+        """, params)
+        grupos = cur.fetchall()
+
+    # GROUPING(pid, bid, mot): bit ligado = coluna agregada; 0b011 = só motivo, etc.
+    rotulos = dict(PerdaProduto.MOTIVOS)
+    por_produto, por_bar, por_motivo = [], [], []
+    registros = total_garrafas = total_doses = 0
+    for grupo, pid, pnome, pcodigo, bid, bnome, mot, n, g, d in grupos:
+        if grupo == 0b111:
+            registros, total_garrafas, total_doses = n, int(g), int(d)
+        elif grupo == 0b011:
+            por_produto.append({'produto__id': pid, 'produto__nome': pnome, 'produto__codigo': pcodigo,
+                                'garrafas': int(g), 'doses': int(d)})
+        elif grupo == 0b101:
+            por_bar.append({'bar__id': bid, 'bar__nome': bnome, 'garrafas': int(g), 'doses': int(d)})
+        else:
+            por_motivo.append({'motivo': mot, 'rotulo': rotulos.get(mot, mot),
+                               'registros': n, 'garrafas': int(g), 'doses': int(d)})
+
+    return Perdas(
+        por_produto=sorted(por_produto, key=lambda r: r['produto__nome'].lower()),
+        por_bar=sorted(por_bar, key=lambda r: r['bar__nome'].lower()),
+        por_motivo=sorted(por_motivo, key=lambda r: r['rotulo']),
+        registros=registros,
+        total_garrafas=total_garrafas,
+        total_doses=total_doses,
+    )
+
+
+_EPOCA = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def cursor_perdas(perda):
+    """Posição de uma perda na ordem do detalhe (data_registro, id), como texto para a URL."""
+    return f"{(perda.data_registro - _EPOCA) // timedelta(microseconds=1)}-{perda.id}"
+
+
+def _ler_cursor_perdas(cursor):
+    try:
+        micros, pk = (int(parte) for parte in (cursor or '').split('-'))
+    except ValueError:
+        return None
+    return _EPOCA + timedelta(microseconds=micros), pk
+
+
+def perdas_pagina(restaurante_id, antes=None, tamanho=100, **filtros):
+    """Uma página do detalhe por keyset: as `tamanho` perdas seguintes ao cursor `antes`
+       (ver cursor_perdas), mais recentes primeiro. Custa o mesmo em qualquer página,
+       sem OFFSET nem COUNT. Retorna (itens, cursor da próxima página ou None)."""
+    qs = perdas_queryset(restaurante_id, **filtros)
+    posicao = _ler_cursor_perdas(antes)
+    if posicao is not None:
+        data, pk = posicao
+        qs = qs.filter(Q(data_registro__lt=data) | Q(data_registro=data, id__lt=pk))
+    itens = list(qs[:tamanho + 1])
+    if len(itens) > tamanho:
+        return itens[:tamanho], cursor_perdas(itens[tamanho - 1])
+    return itens, None
+
+
+# ---------------------------------------------------------------- consolidado do período
+
+class ConsolidadoPeriodo(NamedTuple):
+    linhas: list     # [{produto, inicio_g/d, entradas_g/d, final_g/d, saida_g/d}]
+    totais: dict
+
+
+def _filtros_consolidado_periodo(params):
+    # intervalo com horas: quem chama resolve (intervalo) e passa ini_dt/fim_dt
+    return {'incluir_central': params.get('incluir_central', '1') == '1'}
+
+
+@relatorio('consolidado_periodo', filtros=_filtros_consolidado_periodo)
+def consolidado_periodo(restaurante_id, ini_dt, fim_dt, incluir_central=True):
+    """Estoque no início e no fim do intervalo, entradas no central e a saída
+       resultante, por produto ativo, somando os bares do restaurante."""
+    bares_qs = Bar.objects.filter(restaurante_id=restaurante_id)
+    if not incluir_central:
+        bares_qs = bares_qs.filter(is_estoque_central=False)
+    bar_ids = list(bares_qs.values_list('id', flat=True))
+
+    produtos = list(Produto.objects.filter(ativo=True).order_by('nome'))
+    prod_ids = [p.id for p in produtos]
+
+    # Última contagem no início e no fim do período: uma query (DISTINCT ON no banco)
+    # (instantes que caem num fechamento de turno são lidos do snapshot)
+    # (já como arrays em centésimos: ver consolidar_periodo)
+    inicio, final = FechamentoTurno.contagens_em([ini_dt, fim_dt], bar_ids=bar_ids, produto_ids=prod_ids,
+                                                  centesimos=True)
+
+    # Entradas (sempre no bar central)
+    entradas = dict(
+        RecebimentoEstoque.objects
+        .filter(restaurante_id=restaurante_id, bar__restaurante_id=restaurante_id,
+                bar__is_estoque_central=True,
+                data_recebimento__gte=ini_dt, data_recebimento__lte=fim_dt)
+        .values('produto')
+        .annotate(qtd=Sum('quantidade'))
+        .values_list('produto', 'qtd')
+    )
+
+    colunas = consolidar_periodo(bar_ids, prod_ids, inicio, final, entradas)
+    linhas = [
+        {'produto': p, **dict(zip(CAMPOS_PERIODO, map(_de_centesimos, valores)))}
+        for p, valores in zip(produtos, colunas.T.tolist())
+    ]
+    totais = dict(zip(CAMPOS_PERIODO, map(_de_centesimos, colunas.sum(axis=1).tolist())))
+    return ConsolidadoPeriodo(linhas, totais)
+
+
+CAMPOS_PERIODO = ('inicio_g', 'inicio_d', 'entradas_g', 'entradas_d', 'final_g', 'final_d', 'saida_g', 'saida_d')
+
+
+def _de_centesimos(valor):
+    return Decimal(int(valor)).scaleb(-2)
+
+
+def _posicoes(ids, valores):
+    """Posição de cada valor na lista `ids` (qualquer ordem), -1 se não estiver nela."""
+    ids = np.asarray(ids, dtype=np.int64)
+    if not len(ids):
+        return np.full(len(valores), -1)
+    ordem = np.argsort(ids)
+    pos = ordem[np.minimum(np.searchsorted(ids, valores, sorter=ordem), len(ids) - 1)]
+    return np.where(ids[pos] == valores, pos, -1)
+
+
+def _matriz(linhas, bar_ids, prod_ids):
+    """Linhas (bar_id, produto_id, g, d) -> matrizes bar × produto de garrafas e doses."""
+    g = np.zeros((len(bar_ids), len(prod_ids)), dtype=np.int64)
+    d = np.zeros_like(g)
+    if len(linhas):
+        bi, pi = _posicoes(bar_ids, linhas[:, 0]), _posicoes(prod_ids, linhas[:, 1])
+        ok = (bi >= 0) & (pi >= 0)
+        g[bi[ok], pi[ok]] = linhas[ok, 2]
+        d[bi[ok], pi[ok]] = linhas[ok, 3]
+    return g, d
+
+
+def consolidar_periodo(bar_ids, prod_ids, inicio, final, entradas):
+    """Núcleo vetorizado do consolidado do período.
+       `inicio`/`final`: arrays int64 n × 4 (bar_id, produto_id, garrafas, doses) em
+       centésimos — todas as quantidades têm no máximo 2 casas, então a soma em
+       inteiros é exata; `entradas`: {produto_id: quantidade}. Cada contagem vira uma
+       célula de uma matriz bar × produto, somada por coluna; a saída e os totais são
+       operações de vetor. Devolve uma matriz 8 × produtos na ordem de CAMPOS_PERIODO."""
+    inicio_g, inicio_d = (m.sum(axis=0) for m in _matriz(inicio, bar_ids, prod_ids))
+    final_g, final_d = (m.sum(axis=0) for m in _matriz(final, bar_ids, prod_ids))
+
+    entradas_g = np.zeros(len(prod_ids), dtype=np.int64)
+    if entradas:
+        pids = np.fromiter(entradas.keys(), dtype=np.int64, count=len(entradas))
+        qtd = np.array([q or 0 for q in entradas.values()], dtype=np.float64)
+        pos = _posicoes(prod_ids, pids)
+        entradas_g[pos[pos >= 0]] = np.rint(qtd[pos >= 0] * 100)
+    entradas_d = np.zeros_like(entradas_g)  # entrada não tem doses
+
+    return np.vstack([
+        inicio_g, inicio_d, entradas_g, entradas_d, final_g, final_d,
+        inicio_g + entradas_g - final_g, inicio_d + entradas_d - final_d,
+    ])
+
+
+# ---------------------------------------------------------------- consolidado do grupo
+
+class ConsolidadoGrupo(NamedTuple):
+    restaurantes: list               # [Restaurante] por nome
+    linhas: list                     # [{produto, CAMPOS_PERIODO..., por_restaurante: {id: linha}}]
+    totais: dict
+    totais_por_restaurante: dict     # restaurante_id -> totais
+    duracoes: dict                   # restaurante_id -> segundos de cálculo
+
+
+def filtros_consolidado_grupo(params):
+    """Restaurantes pedidos (`restaurantes`, repetível) e incluir_central. Quais deles o
+       usuário pode ver é a view que decide (ver Restaurante.do_usuario)."""
+    valores = params.getlist('restaurantes') if hasattr(params, 'getlist') else params.get('restaurantes') or []
+    ids = {i for i in map(_inteiro, valores) if i}
+    return {'restaurante_ids': tuple(sorted(ids)), **_filtros_consolidado_periodo(params)}
+
+
+def _max_threads():
+    return getattr(settings, 'RELATORIOS_GRUPO_THREADS', 4)
+
+
+def em_paralelo(funcao, itens, max_threads=None):
+    """{item: funcao(item)} com no máximo `max_threads` threads ao mesmo tempo.
+       Cada thread abre a própria conexão com o banco (o Django mantém uma por
+       thread) e a fecha ao terminar, para não deixar conexões órfãs no pool.
+       A primeira exceção é repassada a quem chamou."""
+    itens = list(itens)
+    if not itens:
+        return {}
+
+    def executar(item):
+        try:
+            return funcao(item)
+        finally:
+            connections.close_all()
+
+    with ThreadPoolExecutor(max_workers=min(max_threads or _max_threads(), len(itens)),
+                            thread_name_prefix='relatorio') as pool:
+        return dict(zip(itens, pool.map(executar, itens)))
+
+
+def consolidado_grupo(restaurante_ids, ini_dt, fim_dt, incluir_central=True):
+    """Consolidado do período de vários restaurantes: cada um é calculado (ou lido do
+       cache, na sua geração) numa thread própria e o resultado é somado por produto.
+       O tempo total fica perto do restaurante mais lento, não da soma de todos."""
+    restaurantes = list(Restaurante.objects.filter(id__in=restaurante_ids).order_by('nome'))
+
+    def calcular(rid):
+        inicio = perf_counter()
+        dados = obter('consolidado_periodo', restaurante_id=rid, ini_dt=ini_dt, fim_dt=fim_dt,
+                      incluir_central=incluir_central)
+        return dados, perf_counter() - inicio
+
+    resultados = em_paralelo(calcular, [r.id for r in restaurantes])
+
+    # todos listam os mesmos produtos ativos, já por nome; a junção é pelo id do produto
+    por_produto = OrderedDict()
+    for r in restaurantes:
+        for l in resultados[r.id][0].linhas:
+            linha = por_produto.get(l['produto'].id)
+            if linha is None:
+                linha = por_produto[l['produto'].id] = {
+                    'produto': l['produto'], **dict.fromkeys(CAMPOS_PERIODO, Decimal('0')), 'por_restaurante': {},
+                }
+            for campo in CAMPOS_PERIODO:
+                linha[campo] += l[campo]
+            linha['por_restaurante'][r.id] = l
+
+    linhas = list(por_produto.values())
+    return ConsolidadoGrupo(
+        restaurantes=restaurantes,
+        linhas=linhas,
+        totais={c: sum((l[c] for l in linhas), Decimal('0')) for c in CAMPOS_PERIODO},
+        totais_por_restaurante={r.id: resultados[r.id][0].totais for r in restaurantes},
+        duracoes={r.id: resultados[r.id][1] for r in restaurantes},
+    )
+
+
+# ---------------------------------------------------------------- consolidado atual
+
+class ConsolidadoAtual(NamedTuple):
+    linhas: list     # [{produto, g, d}] por nome
+
+
+@relatorio('consolidado_atual', filtros=lambda params: {})
+def consolidado_atual(restaurante_id):
+    """Saldo atual somado de todos os bares do restaurante (inclusive o central)."""
+    agreg = (EstoqueBar.objects
+             .filter(bar__restaurante_id=restaurante_id)
+             .values('produto_id')
+             .annotate(g=Sum('quantidade_garrafas'), d=Sum('quantidade_doses')))
+    totais = {a['produto_id']: a for a in agreg}
+    produtos = Produto.objects.filter(id__in=totais).order_by('nome')
+    return ConsolidadoAtual([
+        {'produto': p, 'g': totais[p.id]['g'] or Decimal('0'), 'd': totais[p.id]['d'] or Decimal('0')}
+        for p in produtos
+    ])
+
+
+# ---------------------------------------------------------------- eventos
+
+class Eventos(NamedTuple):
+    eventos: list                 # um dict por evento, itens de bebidas e alimentos
+    consolidado_bebidas: dict     # nome -> {garrafas, doses, ml}
+    consolidado_alimentos: dict   # nome -> {quantidade, unidade}
+
+
+def _filtros_eventos(params):
+    g = params
+    inicio, fim = _periodo_mes_atual(g.get('data_inicio'), g.get('data_fim'))
+    return {
+        'data_inicio': inicio,
+        'data_fim': fim,
+        'nome_evento': (g.get('nome_evento') or '').strip(),
+        'somente_nao_baixados': g.get('pendentes') == '1',
+        'restaurante': _inteiro((g.get('restaurante') or '').strip()),
+    }
+
+
+def eventos_queryset(data_inicio, data_fim, nome_evento='', somente_nao_baixados=False, restaurante=None):
+    """Eventos pela DATA DO EVENTO, mais recentes primeiro, com itens pré-carregados."""
+    qs = (Evento.objects
+          .filter(data_evento__range=(data_inicio, data_fim))
+          .prefetch_related('produtos__produto', 'alimentos__alimento')
+          .select_related('responsavel', 'supervisor_finalizou', 'baixado_por', 'restaurante')
+          .order_by('-data_evento', '-finalizado_em', '-data_criacao'))
+    qs = busca.filtrar(qs, nome_evento, 'nome')
+    if somente_nao_baixados:
+        qs = qs.filter(baixado_estoque=False, status='FINALIZADO')
+    if restaurante:
+        qs = qs.filter(restaurante_id=restaurante)
+    return qs
+
+
+def resumo_evento(ev):
+    """Um evento como dict: itens de bebidas/alimentos e totais do próprio evento."""
+    total_g, total_d, total_ml = 0, Decimal('0'), Decimal('0')
+    itens_bebidas = []
+    for item in ev.produtos.all():
+        g = int(item.garrafas or 0)
+        d = Decimal(item.doses or 0)
+        ml = d * DOSE_ML
+        itens_bebidas.append({'produto': item.produto.nome, 'garrafas': g, 'doses': d, 'ml': ml})
+        total_g += g; total_d += d; total_ml += ml
+
+    itens_alimentos = []
+    total_qtd_alimentos = Decimal('0')
+    for ali in ev.alimentos.all():
+        qtd = Decimal(ali.quantidade or 0)
+        itens_alimentos.append({'alimento': ali.alimento.nome, 'quantidade': qtd,
+                                'unidade': ali.alimento.unidade or ''})
+        total_qtd_alimentos += qtd
+
+    return {
+        'obj': ev,
+        'nome': ev.nome,
+        'data': ev.data_evento,
+        'responsavel': getattr(ev, 'responsavel', ''),
+        'pessoas': ev.numero_pessoas,
+        'horas': ev.horas,
+        'restaurante_nome': ev.restaurante.nome if getattr(ev, 'restaurante', None) else None,
+        'status': ev.status,
+        'baixado': ev.baixado_estoque,
+        'itens_bebidas': itens_bebidas,
+        'totais_bebidas': {'garrafas': total_g, 'doses': total_d, 'ml': total_ml},
+        'itens_alimentos': itens_alimentos,
+        'total_qtd_alimentos': total_qtd_alimentos,
+    }
+
+
+class ConsolidadoEventos:
+    """Acumula bebidas e alimentos de vários eventos (resumo_evento), em ordem de nome."""
+
+    def __init__(self):
+        self.bebidas = defaultdict(lambda: {'garrafas': 0, 'doses': Decimal('0'), 'ml': Decimal('0')})
+        self.alimentos = defaultdict(lambda: {'quantidade': Decimal('0.00'), 'unidade': ''})
+
+    def somar(self, resumo):
+        for it in resumo['itens_bebidas']:
+            b = self.bebidas[it['produto']]
+            b['garrafas'] += it['garrafas']
+            b['doses'] += it['doses']
+            b['ml'] += it['ml']
+        for it in resumo['itens_alimentos']:
+            a = self.alimentos[it['alimento']]
+            a['quantidade'] += it['quantidade']
+            a['unidade'] = it['unidade']
+
+    def ordenado(self, acumulado):
+        return OrderedDict(sorted(acumulado.items(), key=lambda kv: kv[0].lower()))
+
+
+# eventos não têm geração própria: curta validade + descarte pelos signals
+@relatorio('eventos', filtros=_filtros_eventos, escopo='global', validade=60)
+def eventos(**filtros):
+    """Eventos pela DATA DO EVENTO, com itens e totais por evento e os consolidados."""
+    lista, consolidado = [], ConsolidadoEventos()
+    for ev in eventos_queryset(**filtros):
+        resumo = resumo_evento(ev)
+        consolidado.somar(resumo)
+        lista.append(resumo)
+    return Eventos(lista, consolidado.ordenado(consolidado.bebidas), consolidado.ordenado(consolidado.alimentos))
+
+
+# ---------------------------------------------------------------- contagem atual / por dia
+
+class ContagemAtual(NamedTuple):
+    dados_por_bar: dict      # nome do bar -> [{contagem, total_ml, doses_equivalentes}]
+    somatorio_total: dict    # produto_id -> {produto, garrafas, doses, total_ml, doses_equivalentes}
+    inicio: Optional[datetime]
+    fim: Optional[datetime]
+
+
+def _filtros_contagem_atual(params):
+    modo = (params.get('modo') or 'operacional').lower()
+    return {
+        'dia': _data((params.get('data') or '').strip()),
+        'modo': 'calendario' if modo == 'calendario' else 'operacional',
+    }
+
+
+@relatorio('contagem_atual', filtros=_filtros_contagem_atual)
+def contagem_atual(restaurante_id, dia=None, modo='operacional'):
+    """Última contagem por (bar, produto) de TODOS os bares do restaurante, numa única
+       consulta, com o produto (dados de conversão) já carregado; o somatório do
+       restaurante sai no mesmo laço.
+         - sem `dia`: estado atual (tabela UltimaContagem);
+         - `dia` + 'operacional': janela HORA_INICIO→+24h (fechamento congelado, se houver);
+         - `dia` + 'calendario': janela 00:00→24:00."""
+    bares = list(Bar.objects.filter(restaurante_id=restaurante_id).only('id', 'nome').order_by('nome'))
+    bar_ids = [b.id for b in bares]
+    inicio = fim = None
+    finais_por_bar = None
+
+    if dia is None:
+        finais_por_bar = {
+            bid: [uc.ultima for uc in ucs]
+            for bid, ucs in UltimaContagem.por_bar(bar_ids).items()
+        }
+    else:
+        if modo == 'calendario':
+            inicio, fim = janelas.dia(dia)
+        else:
+            inicio, fim = FechamentoTurno.limites(dia)
+        if modo != 'calendario':
+            finais_por_bar = FechamentoTurno.contagens_do_dia(dia, bar_ids)
+        if finais_por_bar is None:
+            finais_por_bar = ContagemBar.ultimas_por_bar(bar_ids, inicio, fim)
+
+    dados_por_bar = {}
+    somatorio_total = defaultdict(lambda: {
+        'produto': None,
+        'garrafas': 0,
+        'doses': 0.0,
+        'total_ml': 0.0,
+        'doses_equivalentes': 0.0,
+    })
+
+    for bar in bares:
+        dados_por_bar[bar.nome] = []
+
+        for c in finais_por_bar.get(bar.id, []):
+            pid = c.produto_id
+            doses = float(c.quantidade_doses_restantes or 0)
+            garrafas = c.quantidade_garrafas_cheias or 0
+
+            total_ml, doses_eq, _ = calcular_totais_ml_e_doses(c.produto, garrafas, doses)
+
+            # linha do bar
+            dados_por_bar[bar.nome].append({
+                'contagem': c,
+                'total_ml': float(total_ml),
+                'doses_equivalentes': float(doses_eq),
+            })
+
+            # somatório por produto no restaurante
+            somatorio_total[pid]['produto'] = c.produto
+            somatorio_total[pid]['garrafas'] += garrafas
+            somatorio_total[pid]['doses']    += doses
+            somatorio_total[pid]['total_ml'] += float(total_ml)
+            somatorio_total[pid]['doses_equivalentes'] += float(doses_eq)
+
+    return ContagemAtual(dados_por_bar, dict(somatorio_total), inicio, fim)
+
+
+# ---------------------------------------------------------------- diferença de contagens
+
+class DiferencaContagens(NamedTuple):
+    dados_por_bar: dict          # nome do bar -> linhas por produto (última x penúltima + histórico)
+    somatorio_total: dict        # produto_id -> {produto, diff_garrafas, diff_doses} (só com penúltima)
+    somatorio_contagens: dict    # produto_id -> {produto, p_g, u_g, p_d, u_d} (penúltima ausente = 0)
+
+
+def _filtros_diferenca_contagens(params, padrao=2, maximo=10):
+    """Quantas contagens por (bar, produto) o relatório mostra (?n=)."""
+    try:
+        n = int(params.get('n', padrao))
+    except (TypeError, ValueError):
+        n = padrao
+    return {'n': min(max(n, 2), maximo)}
+
+
+@relatorio('diferenca_contagens', filtros=_filtros_diferenca_contagens)
+def diferenca_contagens(restaurante_id, n=2):
+    """N contagens mais recentes por (bar, produto) — uma consulta para o restaurante
+       todo (ContagemBar.recentes) — e a diferença entre as duas últimas."""
+    bares = list(Bar.objects.filter(restaurante_id=restaurante_id).only('id', 'nome').order_by('nome'))
+    recentes = defaultdict(dict)
+    for (bid, pid), lista in ContagemBar.recentes([b.id for b in bares], n).items():
+        recentes[bid][pid] = lista
+
+    def _por_nome(item):
+        return item[1]['produto'].nome.lower() if item[1]['produto'] else ''
+
+    dados_por_bar = {}
+    somatorio_total = defaultdict(lambda: {
+        'produto': None, 'diff_garrafas': Decimal('0'), 'diff_doses': Decimal('0'),
+    })
+    somatorio_contagens = defaultdict(lambda: {
+        'produto': None,
+        'p_g': Decimal('0'), 'u_g': Decimal('0'),
+        'p_d': Decimal('0'), 'u_d': Decimal('0'),
+    })
+
+    for bar in bares:
+        linhas_bar = []
+        for pid, lista in recentes.get(bar.id, {}).items():
+            ultimo = lista[0]
+            penultimo = lista[1] if len(lista) > 1 else None
+
+            # Decimal nas doses para não acumular erro de float
+            u_g = Decimal(ultimo.quantidade_garrafas_cheias or 0)
+            u_d = Decimal(ultimo.quantidade_doses_restantes or 0)
+            p_g = Decimal(penultimo.quantidade_garrafas_cheias or 0) if penultimo else None
+            p_d = Decimal(penultimo.quantidade_doses_restantes or 0) if penultimo else None
+            diff_g = (u_g - p_g) if penultimo else None
+            diff_d = (u_d - p_d) if penultimo else None
+
+            if penultimo:
+                st = somatorio_total[pid]
+                st['produto'] = ultimo.produto
+                st['diff_garrafas'] += diff_g
+                st['diff_doses'] += diff_d
+
+            sc = somatorio_contagens[pid]
+            sc['produto'] = ultimo.produto
+            sc['u_g'] += u_g
+            sc['u_d'] += u_d
+            sc['p_g'] += p_g if penultimo else Decimal('0')
+            sc['p_d'] += p_d if penultimo else Decimal('0')
+
+            linhas_bar.append({
+                'bar': bar.nome,
+                'produto': ultimo.produto,
+                'ultimo': ultimo,
+                'penultimo': penultimo,
+                'u_g': u_g, 'u_d': u_d,
+                'p_g': p_g, 'p_d': p_d,
+                'diff_g': diff_g, 'diff_d': diff_d,
+                'data_p': penultimo.data_contagem if penultimo else None,
+                'user_p': penultimo.usuario.username if (penultimo and penultimo.usuario) else None,
+                'data_u': ultimo.data_contagem,
+                'user_u': ultimo.usuario.username if ultimo.usuario else None,
+                # da mais antiga para a mais recente, com a variação de cada contagem
+                'historico': lista[::-1],
+            })
+
+        # por nome do produto dentro do bar (fica mais amigável)
+        linhas_bar.sort(key=lambda x: x['produto'].nome.lower())
+        dados_por_bar[bar.nome] = linhas_bar
+
+    return DiferencaContagens(
+        dados_por_bar,
+        dict(sorted(somatorio_total.items(), key=_por_nome)),
+        dict(sorted(somatorio_contagens.items(), key=_por_nome)),
+    )
+
+
+# ---------------------------------------------------------------- consolidado diferença (mês)
+
+class ConsolidadoDiferenca(NamedTuple):
+    por_dia: dict    # 'dd/mm/aaaa' -> {Produto: {quantidade_requisitada, cheias, doses, diferenca}}
+
+
+def _filtros_consolidado_diferenca(params):
+    """Mês fora de 1..12 ou ano fora do calendário viram o mês/ano corrente."""
+    hoje = timezone.localdate()
+    mes, ano = _inteiro(params.get('mes')), _inteiro(params.get('ano'))
+    return {
+        'mes': mes if mes and 1 <= mes <= 12 else hoje.month,
+        'ano': ano if ano and MINYEAR <= ano < MAXYEAR else hoje.year,
+    }
+
+
+@relatorio('consolidado_diferenca', filtros=_filtros_consolidado_diferenca, escopo='bar')
+def consolidado_diferenca(bar_id, mes, ano):
+    """Requisitado x contado por dia do mês, datas em ordem decrescente. Três
+       consultas no total, independente do volume: requisições agregadas por
+       (dia, produto), última contagem por (dia, produto) via DISTINCT ON e os
+       produtos envolvidos. Dia = data local."""
+    tz = timezone.get_current_timezone()
+    janela = janelas.mes(mes, ano)
+    if janela is None:
+        return ConsolidadoDiferenca({})
+    ini_dt, fim_dt = janela
+
+    # 1) requisições aprovadas somadas por (dia, produto) — faixa de datas usa índice
+    requisitado = {
+        (r['dia'], r['produto_id']): r['qtd']
+        for r in (RequisicaoProduto.objects
+                  .filter(bar_id=bar_id, status='APROVADA',
+                          data_solicitacao__gte=ini_dt, data_solicitacao__lt=fim_dt)
+                  .annotate(dia=TruncDate('data_solicitacao', tzinfo=tz))
+                  .values('dia', 'produto_id')
+                  .annotate(qtd=Sum('quantidade_solicitada')))
+    }
+    if not requisitado:
+        return ConsolidadoDiferenca({})
+    produto_ids = {pid for _, pid in requisitado}
+
+    # 2) última contagem de cada (dia, produto) no mês
+    contagens = {
+        (c['dia'], c['produto_id']): c
+        for c in (ContagemBar.objects
+                  .filter(bar_id=bar_id, produto_id__in=produto_ids,
+                          data_contagem__gte=ini_dt, data_contagem__lt=fim_dt)
+                  .annotate(dia=TruncDate('data_contagem', tzinfo=tz))
+                  .order_by('dia', 'produto_id', '-data_contagem', '-id')
+                  .distinct('dia', 'produto_id')
+                  .values('dia', 'produto_id', 'quantidade_garrafas_cheias', 'quantidade_doses_restantes'))
+    }
+    produtos = Produto.objects.in_bulk(produto_ids)
+
+    # 3) junção em memória
+    dados = defaultdict(dict)
+    for (dia, pid), qtd in sorted(requisitado.items(), key=lambda kv: (kv[0][0], produtos[kv[0][1]].nome)):
+        c = contagens.get((dia, pid))
+        cheias = c['quantidade_garrafas_cheias'] if c else 0
+        doses = float(c['quantidade_doses_restantes']) if c else 0.0
+        quantidade = float(qtd or 0)
+        dados[dia][produtos[pid]] = {
+            'quantidade_requisitada': quantidade,
+            'cheias': cheias,
+            'doses': doses,
+            'diferenca': abs(cheias - quantidade),
+        }
+    return ConsolidadoDiferenca({dia.strftime('%d/%m/%Y'): dados[dia] for dia in sorted(dados, reverse=True)})
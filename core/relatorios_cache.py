@@ -0,0 +1,120 @@
+# core/relatorios_cache.py
+"""Cache em memória (por processo) dos conjuntos de dados dos relatórios.
+
+   A chave é (relatório, restaurante/bar, filtros normalizados, geração dos dados).
+   A geração (Restaurante/Bar.geracao_dados) sobe no commit de qualquer gravação
+   de estoque/contagem (ver Restaurante.invalidar_relatorios e core/signals.py),
+   então uma entrada antiga nunca é servida: a chave nova simplesmente não existe
+   ainda e as velhas saem pelo LRU. Cada entrada vale ainda no máximo
+   RELATORIOS_CACHE_VALIDADE segundos, o que limita o atraso do que não passa
+   pela geração (nomes de usuário, relatórios sem restaurante como o de eventos)."""
+
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+
+from django.conf import settings
+
+from .models import Bar, Restaurante
+
+_lock = threading.Lock()
+_entradas = OrderedDict()
+
+
+def _max_entradas():
+    return getattr(settings, 'RELATORIOS_CACHE_MAX_ENTRADAS', 64)
+
+
+def validade_padrao():
+    return getattr(settings, 'RELATORIOS_CACHE_VALIDADE', 300)
+
+
+def geracao(restaurante_id=None, bar_id=None):
+    """Geração atual do bar (se informado) ou do restaurante — uma consulta por PK.
+       Sem nenhum dos dois (relatório global) a geração é fixa: vale só a validade."""
+    if bar_id is not None:
+        modelo, pk = Bar, bar_id
+    elif restaurante_id is not None:
+        modelo, pk = Restaurante, restaurante_id
+    else:
+        return 0
+    return modelo.objects.filter(pk=pk).values_list('geracao_dados', flat=True).first()
+
+
+def geracoes(restaurante_ids):
+    """((id, geração), ...) de vários restaurantes, para relatórios que juntam mais de um."""
+    return tuple(Restaurante.objects.filter(id__in=restaurante_ids).order_by('id')
+                 .values_list('id', 'geracao_dados'))
+
+
+def _normalizar(valor):
+    if isinstance(valor, (date, datetime)):
+        return valor.isoformat()
+    if isinstance(valor, (list, tuple, set, frozenset)):
+        return tuple(sorted(_normalizar(v) for v in valor))
+    if isinstance(valor, str):
+        return valor.strip()
+    return valor
+
+
+def normalizar_filtros(params):
+    """Filtros em forma canônica e hashable: ordem das chaves, datas, listas e
+       espaços nas pontas não geram chaves diferentes para a mesma consulta."""
+    return tuple(sorted((k, _normalizar(v)) for k, v in (params or {}).items()))
+
+
+def obter(nome, params, calcular, *, restaurante_id=None, bar_id=None, validade=None):
+    """Devolve o resultado cacheado de `calcular()` para este relatório/filtros na
+       geração atual dos dados; calcula e guarda quando não houver (ou se passou de
+       `validade` segundos). O resultado é compartilhado entre requisições: quem
+       consome não deve alterá-lo."""
+    versao = geracao(restaurante_id, bar_id)
+    if versao is None:  # restaurante/bar inexistente: não há o que cachear
+        return calcular()
+
+    chave = (nome, restaurante_id, bar_id, normalizar_filtros(params), versao)
+    agora = time.monotonic()
+    resultado = _ler(chave, agora, validade)
+    if resultado is not None:
+        return resultado
+
+    resultado = calcular()
+
+    with _lock:
+        _entradas[chave] = (agora, resultado)
+        _entradas.move_to_end(chave)
+        while len(_entradas) > _max_entradas():
+            _entradas.popitem(last=False)
+    return resultado
+
+
+def _ler(chave, agora, validade):
+    validade = validade_padrao() if validade is None else validade
+    with _lock:
+        entrada = _entradas.get(chave)
+        if entrada is not None and agora - entrada[0] < validade:
+            _entradas.move_to_end(chave)
+            return entrada[1]
+    return None
+
+
+def consultar(nome, params, *, restaurante_id=None, bar_id=None, validade=None):
+    """Resultado já cacheado (geração atual e dentro da validade) ou None, sem calcular."""
+    versao = geracao(restaurante_id, bar_id)
+    if versao is None:
+        return None
+    chave = (nome, restaurante_id, bar_id, normalizar_filtros(params), versao)
+    return _ler(chave, time.monotonic(), validade)
+
+
+def descartar(nome):
+    """Remove as entradas de um relatório (neste processo)."""
+    with _lock:
+        for chave in [k for k in _entradas if k[0] == nome]:
+            del _entradas[chave]
+
+
+def limpar():
+    with _lock:
+        _entradas.clear()
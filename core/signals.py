@@ -0,0 +1,59 @@
+# core/signals.py
+"""Invalidação do cache de relatórios para gravações feitas fora dos métodos
+   de lote dos models (admin, views que usam .save()/.delete() direto)."""
+
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from . import catalogo, relatorios_cache
+from .models import (
+    Restaurante, Bar, Produto, RecebimentoEstoque, TransferenciaBar, ContagemBar,
+    RequisicaoProduto, EstoqueBar, PerdaProduto, FechamentoTurno, Evento,
+    EventoProduto, EventoAlimento, Alimento,
+)
+
+
+@receiver([post_save, post_delete], sender=ContagemBar)
+@receiver([post_save, post_delete], sender=EstoqueBar)
+@receiver([post_save, post_delete], sender=PerdaProduto)
+@receiver([post_save, post_delete], sender=RecebimentoEstoque)
+@receiver([post_save, post_delete], sender=RequisicaoProduto)
+def _invalidar_por_bar(sender, instance, **kwargs):
+    Restaurante.invalidar_relatorios(bar_ids=[instance.bar_id])
+
+
+@receiver([post_save, post_delete], sender=TransferenciaBar)
+def _invalidar_transferencia(sender, instance, **kwargs):
+    Restaurante.invalidar_relatorios(bar_ids=[instance.origem_id, instance.destino_id])
+
+
+@receiver(post_save, sender=Bar)
+def _invalidar_bar(sender, instance, **kwargs):
+    Restaurante.invalidar_relatorios(bar_ids=[instance.pk])
+
+
+@receiver(post_save, sender=Restaurante)
+def _invalidar_restaurante(sender, instance, **kwargs):
+    Restaurante.invalidar_relatorios(restaurante_ids=[instance.pk])
+
+
+@receiver([post_save, post_delete], sender=Produto)
+@receiver(post_delete, sender=FechamentoTurno)
+def _invalidar_tudo(sender, instance, **kwargs):
+    # nome, categoria e ml da dose aparecem em todos os relatórios
+    Restaurante.invalidar_relatorios(todos=True)
+
+
+@receiver([post_save, post_delete], sender=Produto)
+@receiver([post_save, post_delete], sender=Alimento)
+def _invalidar_catalogo(sender, instance, **kwargs):
+    # os outros processos percebem pela versão (contagem, atualizado_em) no banco
+    catalogo.descartar('produtos' if sender is Produto else 'alimentos')
+
+
+@receiver([post_save, post_delete], sender=Evento)
+@receiver([post_save, post_delete], sender=EventoProduto)
+@receiver([post_save, post_delete], sender=EventoAlimento)
+def _invalidar_eventos(sender, instance, **kwargs):
+    # relatório global (sem geração): descarta já neste processo; nos demais vale a validade curta
+    relatorios_cache.descartar('eventos')
@@ -0,0 +1,252 @@
+# core/tabelas.py
+"""Relatórios em formato tabular (CSV e Parquet), para consumo por máquina (BI).
+
+   Cada relatório do registro de core/relatorios ganha aqui uma função @tabela que
+   achata o MESMO conjunto de dados da tela em colunas fixas + linhas (tuplas),
+   sem nenhuma formatação. Os relatórios que podem ser grandes (saída de estoque,
+   eventos) leem do cache da tela quando ela acabou de montá-los e, senão, direto
+   do banco em streaming, como a exportação Excel; o detalhe das perdas (paginado
+   na tela) vem sempre do banco.
+
+   - CSV: StreamingHttpResponse, uma linha por vez; nada é acumulado.
+   - Parquet: colunas montadas uma a uma e gravadas pelo pandas (engine pyarrow).
+     Sem pyarrow instalado, `parquet_disponivel()` é False e a view avisa."""
+
+import csv
+import io
+from datetime import datetime
+from decimal import Decimal
+from typing import Iterable, NamedTuple
+
+from django.http import HttpResponse, StreamingHttpResponse
+
+from core import relatorios
+from .models import PerdaProduto
+
+try:
+    import pyarrow  # noqa: F401  (engine do DataFrame.to_parquet)
+except ImportError:  # dependência opcional: sem ela só o CSV fica disponível
+    pyarrow = None
+
+
+class Tabela(NamedTuple):
+    colunas: list
+    linhas: Iterable     # tuplas na ordem de `colunas`
+
+
+class _Definicao(NamedTuple):
+    montar: callable     # (params, restaurante_id, bar_id) -> Tabela
+    escopo: str          # 'restaurante' | 'bar' | 'global' | 'grupo' (restaurantes nos parâmetros)
+
+
+_REGISTRO = {}
+
+
+def tabela(nome, *, escopo='restaurante'):
+    def registrar(montar):
+        _REGISTRO[nome] = _Definicao(montar, escopo)
+        return montar
+    return registrar
+
+
+def existe(nome):
+    return nome in _REGISTRO
+
+
+def escopo(nome):
+    return _REGISTRO[nome].escopo
+
+
+def montar(nome, params, *, restaurante_id=None, bar_id=None):
+    return _REGISTRO[nome].montar(params, restaurante_id=restaurante_id, bar_id=bar_id)
+
+
+def parquet_disponivel():
+    return pyarrow is not None
+
+
+# ---------------------------------------------------------------- respostas
+
+class _Eco:
+    """Pseudo-arquivo para o csv.writer: devolve a linha em vez de gravá-la."""
+
+    def write(self, valor):
+        return valor
+
+
+def _csv_linhas(tab):
+    escritor = csv.writer(_Eco())
+    yield escritor.writerow(tab.colunas)
+    for linha in tab.linhas:
+        yield escritor.writerow(linha)
+
+
+def resposta_csv(tab, nome_arquivo):
+    resp = StreamingHttpResponse(_csv_linhas(tab), content_type='text/csv; charset=utf-8')
+    resp['Content-Disposition'] = f'attachment; filename="{nome_arquivo}"'
+    return resp
+
+
+def _parquet_valor(valor):
+    # Decimal vira float: o pyarrow inferiria decimal128 com escala variável por coluna
+    return float(valor) if isinstance(valor, Decimal) else valor
+
+
+def resposta_parquet(tab, nome_arquivo):
+    import pandas as pd
+
+    colunas = [[] for _ in tab.colunas]
+    for linha in tab.linhas:
+        for coluna, valor in zip(colunas, linha):
+            coluna.append(_parquet_valor(valor))
+    df = pd.DataFrame(dict(zip(tab.colunas, colunas)), columns=tab.colunas)
+
+    buffer = io.BytesIO()
+    df.to_parquet(buffer, engine='pyarrow', index=False)
+    resp = HttpResponse(buffer.getvalue(), content_type='application/vnd.apache.parquet')
+    resp['Content-Disposition'] = f'attachment; filename="{nome_arquivo}"'
+    return resp
+
+
+# ---------------------------------------------------------------- relatórios
+
+def _nome(usuario):
+    return usuario.username if usuario else ''
+
+
+@tabela('saida_estoque', escopo='bar')
+def saida_estoque(params, restaurante_id=None, bar_id=None):
+    filtros = relatorios.ler_filtros('saida_estoque', params)
+    # mesma chave da tela (só os filtros; o corte das 50 últimas é da view)
+    dados = relatorios.em_cache('saida_estoque', bar_id=bar_id, **filtros)
+    if dados is not None:
+        requisicoes = dados.requisicoes
+    else:
+        requisicoes = relatorios.saida_estoque_queryset(bar_id, **filtros).iterator(chunk_size=2000)
+    return Tabela(
+        ['requisicao_id', 'produto_id', 'produto', 'quantidade', 'status',
+         'data_solicitacao', 'solicitado_por', 'decidido_por'],
+        ((r.id, r.produto_id, r.produto.nome, r.quantidade_solicitada, r.status,
+          r.data_solicitacao, _nome(r.usuario), _nome(r.usuario_aprovador))
+         for r in requisicoes),
+    )
+
+
+@tabela('perdas')
+def perdas(params, restaurante_id=None, bar_id=None):
+    filtros = relatorios.ler_filtros('perdas', params)
+    itens = relatorios.perdas_queryset(restaurante_id, **filtros).iterator(chunk_size=2000)
+    motivos = dict(PerdaProduto.MOTIVOS)
+    return Tabela(
+        ['perda_id', 'data_registro', 'restaurante_id', 'bar_id', 'bar', 'produto_id',
+         'produto_codigo', 'produto', 'garrafas', 'doses', 'motivo', 'motivo_rotulo',
+         'usuario', 'observacao', 'baixado'],
+        ((p.id, p.data_registro, p.restaurante_id, p.bar_id, p.bar.nome, p.produto_id,
+          p.produto.codigo or '', p.produto.nome, p.garrafas, p.doses, p.motivo,
+          motivos.get(p.motivo, p.motivo), _nome(p.usuario), p.observacao or '', p.baixado)
+         for p in itens),
+    )
+
+
+@tabela('consolidado_periodo')
+def consolidado_periodo(params, restaurante_id=None, bar_id=None):
+    *_, ini_dt, fim_dt = relatorios.intervalo(params)
+    dados = relatorios.obter('consolidado_periodo', restaurante_id=restaurante_id, ini_dt=ini_dt,
+                             fim_dt=fim_dt, **relatorios.ler_filtros('consolidado_periodo', params))
+    return Tabela(
+        ['produto_id', 'produto', *relatorios.CAMPOS_PERIODO],
+        ((l['produto'].id, l['produto'].nome, *(l[c] for c in relatorios.CAMPOS_PERIODO)) for l in dados.linhas),
+    )
+
+
+@tabela('consolidado_grupo', escopo='grupo')
+def consolidado_grupo(params, restaurante_id=None, bar_id=None):
+    """Uma linha por restaurante × produto (a soma do grupo fica para quem consome)."""
+    *_, ini_dt, fim_dt = relatorios.intervalo(params)
+    dados = relatorios.consolidado_grupo(ini_dt=ini_dt, fim_dt=fim_dt,
+                                         **relatorios.filtros_consolidado_grupo(params))
+
+    def linhas():
+        for r in dados.restaurantes:
+            for linha in dados.linhas:
+                l = linha['por_restaurante'].get(r.id)
+                if l is not None:
+                    yield (r.id, r.nome, l['produto'].id, l['produto'].nome,
+                           *(l[c] for c in relatorios.CAMPOS_PERIODO))
+
+    return Tabela(['restaurante_id', 'restaurante', 'produto_id', 'produto', *relatorios.CAMPOS_PERIODO], linhas())
+
+
+@tabela('consolidado_atual')
+def consolidado_atual(params, restaurante_id=None, bar_id=None):
+    dados = relatorios.obter('consolidado_atual', restaurante_id=restaurante_id)
+    return Tabela(
+        ['produto_id', 'produto', 'garrafas', 'doses'],
+        ((l['produto'].id, l['produto'].nome, l['g'], l['d']) for l in dados.linhas),
+    )
+
+
+@tabela('eventos', escopo='global')
+def eventos(params, restaurante_id=None, bar_id=None):
+    """Uma linha por item (bebida ou alimento) de cada evento."""
+    filtros = relatorios.ler_filtros('eventos', params)
+    dados = relatorios.em_cache('eventos', **filtros)
+    if dados is not None:
+        resumos = dados.eventos
+    else:
+        resumos = (relatorios.resumo_evento(ev)
+                   for ev in relatorios.eventos_queryset(**filtros).iterator(chunk_size=200))
+
+    def linhas():
+        for ev in resumos:
+            base = (ev['obj'].id, ev['nome'], ev['data'], ev['restaurante_nome'] or '', ev['status'],
+                    ev['baixado'], ev['pessoas'], ev['horas'])
+            for it in ev['itens_bebidas']:
+                yield base + ('bebida', it['produto'], it['garrafas'], it['doses'], it['ml'], None, '')
+            for it in ev['itens_alimentos']:
+                yield base + ('alimento', it['alimento'], None, None, None, it['quantidade'], it['unidade'])
+
+    return Tabela(
+        ['evento_id', 'evento', 'data_evento', 'restaurante', 'status', 'baixado', 'pessoas', 'horas',
+         'tipo', 'item', 'garrafas', 'doses', 'ml', 'quantidade', 'unidade'],
+        linhas(),
+    )
+
+
+@tabela('contagem_atual')
+def contagem_atual(params, restaurante_id=None, bar_id=None):
+    dados = relatorios.obter('contagem_atual', restaurante_id=restaurante_id,
+                             **relatorios.ler_filtros('contagem_atual', params))
+    return Tabela(
+        ['bar', 'produto_id', 'produto', 'garrafas', 'doses', 'total_ml', 'doses_equivalentes',
+         'data_contagem', 'usuario'],
+        ((bar, l['contagem'].produto_id, l['contagem'].produto.nome,
+          l['contagem'].quantidade_garrafas_cheias, l['contagem'].quantidade_doses_restantes,
+          l['total_ml'], l['doses_equivalentes'], l['contagem'].data_contagem, _nome(l['contagem'].usuario))
+         for bar, itens in dados.dados_por_bar.items() for l in itens),
+    )
+
+
+@tabela('diferenca_contagens')
+def diferenca_contagens(params, restaurante_id=None, bar_id=None):
+    dados = relatorios.obter('diferenca_contagens', restaurante_id=restaurante_id,
+                             **relatorios.ler_filtros('diferenca_contagens', params))
+    return Tabela(
+        ['bar', 'produto_id', 'produto', 'penultima_garrafas', 'penultima_doses', 'penultima_data',
+         'ultima_garrafas', 'ultima_doses', 'ultima_data', 'diferenca_garrafas', 'diferenca_doses'],
+        ((bar, l['produto'].id, l['produto'].nome, l['p_g'], l['p_d'], l['data_p'],
+          l['u_g'], l['u_d'], l['data_u'], l['diff_g'], l['diff_d'])
+         for bar, itens in dados.dados_por_bar.items() for l in itens),
+    )
+
+
+@tabela('consolidado_diferenca', escopo='bar')
+def consolidado_diferenca(params, restaurante_id=None, bar_id=None):
+    dados = relatorios.obter('consolidado_diferenca', bar_id=bar_id,
+                             **relatorios.ler_filtros('consolidado_diferenca', params))
+    return Tabela(
+        ['dia', 'produto_id', 'produto', 'quantidade_requisitada', 'cheias', 'doses', 'diferenca'],
+        ((datetime.strptime(dia, '%d/%m/%Y').date(), produto.id, produto.nome,
+          d['quantidade_requisitada'], d['cheias'], d['doses'], d['diferenca'])
+         for dia, por_produto in dados.por_dia.items() for produto, d in por_produto.items()),
+    )
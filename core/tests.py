@@ -1,3 +1,29 @@
+import json
+
+from django.db import connection
 from django.test import TestCase
 
-# Create your tests here.
+from core.management.commands.verificar_indices import _consultas, _varreduras_sequenciais
+from core.models import Bar, Restaurante
+
+
+class IndicesDasConsultasQuentesTest(TestCase):
+    """As consultas quentes das telas (as mesmas do manage.py verificar_indices)
+       precisam de um índice utilizável: com enable_seqscan desligado, nenhuma pode
+       ler a tabela principal por varredura sequencial."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.restaurante = Restaurante.objects.create(nome='Restaurante Teste')
+        cls.bar = Bar.objects.create(nome='Bar Teste', restaurante=cls.restaurante)
+
+    def test_consultas_usam_indice(self):
+        # o TestCase roda dentro de uma transação: o SET LOCAL vale só para este teste
+        with connection.cursor() as cur:
+            cur.execute("SET LOCAL enable_seqscan = off")
+        for nome, qs in _consultas(self.restaurante.id, self.bar.id):
+            with self.subTest(consulta=nome):
+                plano = json.loads(qs.explain(format='json'))[0]['Plan']
+                tabela = qs.model._meta.db_table
+                self.assertFalse(any(_varreduras_sequenciais(plano, tabela)),
+                                 f"{nome}: varredura sequencial em {tabela}")
@@ -56,6 +56,16 @@ urlpatterns = [
     path("relatorios/perdas/exportar/", views.exportar_relatorio_perdas_excel, name="exportar_relatorio_perdas_excel"),
     path('relatorios/perdas/marcar/<int:perda_id>/', views.marcar_perda_baixada, name='marcar_perda_baixada'),
     path('relatorios/perdas/desmarcar/<int:perda_id>/', views.desmarcar_perda_baixada, name='desmarcar_perda_baixada'),
+    path(
+        "relatorios/consolidado/grupo/",
+        views.relatorio_consolidado_grupo,
+        name="relatorio_consolidado_grupo",
+    ),
+    path(
+        "relatorios/consolidado/grupo/exportar/",
+        views.exportar_consolidado_grupo_excel,
+        name="exportar_consolidado_grupo_excel",
+    ),
     path(
         "relatorios/consolidado/periodo/",
         views.relatorio_consolidado_periodo,
@@ -86,4 +96,15 @@ urlpatterns = [
     path('relatorio_eventos/exportar_excel/', views.exportar_relatorio_eventos_excel, name='exportar_relatorio_eventos_excel'),
     path('relatorios/eventos/<int:evento_id>/baixar/', views.marcar_evento_baixado, name='marcar_evento_baixado'),
     path('relatorios/eventos/<int:evento_id>/desmarcar/', views.desmarcar_evento_baixado, name='desmarcar_evento_baixado'),
+
+    # Dados dos relatórios para BI (CSV / Parquet)
+    path('relatorios/dados/<slug:nome>.<slug:formato>', views.exportar_dados_relatorio, name='exportar_dados_relatorio'),
+
+    # Exportações em segundo plano
+    path('exportacoes/solicitar/', views.solicitar_exportacao, name='solicitar_exportacao'),
+    path('exportacoes/<int:tarefa_id>/status/', views.status_exportacao, name='status_exportacao'),
+    path('exportacoes/<int:tarefa_id>/arquivo/', views.baixar_exportacao, name='baixar_exportacao'),
+
+    # Catálogo (JSON) para o autocomplete de produtos/alimentos
+    path('catalogo/<slug:tipo>/', views.catalogo_json, name='catalogo'),
 ]
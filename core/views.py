@@ -1,41 +1,47 @@
 from django.contrib.auth import authenticate, login, logout
 from django.shortcuts import render, redirect, get_object_or_404
 from .models import ( Produto, Bar, Restaurante, RequisicaoProduto, TransferenciaBar, ContagemBar, EstoqueBar, models,
- AcessoUsuarioBar, EventoProduto, Evento, PermissaoPagina, RecebimentoEstoque, EventoAlimento, Alimento, PerdaProduto) 
+ AcessoUsuarioBar, EventoProduto, Evento, PermissaoPagina, RecebimentoEstoque, EventoAlimento, Alimento, PerdaProduto,
+ TarefaExportacao) 
 from decimal import Decimal, InvalidOperation
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.views.decorators.http import require_POST
+from django.utils.cache import get_conditional_response
 from itertools import zip_longest
 from datetime import time
 from django.core.paginator import Paginator
-from django.db import transaction
+from django.db import IntegrityError, OperationalError, transaction
 from django.core.exceptions import FieldError
+import logging
 import uuid
-from core.utils import calcular_totais_ml_e_doses
+from core import catalogo, exportacoes, historico, janelas, relatorios, tabelas
+from core.condicional import condicional
+from core.planilhas import CONTENT_TYPE_XLSX, PlanilhaStream
 import pandas as pd
 import openpyxl
 import io
-from io import BytesIO
 import xlsxwriter
 from django.utils.timezone import is_aware, localtime, timedelta
 from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
 from openpyxl.formatting.rule import ColorScaleRule
 from django.utils import timezone
-from django.db.models import Sum, Max, Q, Count
+from django.db.models import Max, Count
 from openpyxl.utils import get_column_letter
-from django.http import HttpResponse
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, QueryDict
+from django.urls import reverse
 from openpyxl import Workbook
 from django.contrib.auth.decorators import user_passes_test
 from django.db.models import DateField, F
 from django.core.files.storage import default_storage
-from django.db.models.functions import TruncDate
-from collections import defaultdict, OrderedDict
+from collections import defaultdict
 from django.utils.timezone import now
 from django.utils.dateparse import parse_date
 from babel.dates import parse_date
-from datetime import datetime, date
-from django.utils.text import slugify
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
 
 def login_view(request):
     context = {}
@@ -96,9 +102,7 @@ def selecionar_bar_view(request):
                     .filter(user=request.user)
                     .select_related('restaurante'))
 
-    restaurantes_permitidos = (Restaurante.objects
-                               .filter(id__in=acessos_user.values_list('restaurante_id', flat=True).distinct())
-                               .order_by('nome'))
+    restaurantes_permitidos = Restaurante.do_usuario(request.user)
 
     # Trocar restaurante explicitamente
     if request.method == 'POST' and request.POST.get('acao') == 'trocar_restaurante':
@@ -212,8 +216,8 @@ def requisicao_produtos_view(request):
 
         return redirect('requisicao')
 
-    produtos = Produto.objects.filter(ativo=True).order_by('nome')
-    return render(request, 'core/requisicao.html', {'produtos': produtos})
+    # produtos vêm do catálogo (views.catalogo_json), não do HTML
+    return render(request, 'core/requisicao.html')
 
 
 @login_required
@@ -230,8 +234,7 @@ def aprovar_requisicoes_view(request):
         restaurante_id=restaurante_id, status='PENDENTE'
     )
 
-    restaurante = get_object_or_404(Restaurante, id=restaurante_id)
-    bar_central = get_object_or_404(Bar, restaurante=restaurante, is_estoque_central=True)
+    get_object_or_404(Restaurante, id=restaurante_id)
 
     if request.method == 'POST':
         # 1) Colete decisões do form
@@ -248,68 +251,53 @@ def aprovar_requisicoes_view(request):
             messages.info(request, "Nenhuma requisição selecionada.")
             return redirect('aprovar-requisicoes')
 
-        # 2) Busque as PENDENTES escolhidas e processe em ORDEM de chegada
-        qs = (
-            RequisicaoProduto.objects
-            .filter(id__in=decisoes.keys(), restaurante_id=restaurante_id, status='PENDENTE')
-            .select_related('produto', 'bar')
-            .order_by('data_solicitacao', 'id')
-        )
-
+        base = RequisicaoProduto.objects.filter(restaurante_id=restaurante_id, status='PENDENTE')
         erros = []
 
-        for requisicao in qs:
-            decisao = decisoes.get(requisicao.id)
-
-            if decisao == 'aprovar':
-                try:
-                    qtd = Decimal(requisicao.quantidade_solicitada or 0)
-                except Exception:
-                    qtd = Decimal('0')
-
-                if qtd <= 0:
-                    requisicao.status = 'FALHA_ESTOQUE'
-                    requisicao.motivo_negativa = "Quantidade inválida."
-                    messages.warning(request, f"Requisição: quantidade inválida.")
+        # 2) Aprovações: motor em lote (ordem de chegada, locks ordenados, updates set-based)
+        ids_aprovar = [rid for rid, d in decisoes.items() if d == 'aprovar']
+        if ids_aprovar:
+            try:
+                processadas = RequisicaoProduto.aprovar_lote(base.filter(id__in=ids_aprovar), request.user)
+            except (IntegrityError, OperationalError):
+                logger.exception("Falha ao aprovar requisições do restaurante %s", restaurante_id)
+                processadas = []
+                erros.append("Não foi possível aprovar as requisições agora. Tente novamente.")
+
+            for requisicao in processadas:
+                if requisicao.status == 'APROVADA':
+                    messages.success(request, f"Requisição aprovada ({requisicao.produto.nome}).")
+                elif requisicao.motivo_negativa == "Quantidade inválida.":
+                    messages.warning(request, "Requisição: quantidade inválida.")
                 else:
-                    try:
-                        ok = EstoqueBar.transferir(
-                            origem=bar_central,
-                            destino=requisicao.bar,
-                            produto=requisicao.produto,
-                            garrafas=qtd
-                        )
-                        if ok:
-                            requisicao.status = 'APROVADA'
-                            messages.success(
-                                request, f"Requisição aprovada ({requisicao.produto.nome})."
-                            )
-                        else:
-                            requisicao.status = 'FALHA_ESTOQUE'
-                            requisicao.motivo_negativa = "Produto insuficiente no estoque central."
-                            messages.warning(
-                                request,
-                                f"Requisição: estoque insuficiente para {requisicao.produto.nome}."
-                            )
-                    except Exception as e:
-                        erros.append(f"Erro ao aprovar a requisição: {e}")
-
-                requisicao.usuario_aprovador = request.user
-                requisicao.data_decisao = timezone.now()
-                requisicao.save()
+                    messages.warning(
+                        request,
+                        f"Requisição: estoque insuficiente para {requisicao.produto.nome}."
+                    )
 
-            elif decisao == 'negar':
+        # 3) Negativas: um único bulk_update
+        ids_negar = [rid for rid, d in decisoes.items() if d == 'negar']
+        if ids_negar:
+            agora = timezone.now()
+            negadas = []
+            for requisicao in base.filter(id__in=ids_negar).order_by('data_solicitacao', 'id'):
                 motivo = (request.POST.get(f'motivo_{requisicao.id}', '') or '').strip()
                 if not motivo:
-                    erros.append(f"Informe o motivo da negativa para a requisição.")
+                    erros.append("Informe o motivo da negativa para a requisição.")
                     continue
-
                 requisicao.status = 'NEGADA'
                 requisicao.motivo_negativa = motivo
                 requisicao.usuario_aprovador = request.user
-                requisicao.data_decisao = timezone.now()
-                requisicao.save()
-                messages.info(request, f"Requisição negada.")
+                requisicao.data_decisao = agora
+                negadas.append(requisicao)
+
+            if negadas:
+                RequisicaoProduto.objects.bulk_update(
+                    negadas, ['status', 'motivo_negativa', 'usuario_aprovador', 'data_decisao']
+                )
+                Restaurante.invalidar_relatorios(bar_ids={r.bar_id for r in negadas})
+                for _ in negadas:
+                    messages.info(request, "Requisição negada.")
 
         for e in erros:
             messages.error(request, e)
@@ -352,34 +340,18 @@ def historico_requisicoes_view(request):
             'filtro_ativo': filtro_ativo
         })
 
-    mes = request.GET.get('mes')
-    ano = request.GET.get('ano')
+    janela = janelas.mes(request.GET.get('mes'), request.GET.get('ano'))
+    filtro_ativo = janela is not None
 
     # ⚡ mais performático para render (tudo que exibimos é FK direta)
     qs = (RequisicaoProduto.objects
           .filter(restaurante_id=restaurante_id, bar_id=bar_id)
           .select_related('produto', 'bar', 'usuario', 'usuario_aprovador'))
-
-    if mes and ano:
-        try:
-            mes_i = int(mes)
-            ano_i = int(ano)
-            qs = qs.filter(data_solicitacao__month=mes_i, data_solicitacao__year=ano_i)
-            filtro_ativo = True
-        except ValueError:
-            pass
-        qs = qs.order_by('-data_solicitacao')
-    else:
-        # Últimas 20 (sem filtro)
-        qs = qs.order_by('-data_solicitacao')[:20]
-
-    # Agrupa por data (dia)
-    qs = qs.annotate(data_truncada=TruncDate('data_solicitacao'))
-    for r in qs:
-        agrupado[r.data_truncada].append(r)
+    pagina = historico.paginar(qs, 'data_solicitacao', cursor=request.GET.get('antes'), janela=janela)
 
     return render(request, 'core/historico_requisicoes.html', {
-        'agrupado': dict(agrupado),
+        'agrupado': pagina.dias,
+        'proximo': pagina.proximo,
         'now': datetime.now(),
         'filtro_ativo': filtro_ativo
     })
@@ -406,38 +378,26 @@ def entrada_mercadorias_view(request):
         produtos = request.POST.getlist('produto[]')
         quantidades = request.POST.getlist('quantidade[]')
 
-        for prod_id, qtd in zip(produtos, quantidades):
-            produto = Produto.objects.get(id=prod_id)
-            quantidade = Decimal((qtd or '').replace(',', '.')) if qtd else Decimal(0)
-
-            # Monta kwargs para não quebrar caso o modelo ainda não tenha esses campos
-            kwargs = dict(
-                restaurante=restaurante,
-                bar=estoque_central,
-                produto=produto,
-                quantidade=quantidade
-            )
-            # Se o modelo tiver usuario/data_recebimento/observacao, preenche
-            if hasattr(RecebimentoEstoque, 'usuario'):
-                kwargs['usuario'] = request.user
-            if hasattr(RecebimentoEstoque, 'data_recebimento'):
-                kwargs['data_recebimento'] = timezone.now()
-            # Observação opcional vinda do form (ex.: um <input name="observacao"> geral ou por linha)
-            obs = (request.POST.get('observacao') or '').strip()
-            if obs and hasattr(RecebimentoEstoque, 'observacao'):
-                kwargs['observacao'] = obs
-
-            # 1) Registra a entrada
-            RecebimentoEstoque.objects.create(**kwargs)
-
-            # 2) Atualiza estoque do bar central
-            EstoqueBar.adicionar(estoque_central, produto, quantidade)
+        try:
+            itens = [
+                (prod_id, Decimal((qtd or '').replace(',', '.')) if qtd else Decimal(0))
+                for prod_id, qtd in zip(produtos, quantidades)
+                if prod_id
+            ]
+            # Uma transação: produtos validados numa consulta, recebimentos em bulk
+            # e estoque central creditado com um único upsert (duplicados somados).
+            RecebimentoEstoque.registrar_lote(restaurante, estoque_central, itens, usuario=request.user)
+        except (InvalidOperation, ValueError):
+            messages.error(request, "Quantidade inválida na entrada de mercadorias.")
+            return redirect('entrada-mercadorias')
+        except Produto.DoesNotExist:
+            messages.error(request, "Produto não encontrado na entrada de mercadorias.")
+            return redirect('entrada-mercadorias')
 
         messages.success(request, "Entrada de mercadorias realizada com sucesso!")
         return redirect('entrada-mercadorias')
 
-    produtos = Produto.objects.filter(ativo=True).order_by('nome')
-    return render(request, 'core/entrada_mercadorias.html', {'produtos': produtos})
+    return render(request, 'core/entrada_mercadorias.html')
 
 
 
@@ -452,95 +412,17 @@ def historico_entradas_view(request):
         messages.error(request, "Restaurante não selecionado.")
         return redirect('dashboard')
 
-    # Base
     entradas = RecebimentoEstoque.objects.filter(restaurante_id=restaurante_id).select_related(
         'produto', 'bar', 'usuario'
     )
-
-    # Campo de data preferencial
-    data_field = 'data_recebimento' if hasattr(RecebimentoEstoque, 'data_recebimento') else (
-                 'created_at' if hasattr(RecebimentoEstoque, 'created_at') else None)
-
-    # Ordenação alinhada ao índice
-    if data_field:
-        entradas = entradas.order_by(f'-{data_field}', '-id')
-    else:
-        entradas = entradas.order_by('-id')  # fallback
-
-    # Filtros
-    mes = request.GET.get('mes')
-    ano = request.GET.get('ano')
-    before = request.GET.get('before')  # cursor para datas anteriores (YYYY-MM-DD)
-
-    # Filtro Mês/Ano: preferir range (aproveita índice)
-    if mes and ano and data_field:
-        ano = int(ano); mes = int(mes)
-        inicio = date(ano, mes, 1)
-        if mes == 12:
-            fim = date(ano + 1, 1, 1)
-        else:
-            fim = date(ano, mes + 1, 1)
-        entradas = entradas.filter(**{f'{data_field}__gte': inicio, f'{data_field}__lt': fim})
-
-    agrupado = {}
-    next_before = None
-
-    # Quando NÃO está filtrando por mês/ano, aplicamos o modelo "10 dias + cursor"
-    if not (mes and ano):
-        if before and data_field:
-            # pega blocos de 10 dias anteriores ao dia passado
-            entradas = entradas.filter(**{f'{data_field}__date__lt': before})
-
-        # subquery leve só com as 10 últimas datas distintas
-        if data_field:
-            ultimos_dias = (entradas
-                            .annotate(d=TruncDate(data_field))
-                            .values_list('d', flat=True)
-                            .distinct()
-                            .order_by('-d')[:10])
-            dias = list(ultimos_dias)
-            if dias:
-                entradas = (entradas
-                            .filter(**{f'{data_field}__date__in': dias})
-                            .only('id', 'quantidade',
-                                  'produto__nome', 'bar__nome',
-                                  'usuario__username', data_field))
-                # agrupa em memória
-                tmp = defaultdict(list)
-                for e in entradas:
-                    dia = getattr(e, data_field).date() if data_field else 'Sem data'
-                    tmp[dia].append(e)
-                # ordena as chaves (decrescente)
-                agrupado = dict(sorted(tmp.items(), key=lambda kv: kv[0], reverse=True))
-                next_before = min(dias).isoformat()
-            else:
-                agrupado = {}
-        else:
-            # sem campo de data (raro) — só lista últimos N
-            tmp = defaultdict(list)
-            for e in entradas[:200]:
-                tmp['Sem data'].append(e)
-            agrupado = dict(tmp)
-    else:
-        # Mês/Ano: lista tudo do período (a consulta já veio estreita pelo índice)
-        if data_field:
-            entradas = entradas.annotate(d=TruncDate(data_field))
-            tmp = defaultdict(list)
-            for e in entradas:
-                tmp[e.d].append(e)
-            agrupado = dict(sorted(tmp.items(), key=lambda kv: kv[0], reverse=True))
-        else:
-            tmp = defaultdict(list)
-            for e in entradas:
-                tmp['Sem data'].append(e)
-            agrupado = dict(tmp)
+    janela = janelas.mes(request.GET.get('mes'), request.GET.get('ano'))
+    pagina = historico.paginar(entradas, 'data_recebimento', cursor=request.GET.get('antes'), janela=janela)
 
     return render(request, 'core/historico_entradas.html', {
-        'agrupado': agrupado,
+        'agrupado': pagina.dias,
+        'proximo': pagina.proximo,  # para o botão "Ver dias anteriores"
         'now': timezone.now(),
         'meses': list(range(1, 13)),
-        'data_field': data_field,
-        'next_before': next_before,  # para o botão "Ver dias anteriores"
     })
 
 
@@ -573,6 +455,7 @@ def contagem_view(request):
 
     if request.method == 'POST':
         # Percorre SEMPRE a lista fixa que renderizamos
+        itens = {}
         for p in produtos:
             g_raw = (request.POST.get(f'garrafas_{p.id}', '') or '').strip()
             d_raw = (request.POST.get(f'doses_{p.id}', '') or '').strip()
@@ -592,21 +475,10 @@ def contagem_view(request):
             except (InvalidOperation, ValueError):
                 d_val = Decimal('0')
 
-            # 1) Registrar contagem
-            ContagemBar.objects.create(
-                bar=bar,
-                produto=p,
-                quantidade_garrafas_cheias=g_val,
-                quantidade_doses_restantes=d_val,
-                usuario=request.user,
-                data_contagem=timezone.now()
-            )
+            itens[p.id] = (g_val, d_val)
 
-            # 2) Atualizar estoque atual
-            estoque, _ = EstoqueBar.objects.get_or_create(bar=bar, produto=p)
-            estoque.quantidade_garrafas = g_val
-            estoque.quantidade_doses = d_val
-            estoque.save()
+        # Lote atômico: contagens em bulk (mesmo timestamp) + saldo com um único upsert
+        ContagemBar.registrar_lote(bar, itens, usuario=request.user)
 
         messages.success(request, "Contagem registrada e estoque atualizado com sucesso!")
         return redirect('contagem')
@@ -637,32 +509,13 @@ def historico_contagens_view(request):
         return redirect('dashboard')
     
     bar_id = request.session.get('bar_id')
-    bar = Bar.objects.get(id=bar_id)
-
-    mes = request.GET.get('mes')
-    ano = request.GET.get('ano')
-
-    contagens = ContagemBar.objects.filter(bar=bar)
-
-    if mes and ano:
-        contagens = contagens.filter(data_contagem__month=mes, data_contagem__year=ano)
-    else:
-        contagens = contagens.annotate(data=TruncDate('data_contagem')).order_by('-data_contagem')
-
-    agrupado = {}
-    for c in contagens:
-        data = c.data_contagem.date()
-        if mes and ano:
-            agrupado.setdefault(data, []).append(c)
-        else:
-            if data not in agrupado:
-                if len(agrupado) >= 10:
-                    break
-                agrupado[data] = []
-            agrupado[data].append(c)
+    contagens = ContagemBar.objects.filter(bar_id=bar_id).select_related('produto', 'usuario')
+    janela = janelas.mes(request.GET.get('mes'), request.GET.get('ano'))
+    pagina = historico.paginar(contagens, 'data_contagem', cursor=request.GET.get('antes'), janela=janela)
 
     return render(request, 'core/historico_contagens.html', {
-        'agrupado': agrupado,
+        'agrupado': pagina.dias,
+        'proximo': pagina.proximo,
         'now': now(),
         'meses': list(range(1, 13))  # de 1 a 12
     })
@@ -713,26 +566,24 @@ def transferencia_entre_bares_view(request):
             messages.error(request, "Bar de destino inválido.")
             return redirect('transferencia-bares')
 
-        # 🧮 Verifica se há estoque suficiente no bar de origem
-        sucesso = EstoqueBar.retirar(bar_origem, produto, quantidade)
+        # 🧮 Débito, crédito e registro da transferência: tudo ou nada
+        with transaction.atomic():
+            sucesso = EstoqueBar.transferir(bar_origem, bar_destino, produto, quantidade,
+                                            tipo='TRANSFERENCIA', usuario=request.user)
+            if sucesso:
+                TransferenciaBar.objects.create(
+                    restaurante=restaurante,
+                    origem=bar_origem,
+                    destino=bar_destino,
+                    produto=produto,
+                    quantidade=quantidade,
+                    usuario=request.user
+                )
 
         if not sucesso:
             messages.error(request, "Estoque insuficiente para essa transferência.")
             return redirect('transferencia-bares')
 
-        # ➕ Adiciona ao bar de destino
-        EstoqueBar.adicionar(bar_destino, produto, quantidade)
-
-        # 📝 Registra a transferência
-        TransferenciaBar.objects.create(
-            restaurante=restaurante,
-            origem=bar_origem,
-            destino=bar_destino,
-            produto=produto,
-            quantidade=quantidade,
-            usuario=request.user
-        )
-
         messages.success(request, "Transferência realizada com sucesso!")
         return redirect('transferencia-bares')
 
@@ -769,42 +620,19 @@ def historico_transferencias_view(request):
             'filtro_ativo': filtro_ativo
         })
 
-    bar = Bar.objects.get(id=bar_id)
-    mes = request.GET.get('mes')
-    ano = request.GET.get('ano')
-
-    # 🔍 Base query
-    transferencias = TransferenciaBar.objects.filter(
-        restaurante_id=restaurante_id
-    ).filter(
-        models.Q(origem=bar) | models.Q(destino=bar)
-    )
+    janela = janelas.mes(request.GET.get('mes'), request.GET.get('ano'))
+    filtro_ativo = janela is not None
 
-    if mes and ano:
-        try:
-            mes = int(mes)
-            ano = int(ano)
-            transferencias = transferencias.filter(
-                data_transferencia__month=mes,
-                data_transferencia__year=ano
-            )
-            filtro_ativo = True
-        except ValueError:
-            pass
-    else:
-        transferencias = transferencias.order_by('-data_transferencia')[:10]
-
-    # ✅ Anota data truncada para agrupar
-    transferencias = transferencias.annotate(
-        data_truncada=TruncDate('data_transferencia')
-    )
-
-    # ✅ Agora agrupamos sem risco de erro
-    for t in transferencias:
-        agrupado[t.data_truncada].append(t)
+    # 🔍 Base query: o bar como origem ou destino
+    transferencias = (TransferenciaBar.objects
+                      .filter(restaurante_id=restaurante_id)
+                      .filter(models.Q(origem_id=bar_id) | models.Q(destino_id=bar_id))
+                      .select_related('produto', 'origem', 'destino', 'usuario'))
+    pagina = historico.paginar(transferencias, 'data_transferencia', cursor=request.GET.get('antes'), janela=janela)
 
     return render(request, 'core/historico_transferencias.html', {
-        'agrupado': dict(agrupado),
+        'agrupado': pagina.dias,
+        'proximo': pagina.proximo,
         'now': datetime.now(),
         'filtro_ativo': filtro_ativo
     })
@@ -860,12 +688,10 @@ def pagina_eventos(request):
     eventos_abertos = paginator.get_page(page_number)
 
     # Consolidado: finalizados hoje após 06:00
-    tz = timezone.get_current_timezone()
-    start_dt = timezone.make_aware(datetime.combine(hoje, time(6, 0)), tz)
-    end_dt   = timezone.make_aware(datetime.combine(hoje, time(23, 59, 59, 999999)), tz)
+    janela = janelas.dia(hoje)._replace(de=timezone.make_aware(datetime.combine(hoje, time(6, 0))))
 
     finalizados_qs = (
-        Evento.objects.filter(status='FINALIZADO', finalizado_em__range=(start_dt, end_dt))
+        Evento.objects.filter(status='FINALIZADO', **janela.filtro('finalizado_em'))
         .select_related('restaurante')
         .prefetch_related('produtos__produto', 'alimentos__alimento')
         .order_by('-finalizado_em')
@@ -886,13 +712,9 @@ def pagina_eventos(request):
             consolidado_alimentos[nome]['quantidade'] += (item.quantidade or Decimal('0'))
             consolidado_alimentos[nome]['unidade'] = item.alimento.unidade
 
-    produtos = Produto.objects.all().order_by('nome')
-    alimentos = Alimento.objects.filter(ativo=True).order_by('nome')
     restaurantes = Restaurante.objects.all().order_by('nome')
 
     return render(request, 'eventos/pagina_eventos.html', {
-        'produtos': produtos,
-        'alimentos': alimentos,
         'restaurantes': restaurantes,
         'eventos_abertos': eventos_abertos,
         'paginator': paginator,
@@ -1151,12 +973,8 @@ def editar_evento(request, evento_id):
         messages.success(request, "Alterações salvas (itens removidos/atualizados).")
         return redirect('editar_evento', evento_id=evento.id)
 
-    produtos = Produto.objects.all().order_by('nome')
-    alimentos = Alimento.objects.filter(ativo=True).order_by('nome')
     return render(request, 'eventos/editar_evento.html', {
         'evento': evento,
-        'produtos': produtos,
-        'alimentos': alimentos,
         # 'restaurantes': Restaurante.objects.all().order_by('nome'),  # se quiser trocar na edição
     })
 
@@ -1326,13 +1144,10 @@ def pagina_perdas(request):
 
     bar = get_object_or_404(Bar, id=bar_id)
 
-    # produtos ativos (se quiser, pode filtrar só os que existem no estoque do bar)
-    produtos = Produto.objects.filter(ativo=True).order_by('nome')
-
     # perdas do dia APENAS do bar logado
     perdas_hoje = (
         PerdaProduto.objects
-        .filter(bar=bar, data_registro__date=hoje)
+        .filter(bar=bar, **janelas.dia(hoje).filtro('data_registro'))
         .select_related('bar', 'produto', 'usuario')
         .order_by('-data_registro')
     )
@@ -1346,7 +1161,6 @@ def pagina_perdas(request):
 
     return render(request, 'perdas/pagina_perdas.html', {
         'bar': bar,
-        'produtos': produtos,
         'perdas_hoje': perdas_hoje,
         'consolidado': dict(consolidado),
         'hoje': hoje,
@@ -1405,25 +1219,16 @@ def registrar_perda(request):
         return redirect('pagina_perdas')
 
     # --- Caso 2: produto controla -> baixa normal com bloqueio se insuficiente ---
-    estoque, _ = EstoqueBar.objects.get_or_create(
-        bar=bar, produto=produto,
-        defaults={'quantidade_garrafas': Decimal('0'), 'quantidade_doses': Decimal('0')}
-    )
-    antes_g = Decimal(estoque.quantidade_garrafas)
-    antes_d = Decimal(estoque.quantidade_doses)
-
-    ok = EstoqueBar.retirar(
-        bar=bar, produto=produto,
-        garrafas=Decimal(garrafas), doses=Decimal(doses)
+    # débito condicional numa única instrução, já devolvendo o saldo antes/depois
+    saldo = EstoqueBar.movimentar(
+        bar, produto,
+        garrafas=-Decimal(garrafas), doses=-Decimal(doses),
+        tipo='PERDA', usuario=request.user,
     )
-    if not ok:
+    if saldo is None:
         messages.error(request, "Estoque insuficiente para registrar a perda.")
         return redirect('pagina_perdas')
 
-    estoque = EstoqueBar.objects.get(bar=bar, produto=produto)
-    depois_g = Decimal(estoque.quantidade_garrafas)
-    depois_d = Decimal(estoque.quantidade_doses)
-
     PerdaProduto.objects.create(
         restaurante=bar.restaurante,
         bar=bar,
@@ -1433,10 +1238,10 @@ def registrar_perda(request):
         motivo=motivo if motivo in dict(PerdaProduto.MOTIVOS) else 'OUTRO',
         observacao=observacao,
         usuario=request.user,
-        estoque_antes_garrafas=antes_g,
-        estoque_antes_doses=antes_d,
-        estoque_depois_garrafas=depois_g,
-        estoque_depois_doses=depois_d,
+        estoque_antes_garrafas=saldo.antes_garrafas,
+        estoque_antes_doses=saldo.antes_doses,
+        estoque_depois_garrafas=saldo.depois_garrafas,
+        estoque_depois_doses=saldo.depois_doses,
         sem_baixa=False,
     )
 
@@ -1452,7 +1257,8 @@ def excluir_perda(request, perda_id):
     if perda.data_registro.date() == timezone.localdate():
         EstoqueBar.adicionar(
             bar=perda.bar, produto=perda.produto,
-            garrafas=Decimal(perda.garrafas), doses=Decimal(perda.doses)
+            garrafas=Decimal(perda.garrafas), doses=Decimal(perda.doses),
+            tipo='ESTORNO_PERDA', usuario=request.user,
         )
         perda.delete()
         messages.success(request, "Perda removida e estoque restituído.")
@@ -1797,6 +1603,7 @@ def relatorios_view(request):
 
 
 @login_required
+@condicional('saida_estoque')
 def relatorio_saida_estoque(request):
     bar_id = request.session.get('bar_id')
     if not bar_id:
@@ -1804,35 +1611,17 @@ def relatorio_saida_estoque(request):
 
     mes = request.GET.get('mes')
     ano = request.GET.get('ano')
-    produto_query = request.GET.get('produto', '').strip()
-
-    requisicoes = RequisicaoProduto.objects.filter(
-        bar_id=bar_id,
-        status__in=['APROVADA', 'NEGADA', 'FALHA_ESTOQUE']
-    )
-
-    # Aplicar os filtros de produto antes de cortar
-    if produto_query:
-        requisicoes = requisicoes.filter(produto__nome__icontains=produto_query)
-
-    if mes and ano:
-        requisicoes = requisicoes.filter(data_solicitacao__month=int(mes), data_solicitacao__year=int(ano))
-    elif mes:
-        requisicoes = requisicoes.filter(data_solicitacao__month=int(mes))
-    elif ano:
-        requisicoes = requisicoes.filter(data_solicitacao__year=int(ano))
+    filtros = relatorios.ler_filtros('saida_estoque', request)
 
     # Se nenhum filtro de data foi usado, limita a 50 últimas
-    if not mes and not ano:
-        requisicoes = requisicoes.order_by('-data_solicitacao')[:50]
-    else:
-        requisicoes = requisicoes.order_by('-data_solicitacao')
+    limite = None if (filtros['mes'] or filtros['ano']) else 50
+    dados = relatorios.obter('saida_estoque', bar_id=bar_id, **filtros)
 
     context = {
-        'requisicoes': requisicoes,
+        'requisicoes': dados.requisicoes[:limite],
         'mes': mes or '',
         'ano': ano or '',
-        'produto': produto_query or '',
+        'produto': filtros['produto'],
     }
 
     return render(request, 'core/relatorios/saida_estoque.html', context)
@@ -1843,62 +1632,26 @@ def relatorio_saida_estoque(request):
 
 
 @login_required
+@condicional('consolidado_diferenca')
 def relatorio_consolidado_view(request):
     bar_id = request.session.get('bar_id')
     if not bar_id:
         return render(request, 'erro.html', {'mensagem': 'Nenhum bar selecionado.'})
 
     # Filtros de mês e ano, padrão para o mês atual
-    hoje = timezone.now()
+    hoje = timezone.localdate()
     mes = request.GET.get('mes', f"{hoje.month:02}")
     ano = request.GET.get('ano', str(hoje.year))
 
-    # Buscar requisições aprovadas no período
-    requisicoes = RequisicaoProduto.objects.filter(
-        bar_id=bar_id,
-        status='APROVADA',
-        data_solicitacao__month=int(mes),
-        data_solicitacao__year=int(ano)
-    )
-
-    dados_agrupados = defaultdict(lambda: defaultdict(dict))  # data -> produto_obj -> dados
-
-    for req in requisicoes:
-        data_str = req.data_solicitacao.date().strftime('%d/%m/%Y')
-        produto = req.produto
-
-        # Acumular quantidade requisitada
-        dados_agrupados[data_str][produto]['quantidade_requisitada'] = \
-            dados_agrupados[data_str][produto].get('quantidade_requisitada', 0) + float(req.quantidade_solicitada)
-
-        # Buscar contagem do dia
-        contagem = ContagemBar.objects.filter(
-            bar_id=bar_id,
-            produto=produto,
-            data_contagem__date=req.data_solicitacao.date()
-        ).order_by('-data_contagem').first()
-
-        if contagem:
-            dados_agrupados[data_str][produto]['cheias'] = contagem.quantidade_garrafas_cheias
-            dados_agrupados[data_str][produto]['doses'] = float(contagem.quantidade_doses_restantes)
-        else:
-            dados_agrupados[data_str][produto]['cheias'] = 0
-            dados_agrupados[data_str][produto]['doses'] = 0.0
-
-        # Cálculo da diferença (apenas em garrafas)
-        requisitado = dados_agrupados[data_str][produto]['quantidade_requisitada']
-        cheias = dados_agrupados[data_str][produto]['cheias']
-        dados_agrupados[data_str][produto]['diferenca'] = abs(cheias - requisitado)
+    dados_agrupados = relatorios.obter(
+        'consolidado_diferenca', bar_id=bar_id, **relatorios.ler_filtros('consolidado_diferenca', request),
+    ).por_dia
 
-
-    # Converter Produto -> produto.nome e ordenar datas de forma decrescente
-    dados_agrupados_final = dict()
-    for data in sorted(dados_agrupados.keys(), reverse=True):
-        produtos_formatados = {
-            produto_obj.nome: dados
-            for produto_obj, dados in dados_agrupados[data].items()
-        }
-        dados_agrupados_final[data] = produtos_formatados
+    # Converter Produto -> produto.nome (datas já em ordem decrescente)
+    dados_agrupados_final = {
+        data: {produto_obj.nome: dados for produto_obj, dados in produtos.items()}
+        for data, produtos in dados_agrupados.items()
+    }
 
     context = {
         'dados_agrupados': dados_agrupados_final,
@@ -1912,6 +1665,7 @@ def relatorio_consolidado_view(request):
 SHIFT_START_HOUR = 19  # início do "dia operacional": 19:00
 
 @login_required
+@condicional('contagem_atual')
 def relatorio_contagem_atual(request):
     bar_id = request.session.get('bar_id')
     if not bar_id:
@@ -1919,84 +1673,24 @@ def relatorio_contagem_atual(request):
 
     bar_atual = get_object_or_404(Bar, id=bar_id)
     restaurante = bar_atual.restaurante
-    bares = Bar.objects.filter(restaurante=restaurante).order_by('nome')
-
-    # --------- Filtro de data ---------
-    filtro_data_str = (request.GET.get('data') or '').strip()   # formato: YYYY-MM-DD
-    modo = (request.GET.get('modo') or 'operacional').lower()   # 'operacional' | 'calendario'
-    use_range = False
-    inicio = fim = None
-
-    if filtro_data_str:
-        try:
-            dia = datetime.strptime(filtro_data_str, '%Y-%m-%d').date()
-            tz = timezone.get_current_timezone()
-
-            if modo == 'calendario':
-                inicio = timezone.make_aware(datetime.combine(dia, time(0, 0, 0)), tz)
-                fim    = inicio + timedelta(days=1)
-            else:
-                start_naive = datetime.combine(dia, time(SHIFT_START_HOUR, 0, 0))
-                inicio = timezone.make_aware(start_naive, tz)
-                fim    = inicio + timedelta(days=1)
-
-            use_range = True
-        except ValueError:
-            messages.warning(request, "Data inválida no filtro; exibindo contagem atual.")
-
-    dados_por_bar = {}
-    somatorio_total = defaultdict(lambda: {
-        'produto': None,
-        'garrafas': 0,
-        'doses': 0.0,
-        'total_ml': 0.0,
-        'doses_equivalentes': 0.0,
-    })
 
-    for bar in bares:
-        qs = ContagemBar.objects.filter(bar=bar).order_by('-data_contagem', '-id')
-        if use_range:
-            qs = qs.filter(data_contagem__gte=inicio, data_contagem__lt=fim)
+    # --------- Filtro de data ('data' = YYYY-MM-DD, 'modo' = operacional | calendario) ---------
+    filtro_data_str = (request.GET.get('data') or '').strip()
+    filtros = relatorios.ler_filtros('contagem_atual', request)
+    if filtro_data_str and filtros['dia'] is None:
+        messages.warning(request, "Data inválida no filtro; exibindo contagem atual.")
 
-        # última contagem por produto no período
-        ultima_por_produto = {}
-        for c in qs:
-            if c.produto_id not in ultima_por_produto:
-                ultima_por_produto[c.produto_id] = c
-
-        contagens_finais = list(ultima_por_produto.values())
-        dados_por_bar[bar.nome] = []
-
-        for c in contagens_finais:
-            pid = c.produto_id
-            doses = float(c.quantidade_doses_restantes or 0)
-            garrafas = c.quantidade_garrafas_cheias or 0
-
-            total_ml, doses_eq, _ = calcular_totais_ml_e_doses(c.produto, garrafas, doses)
-
-            # linha do bar para render no template
-            dados_por_bar[bar.nome].append({
-                'contagem': c,
-                'total_ml': float(total_ml),
-                'doses_equivalentes': float(doses_eq),
-            })
-
-            # somatório por produto no restaurante
-            somatorio_total[pid]['produto'] = c.produto
-            somatorio_total[pid]['garrafas'] += garrafas
-            somatorio_total[pid]['doses']    += doses
-            somatorio_total[pid]['total_ml'] += float(total_ml)
-            somatorio_total[pid]['doses_equivalentes'] += float(doses_eq)
+    dados = relatorios.obter('contagem_atual', restaurante_id=restaurante.id, **filtros)
 
     context = {
-        'dados_por_bar': dados_por_bar,
+        'dados_por_bar': dados.dados_por_bar,
         'restaurante': restaurante,
-        'somatorio_total': dict(somatorio_total),
+        'somatorio_total': dados.somatorio_total,
         'filtro_data': filtro_data_str,
-        'modo': 'calendario' if modo == 'calendario' else 'operacional',
-        'use_range': use_range,
-        'inicio_periodo': inicio,
-        'fim_periodo': fim,
+        'modo': filtros['modo'],
+        'use_range': filtros['dia'] is not None,
+        'inicio_periodo': dados.inicio,
+        'fim_periodo': dados.fim,
         'SHIFT_START_HOUR': SHIFT_START_HOUR,
     }
     return render(request, 'core/relatorios/contagem_atual.html', context)
@@ -2008,107 +1702,22 @@ DOSE_ML = Decimal('50')  # ml por dose
 
 @login_required
 def relatorio_eventos(request):
-    # filtros (mês atual por padrão)
-    data_inicio_param = request.GET.get('data_inicio')
-    data_fim_param = request.GET.get('data_fim')
-    nome_evento = (request.GET.get('nome_evento') or "").strip()
-    somente_nao_baixados = request.GET.get('pendentes') == '1'
-
-    # 🔹 filtro por restaurante
-    restaurante_param = (request.GET.get('restaurante') or '').strip()
-    try:
-        restaurante_filtro_id = int(restaurante_param) if restaurante_param else None
-    except ValueError:
-        restaurante_filtro_id = None
-
-    if data_inicio_param and data_fim_param:
-        try:
-            data_inicio = datetime.strptime(data_inicio_param, "%Y-%m-%d").date()
-            data_fim = datetime.strptime(data_fim_param, "%Y-%m-%d").date()
-        except (ValueError, TypeError):
-            data_inicio = date.today().replace(day=1)
-            data_fim = date.today()
-    else:
-        data_inicio = date.today().replace(day=1)
-        data_fim = date.today()
-
-    # 🔁 AGORA filtra e ordena pela DATA DO EVENTO
-    eventos_qs = (
-        Evento.objects
-        .filter(data_evento__range=(data_inicio, data_fim))
-        .prefetch_related('produtos__produto', 'alimentos__alimento')
-        .select_related('responsavel', 'supervisor_finalizou', 'baixado_por', 'restaurante')
-        .order_by('-data_evento', '-finalizado_em', '-data_criacao')
-    )
-    if nome_evento:
-        eventos_qs = eventos_qs.filter(nome__icontains=nome_evento)
-    if somente_nao_baixados:
-        eventos_qs = eventos_qs.filter(baixado_estoque=False, status='FINALIZADO')
-    if restaurante_filtro_id:
-        eventos_qs = eventos_qs.filter(restaurante_id=restaurante_filtro_id)
-
-    # ✅ consolidados
-    consolidado_bebidas = defaultdict(lambda: {'garrafas': 0, 'doses': Decimal('0'), 'ml': Decimal('0')})
-    consolidado_alimentos = defaultdict(lambda: {'quantidade': Decimal('0.00'), 'unidade': ''})
-
-    eventos = []
-    for ev in eventos_qs:
-        # --- bebidas
-        total_g, total_d, total_ml = 0, Decimal('0'), Decimal('0')
-        itens_bebidas = []
-        for item in ev.produtos.all():
-            g = int(item.garrafas or 0)
-            d = Decimal(item.doses or 0)
-            ml = d * DOSE_ML
-            itens_bebidas.append({'produto': item.produto.nome, 'garrafas': g, 'doses': d, 'ml': ml})
-            total_g += g; total_d += d; total_ml += ml
-
-            nome_prod = item.produto.nome
-            consolidado_bebidas[nome_prod]['garrafas'] += g
-            consolidado_bebidas[nome_prod]['doses'] += d
-            consolidado_bebidas[nome_prod]['ml'] += ml
-
-        # --- alimentos
-        itens_alimentos = []
-        total_qtd_alimentos = Decimal('0')
-        for ali in ev.alimentos.all():
-            nome = ali.alimento.nome
-            qtd = Decimal(ali.quantidade or 0)
-            uni = ali.alimento.unidade or ''
-            itens_alimentos.append({'alimento': nome, 'quantidade': qtd, 'unidade': uni})
-            total_qtd_alimentos += qtd
-
-            consolidado_alimentos[nome]['quantidade'] += qtd
-            consolidado_alimentos[nome]['unidade'] = uni
-
-        eventos.append({
-            'obj': ev,
-            'data': ev.data_evento,  # << usar a DATA DO EVENTO
-            'responsavel': getattr(ev, 'responsavel', ''),
-            'pessoas': ev.numero_pessoas,
-            'horas': ev.horas,
-            'restaurante_nome': ev.restaurante.nome if getattr(ev, 'restaurante', None) else None,
-            'itens_bebidas': itens_bebidas,
-            'totais_bebidas': {'garrafas': total_g, 'doses': total_d, 'ml': total_ml},
-            'itens_alimentos': itens_alimentos,
-            'total_qtd_alimentos': total_qtd_alimentos,
-        })
-
-    consolidado_bebidas = OrderedDict(sorted(consolidado_bebidas.items(), key=lambda kv: kv[0].lower()))
-    consolidado_alimentos = OrderedDict(sorted(consolidado_alimentos.items(), key=lambda kv: kv[0].lower()))
+    # filtros (mês atual por padrão) e dados: os mesmos da exportação
+    filtros = relatorios.ler_filtros('eventos', request)
+    dados = relatorios.obter('eventos', **filtros)
 
     restaurantes = Restaurante.objects.all().order_by('nome')
 
     return render(request, 'core/relatorios/relatorio_eventos.html', {
-        'eventos': eventos,
-        'consolidado_bebidas': consolidado_bebidas,
-        'consolidado_alimentos': consolidado_alimentos,
-        'data_inicio': data_inicio,
-        'data_fim': data_fim,
-        'nome_evento': nome_evento,
-        'somente_nao_baixados': '1' if somente_nao_baixados else '',
+        'eventos': dados.eventos,
+        'consolidado_bebidas': dados.consolidado_bebidas,
+        'consolidado_alimentos': dados.consolidado_alimentos,
+        'data_inicio': filtros['data_inicio'],
+        'data_fim': filtros['data_fim'],
+        'nome_evento': filtros['nome_evento'],
+        'somente_nao_baixados': '1' if filtros['somente_nao_baixados'] else '',
         'restaurantes': restaurantes,
-        'selected_restaurante': restaurante_filtro_id,
+        'selected_restaurante': filtros['restaurante'],
     })
 
 
@@ -2187,6 +1796,7 @@ def desmarcar_evento_baixado(request, evento_id):
 
 
 @login_required
+@condicional('diferenca_contagens')
 def relatorio_diferenca_contagens(request):
     bar_id = request.session.get('bar_id')
     if not bar_id:
@@ -2195,95 +1805,23 @@ def relatorio_diferenca_contagens(request):
     bar_atual = get_object_or_404(Bar, id=bar_id)
     restaurante = bar_atual.restaurante
 
-    # Todos os bares do restaurante (igual aos outros relatórios)
-    bares = Bar.objects.filter(restaurante=restaurante).order_by('nome')
-
-    # Estruturas de saída
-    dados_por_bar = {}  # { "Nome do Bar": [ {produto, ultimo, penultimo, diffs...}, ...] }
-    somatorio_total = defaultdict(lambda: {
-        'produto': None,
-        'diff_garrafas': Decimal('0'),
-        'diff_doses': Decimal('0'),
-    })
-
-    for bar in bares:
-        # Pega contagens do bar, mais novas primeiro
-        contagens = (
-            ContagemBar.objects
-            .filter(bar=bar)
-            .select_related('produto', 'usuario')
-            .order_by('-data_contagem')
-        )
-
-        # Para cada produto do bar, vamos guardar as DUAS mais recentes
-        # Estrutura: { produto_id: [ultima, penultima] }
-        duas_ultimas_por_produto = {}
-
-        for c in contagens:
-            pid = c.produto_id
-            if pid not in duas_ultimas_por_produto:
-                duas_ultimas_por_produto[pid] = [c]  # primeira (última)
-            elif len(duas_ultimas_por_produto[pid]) == 1:
-                duas_ultimas_por_produto[pid].append(c)  # segunda (penúltima)
-            # se já tem 2, ignora
-
-        linhas_bar = []
-
-        for pid, lista in duas_ultimas_por_produto.items():
-            ultimo = lista[0]
-            penultimo = lista[1] if len(lista) > 1 else None
-
-            # Converte doses para Decimal pra evitar bug de float
-            u_g = Decimal(ultimo.quantidade_garrafas_cheias or 0)
-            u_d = Decimal(ultimo.quantidade_doses_restantes or 0)
-
-            if penultimo:
-                p_g = Decimal(penultimo.quantidade_garrafas_cheias or 0)
-                p_d = Decimal(penultimo.quantidade_doses_restantes or 0)
-
-                diff_g = u_g - p_g
-                diff_d = u_d - p_d
-            else:
-                diff_g = None
-                diff_d = None
-
-            # Alimenta o somatório consolidado (só se tiver penúltima)
-            if diff_g is not None and diff_d is not None:
-                somatorio_total[pid]['produto'] = ultimo.produto
-                somatorio_total[pid]['diff_garrafas'] += diff_g
-                somatorio_total[pid]['diff_doses'] += diff_d
-
-            linhas_bar.append({
-                'produto': ultimo.produto,
-                'ultimo': ultimo,
-                'penultimo': penultimo,
-                'u_g': u_g, 'u_d': u_d,
-                'p_g': (p_g if penultimo else None),
-                'p_d': (p_d if penultimo else None),
-                'diff_g': diff_g,
-                'diff_d': diff_d,
-            })
-
-        # Ordena por nome do produto dentro do bar (fica mais amigável)
-        linhas_bar.sort(key=lambda x: x['produto'].nome.lower())
-
-        dados_por_bar[bar.nome] = linhas_bar
-
-    # Ordena somatório total por nome do produto
-    somatorio_total_dict = dict(sorted(
-        somatorio_total.items(),
-        key=lambda kv: kv[1]['produto'].nome.lower() if kv[1]['produto'] else ''
-    ))
+    # N contagens mais recentes por (bar, produto) de todos os bares do restaurante
+    filtros = relatorios.ler_filtros('diferenca_contagens', request)
+    profundidade = filtros['n']
+    dados = relatorios.obter('diferenca_contagens', restaurante_id=restaurante.id, **filtros)
 
     context = {
         'restaurante': restaurante,
-        'dados_por_bar': dados_por_bar,
-        'somatorio_total': somatorio_total_dict,
+        'dados_por_bar': dados.dados_por_bar,
+        'somatorio_total': dados.somatorio_total,
+        'profundidade': profundidade,
+        'opcoes_profundidade': [2, 3, 5, 10],
     }
     return render(request, 'core/relatorios/diferenca_contagens.html', context)
 
 
 @login_required
+@condicional('perdas', permissao='relatorios')
 def relatorio_perdas(request):
     """
     Relatório de perdas com filtros por bar, produto (nome/código), motivo, período
@@ -2302,99 +1840,37 @@ def relatorio_perdas(request):
     # Bares do restaurante para o filtro
     bares = Bar.objects.filter(restaurante_id=restaurante_id).order_by('nome')
 
-    # ------- filtros -------
-    bar_id    = (request.GET.get('bar') or '').strip()
-    produto_q = (request.GET.get('produto') or '').strip()   # nome ou código
-    motivo    = (request.GET.get('motivo') or '').strip()    # value de PerdaProduto.MOTIVOS ou vazio
-    somente_nao_baixados = (request.GET.get('pendentes') in ('1', 'true', 'on'))
-
-    # Período: default = mês atual
-    hoje = timezone.localdate()
-    data_inicio_str = request.GET.get('inicio')
-    data_fim_str    = request.GET.get('fim')
-
-    if data_inicio_str and data_fim_str:
-        try:
-            data_inicio = datetime.strptime(data_inicio_str, "%Y-%m-%d").date()
-            data_fim    = datetime.strptime(data_fim_str, "%Y-%m-%d").date()
-        except ValueError:
-            data_inicio = hoje.replace(day=1)
-            data_fim    = hoje
-    else:
-        data_inicio = hoje.replace(day=1)
-        data_fim    = hoje
-
-    # ------- base query -------
-    qs = (
-        PerdaProduto.objects
-        .filter(
-            restaurante_id=restaurante_id,
-            data_registro__date__range=(data_inicio, data_fim)
-        )
-        .select_related('bar', 'produto', 'usuario')
-    )
-
-    if bar_id:
-        qs = qs.filter(bar_id=bar_id)
-
-    if produto_q:
-        qs = qs.filter(
-            Q(produto__nome__icontains=produto_q) |
-            Q(produto__codigo__icontains=produto_q)
-        )
-
-    if motivo:
-        qs = qs.filter(motivo=motivo)
-
-    if somente_nao_baixados:
-        qs = qs.filter(baixado=False)
-
-    # ordenar mais recentes primeiro
-    qs = qs.order_by('-data_registro')
+    # ------- filtros + dados (os mesmos da exportação) -------
+    bar_id = (request.GET.get('bar') or '').strip()
+    filtros = relatorios.ler_filtros('perdas', request)
+    dados = relatorios.obter('perdas', restaurante_id=restaurante_id, **filtros)
+    antes = request.GET.get('antes') or None
+    itens, proximo = relatorios.perdas_pagina(restaurante_id, antes=antes, **filtros)
 
-    # ------- totais gerais -------
-    agreg = qs.aggregate(
-        total_garrafas=Sum('garrafas'),
-        total_doses=Sum('doses')
-    )
-    total_garrafas = agreg['total_garrafas'] or 0
-    total_doses    = agreg['total_doses'] or 0
-
-    # ------- consolidados -------
-    # por produto
-    por_produto = (
-        qs.values('produto__id', 'produto__nome', 'produto__codigo')
-          .annotate(garrafas=Sum('garrafas'), doses=Sum('doses'))
-          .order_by('produto__nome')
-    )
-
-    # por bar
-    por_bar = (
-        qs.values('bar__id', 'bar__nome')
-          .annotate(garrafas=Sum('garrafas'), doses=Sum('doses'))
-          .order_by('bar__nome')
-    )
-
-    # produtos para datalist (auto-complete no filtro)
-    produtos_lista = Produto.objects.filter(ativo=True).order_by('nome')
+    # mesma consulta, sem o cursor: links "mais recentes" / "anteriores"
+    params = request.GET.copy()
+    params.pop('antes', None)
 
     context = {
         'bares': bares,
-        'itens': qs,  # detalhe
-        'por_produto': por_produto,
-        'por_bar': por_bar,
-        'total_garrafas': total_garrafas,
-        'total_doses': total_doses,
+        'itens': itens,  # detalhe: uma página (keyset)
+        'proximo_cursor': proximo,
+        'pagina_inicial': antes is None,
+        'params_sem_cursor': params.urlencode(),
+        'registros': dados.registros,
+        'por_produto': dados.por_produto,
+        'por_bar': dados.por_bar,
+        'total_garrafas': dados.total_garrafas,
+        'total_doses': dados.total_doses,
 
         # filtros (eco no form)
         'bar_id': bar_id,
-        'produto_q': produto_q,
-        'motivo': motivo,
-        'data_inicio': data_inicio,
-        'data_fim': data_fim,
-        'somente_nao_baixados': somente_nao_baixados,
+        'produto_q': filtros['produto'],
+        'motivo': filtros['motivo'],
+        'data_inicio': filtros['data_inicio'],
+        'data_fim': filtros['data_fim'],
+        'somente_nao_baixados': filtros['somente_nao_baixados'],
 
-        'produtos_lista': produtos_lista,
         'MOTIVOS': getattr(PerdaProduto, 'MOTIVOS', ()),
     }
     return render(request, 'core/relatorios/perdas.html', context)
@@ -2433,6 +1909,7 @@ def interval_from_request(request):
     return d_ini, d_fim, t_ini, t_fim, ini_dt, fim_dt
 
 @login_required
+@condicional('consolidado_periodo', permissao='relatorios')
 def relatorio_consolidado_periodo(request):
     if not PermissaoPagina.objects.filter(user=request.user, nome_pagina='relatorios').exists():
         messages.error(request, "Você não tem permissão para acessar a página de relatórios.")
@@ -2444,103 +1921,69 @@ def relatorio_consolidado_periodo(request):
         return redirect('dashboard')
 
     restaurante = get_object_or_404(Restaurante, id=restaurante_id)
-    incluir_central = (request.GET.get('incluir_central', '1') == '1')
+    filtros = relatorios.ler_filtros('consolidado_periodo', request)
 
     d_ini, d_fim, t_ini, t_fim, ini_dt, fim_dt = interval_from_request(request)
+    dados = relatorios.obter('consolidado_periodo', restaurante_id=restaurante.id,
+                             ini_dt=ini_dt, fim_dt=fim_dt, **filtros)
 
-    # bares/produtos
-    bares_qs = Bar.objects.filter(restaurante=restaurante).order_by('nome')
-    if not incluir_central:
-        bares_qs = bares_qs.filter(is_estoque_central=False)
-    bares = list(bares_qs)
-    bar_ids = [b.id for b in bares]
-
-    produtos = list(Produto.objects.filter(ativo=True).order_by('nome'))
-    prod_ids = [p.id for p in produtos]
-
-    # --------- FUNÇÕES AUXILIARES (sem window) ----------
-    def latest_map_until(limit_dt):
-        """
-        Retorna dict {(bar_id, produto_id): (g, d)} com a ÚLTIMA contagem <= limit_dt,
-        em UMA query grande, ordenada por (bar, produto, -data).
-        """
-        qs = (ContagemBar.objects
-              .filter(bar_id__in=bar_ids, produto_id__in=prod_ids, data_contagem__lte=limit_dt)
-              .order_by('bar_id', 'produto_id', '-data_contagem')
-              .values('bar_id', 'produto_id', 'quantidade_garrafas_cheias', 'quantidade_doses_restantes'))
-        out = {}
-        for r in qs:
-            key = (r['bar_id'], r['produto_id'])
-            if key not in out:  # pega só a primeira (que é a mais recente por chave)
-                out[key] = (Decimal(r['quantidade_garrafas_cheias']), r['quantidade_doses_restantes'])
-        return out
-
-    ini_map = latest_map_until(ini_dt)
-    fim_map = latest_map_until(fim_dt)
-
-    # Entradas (sempre no bar central)
-    entradas = defaultdict(lambda: {'g': Decimal('0'), 'd': Decimal('0')})
-    bar_central = Bar.objects.filter(restaurante=restaurante, is_estoque_central=True).first()
-    if bar_central:
-        recs = (RecebimentoEstoque.objects
-                .filter(restaurante=restaurante, bar=bar_central,
-                        data_recebimento__gte=ini_dt, data_recebimento__lte=fim_dt)
-                .values('produto')
-                .annotate(qtd=Sum('quantidade')))
-        for r in recs:
-            entradas[r['produto']]['g'] += r['qtd'] or Decimal('0')
-
-    linhas = []
-    totais = defaultdict(lambda: {
-        'inicio_g': Decimal('0'), 'inicio_d': Decimal('0'),
-        'entradas_g': Decimal('0'), 'entradas_d': Decimal('0'),
-        'final_g': Decimal('0'), 'final_d': Decimal('0'),
-        'saida_g': Decimal('0'), 'saida_d': Decimal('0'),
+    return render(request, 'core/relatorios/consolidado_periodo.html', {
+        'restaurante': restaurante,
+        'linhas': dados.linhas,
+        'totais': dados.totais,
+        'inicio': d_ini, 'fim': d_fim,
+        'inicio_hora': t_ini.strftime("%H:%M"), 'fim_hora': t_fim.strftime("%H:%M"),
+        'incluir_central': '1' if filtros['incluir_central'] else '0',
     })
 
-    for p in produtos:
-        inicio_g = inicio_d = Decimal('0')
-        final_g  = final_d  = Decimal('0')
 
-        for b in bares:
-            if (b.id, p.id) in ini_map:
-                g, d = ini_map[(b.id, p.id)]
-                inicio_g += g; inicio_d += d
-            if (b.id, p.id) in fim_map:
-                g, d = fim_map[(b.id, p.id)]
-                final_g  += g; final_d  += d
 
-        ent_g = entradas[p.id]['g']; ent_d = entradas[p.id]['d']  # doses geralmente 0
-        saida_g = (inicio_g + ent_g) - final_g
-        saida_d = (inicio_d + ent_d) - final_d
 
-        linhas.append({
-            'produto': p,
-            'inicio_g': inicio_g, 'inicio_d': inicio_d,
-            'entradas_g': ent_g,  'entradas_d': ent_d,
-            'final_g': final_g,   'final_d': final_d,
-            'saida_g': saida_g,   'saida_d': saida_d,
-        })
+def _params_do_grupo(user, params):
+    """Cópia de `params` com `restaurantes` limitado aos que o usuário acessa
+       (todos eles, se nenhum foi pedido)."""
+    permitidos = list(Restaurante.do_usuario(user).values_list('id', flat=True))
+    pedidos = set(relatorios.filtros_consolidado_grupo(params)['restaurante_ids'])
+    params = params.copy()
+    params.setlist('restaurantes', [rid for rid in permitidos if rid in pedidos] if pedidos else permitidos)
+    return params
 
-        T = totais['geral']
-        T['inicio_g'] += inicio_g; T['inicio_d'] += inicio_d
-        T['entradas_g'] += ent_g;  T['entradas_d'] += ent_d
-        T['final_g'] += final_g;   T['final_d']   += final_d
-        T['saida_g'] += saida_g;   T['saida_d']   += saida_d
 
-    return render(request, 'core/relatorios/consolidado_periodo.html', {
-        'restaurante': restaurante,
-        'linhas': linhas,
-        'totais': totais['geral'],
+def _params_do_grupo_request(request):
+    return _params_do_grupo(request.user, request.GET)
+
+
+@login_required
+@condicional('consolidado_grupo', permissao='relatorios', params=_params_do_grupo_request)
+def relatorio_consolidado_grupo(request):
+    """Consolidado do período somando todos os restaurantes do usuário (ou os marcados)."""
+    if not PermissaoPagina.objects.filter(user=request.user, nome_pagina='relatorios').exists():
+        messages.error(request, "Você não tem permissão para acessar a página de relatórios.")
+        return redirect('dashboard')
+
+    params = _params_do_grupo(request.user, request.GET)
+    filtros = relatorios.filtros_consolidado_grupo(params)
+    d_ini, d_fim, t_ini, t_fim, ini_dt, fim_dt = relatorios.intervalo(params)
+    dados = relatorios.consolidado_grupo(ini_dt=ini_dt, fim_dt=fim_dt, **filtros)
+
+    return render(request, 'core/relatorios/consolidado_grupo.html', {
+        'restaurantes_disponiveis': Restaurante.do_usuario(request.user),
+        'selecionados': filtros['restaurante_ids'],
+        'restaurantes': dados.restaurantes,
+        'linhas': dados.linhas,
+        'totais': dados.totais,
+        'por_restaurante': [(r, dados.totais_por_restaurante[r.id], dados.duracoes[r.id])
+                            for r in dados.restaurantes],
+        'duracao_max': max(dados.duracoes.values(), default=0),
         'inicio': d_ini, 'fim': d_fim,
         'inicio_hora': t_ini.strftime("%H:%M"), 'fim_hora': t_fim.strftime("%H:%M"),
-        'incluir_central': '1' if incluir_central else '0',
+        'incluir_central': '1' if filtros['incluir_central'] else '0',
+        'parametros': params.urlencode(),
     })
 
 
-
-
 @login_required
+@condicional('consolidado_atual', permissao='relatorios')
 def consolidado_atual_view(request):
     if not PermissaoPagina.objects.filter(user=request.user, nome_pagina='relatorios').exists():
         messages.error(request, "Você não tem permissão para acessar a página de relatórios.")
@@ -2550,24 +1993,7 @@ def consolidado_atual_view(request):
     restaurante = get_object_or_404(Restaurante, id=restaurante_id)
 
     # Sempre inclui TODOS os bares, inclusive o central
-    qs = (
-        EstoqueBar.objects
-        .filter(bar__restaurante=restaurante)
-        .select_related('bar', 'produto')
-    )
-
-    # Soma por produto
-    agreg = defaultdict(lambda: {'g': Decimal('0'), 'd': Decimal('0')})
-    for eb in qs:
-        agreg[eb.produto_id]['g'] += Decimal(eb.quantidade_garrafas or 0)
-        agreg[eb.produto_id]['d'] += Decimal(eb.quantidade_doses or 0)
-
-    produtos = Produto.objects.filter(id__in=agreg.keys()).order_by('nome')
-    linhas = [{
-        'produto': p,
-        'g': agreg[p.id]['g'],
-        'd': agreg[p.id]['d'],
-    } for p in produtos]
+    linhas = relatorios.obter('consolidado_atual', restaurante_id=restaurante.id).linhas
 
     return render(
         request,
@@ -2576,11 +2002,9 @@ def consolidado_atual_view(request):
     )
 
 # Helper para sincronizar EstoqueBar após uma contagem
-def sincronizar_estoque_bar(bar, produto, garrafas, doses):
-    eb, _ = EstoqueBar.objects.get_or_create(bar=bar, produto=produto)
-    eb.quantidade_garrafas = Decimal(garrafas or 0)
-    eb.quantidade_doses = Decimal(doses or 0)
-    eb.save()
+def sincronizar_estoque_bar(bar, produto, garrafas, doses, usuario=None):
+    EstoqueBar.definir(bar, produto, garrafas=Decimal(garrafas or 0), doses=Decimal(doses or 0),
+                       tipo='CONTAGEM', usuario=usuario)
 
 
 
@@ -2592,61 +2016,28 @@ def sincronizar_estoque_bar(bar, produto, garrafas, doses):
 
 
 
-# ---- Helpers: parse de data/hora e janela arbitrária ----
+@login_required
+@condicional('consolidado_grupo', permissao='relatorios', guardar=True, params=_params_do_grupo_request)
+def exportar_consolidado_grupo_excel(request):
+    if not PermissaoPagina.objects.filter(user=request.user, nome_pagina='relatorios').exists():
+        messages.error(request, "Você não tem permissão para exportar relatórios.")
+        return redirect('dashboard')
 
-def _parse_date(s, default_date):
-    try:
-        return datetime.strptime(s, "%Y-%m-%d").date()
-    except Exception:
-        return default_date
+    planilha, nome_arquivo = exportacoes.gerar('consolidado_grupo', _params_do_grupo(request.user, request.GET))
+    return planilha.resposta(nome_arquivo)
 
-def _parse_time(s, default_time):
-    try:
-        return datetime.strptime(s, "%H:%M").time()
-    except Exception:
-        return default_time
 
-def _aware(dt):
-    return timezone.make_aware(dt) if timezone.is_naive(dt) else dt
+# ---- Helpers: janela arbitrária ----
 
 def interval_from_request(request):
     """
-    Lê inicio/fim (datas) e inicio_hora/fim_hora do GET.
-    Se fim <= início, assume que o fim é no dia seguinte (intervalo cruzando meia-noite).
+    Lê inicio/fim (datas) e inicio_hora/fim_hora do GET (ver relatorios.intervalo).
     Retorna (ini_date, fim_date, ini_time, fim_time, start_dt, end_dt).
     """
-    hoje = timezone.localdate()
-    inicio_str = request.GET.get('inicio') or str(hoje)
-    fim_str    = request.GET.get('fim')    or str(hoje)
-
-    # defaults: 00:00 → 23:59
-    inicio_hora_str = request.GET.get('inicio_hora') or "00:00"
-    fim_hora_str    = request.GET.get('fim_hora')    or "23:59"
-
-    ini_date = _parse_date(inicio_str, hoje)
-    fim_date = _parse_date(fim_str, hoje)
-    ini_time = _parse_time(inicio_hora_str, time(0, 0))
-    fim_time = _parse_time(fim_hora_str, time(23, 59))
-
-    start_dt = _aware(datetime.combine(ini_date, ini_time))
-    end_dt   = _aware(datetime.combine(fim_date, fim_time))
-
-    # se o fim for menor/igual ao início, assume que cruza a meia-noite
-    if end_dt <= start_dt:
-        end_dt += timedelta(days=1)
-
-    return ini_date, fim_date, ini_time, fim_time, start_dt, end_dt
-
-# Se já existir no seu módulo, use a versão existente.
-def ultima_contagem_ate(produto, bar, limite_dt):
-    return (
-        ContagemBar.objects
-        .filter(produto=produto, bar=bar, data_contagem__lte=limite_dt)
-        .order_by('-data_contagem')
-        .first()
-    )
+    return relatorios.intervalo(request.GET)
 
 @login_required
+@condicional('consolidado_periodo', permissao='relatorios', guardar=True)
 def exportar_consolidado_periodo_excel(request):
     # Permissão
     if not PermissaoPagina.objects.filter(user=request.user, nome_pagina='relatorios').exists():
@@ -2658,201 +2049,9 @@ def exportar_consolidado_periodo_excel(request):
         messages.error(request, "Restaurante não selecionado.")
         return redirect('dashboard')
 
-    restaurante = get_object_or_404(Restaurante, id=restaurante_id)
-    incluir_central = (request.GET.get('incluir_central', '1') == '1')
-
-    # Intervalo com horas (mesmo da página)
-    ini_date, fim_date, ini_time, fim_time, ini_dt, fim_dt = interval_from_request(request)
-
-    # Bares e produtos
-    bares_qs = Bar.objects.filter(restaurante=restaurante).order_by('nome')
-    if not incluir_central:
-        bares_qs = bares_qs.filter(is_estoque_central=False)
-    bares = list(bares_qs)
-    bar_ids = [b.id for b in bares]
-
-    produtos = list(Produto.objects.filter(ativo=True).order_by('nome'))
-    prod_ids = [p.id for p in produtos]
-
-    # --------- Auxiliar sem window function ----------
-    def latest_map_until(limit_dt):
-        """
-        Uma query só: pega contagens <= limit_dt, ordena por (bar, produto, -data),
-        e guarda a primeira por chave em memória.
-        """
-        qs = (
-            ContagemBar.objects
-            .filter(bar_id__in=bar_ids, produto_id__in=prod_ids, data_contagem__lte=limit_dt)
-            .order_by('bar_id', 'produto_id', '-data_contagem')
-            .values('bar_id', 'produto_id',
-                    'quantidade_garrafas_cheias', 'quantidade_doses_restantes')
-        )
-        out = {}
-        for r in qs:
-            key = (r['bar_id'], r['produto_id'])
-            if key not in out:
-                out[key] = (Decimal(r['quantidade_garrafas_cheias']),
-                            r['quantidade_doses_restantes'])
-        return out
-
-    ini_map = latest_map_until(ini_dt)
-    fim_map = latest_map_until(fim_dt)
-
-    # Entradas (sempre no central) em uma query
-    entradas_por_prod = defaultdict(lambda: {'g': Decimal('0'), 'd': Decimal('0')})
-    bar_central = Bar.objects.filter(restaurante=restaurante, is_estoque_central=True).first()
-    if bar_central:
-        recs = (
-            RecebimentoEstoque.objects
-            .filter(restaurante=restaurante, bar=bar_central,
-                    data_recebimento__gte=ini_dt, data_recebimento__lte=fim_dt)
-            .values('produto')
-            .annotate(qtd=Sum('quantidade'))
-        )
-        for r in recs:
-            entradas_por_prod[r['produto']]['g'] += r['qtd'] or Decimal('0')
-
-    # Montagem das linhas + totais
-    linhas = []
-    totais = defaultdict(lambda: {
-        'inicio_g': Decimal('0'), 'inicio_d': Decimal('0'),
-        'entradas_g': Decimal('0'), 'entradas_d': Decimal('0'),
-        'final_g': Decimal('0'), 'final_d': Decimal('0'),
-        'saida_g': Decimal('0'), 'saida_d': Decimal('0'),
-    })
-
-    for p in produtos:
-        inicio_g = inicio_d = Decimal('0')
-        final_g  = final_d  = Decimal('0')
-
-        for b in bares:
-            k = (b.id, p.id)
-            if k in ini_map:
-                g, d = ini_map[k]
-                inicio_g += g; inicio_d += d
-            if k in fim_map:
-                g, d = fim_map[k]
-                final_g  += g; final_d  += d
-
-        ent_g = entradas_por_prod[p.id]['g']
-        ent_d = entradas_por_prod[p.id]['d']  # normalmente 0
-
-        saida_g = (inicio_g + ent_g) - final_g
-        saida_d = (inicio_d + ent_d) - final_d
-
-        linhas.append({
-            'produto': p.nome,
-            'inicio_g': inicio_g, 'inicio_d': inicio_d,
-            'entradas_g': ent_g,  'entradas_d': ent_d,
-            'final_g': final_g,   'final_d': final_d,
-            'saida_g': saida_g,   'saida_d': saida_d,
-        })
-
-        T = totais['geral']
-        T['inicio_g']   += inicio_g; T['inicio_d']   += inicio_d
-        T['entradas_g'] += ent_g;    T['entradas_d'] += ent_d
-        T['final_g']    += final_g;  T['final_d']    += final_d
-        T['saida_g']    += saida_g;  T['saida_d']    += saida_d
-
-    # ====== Excel ======
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Consolidado"
-
-    head_fill = PatternFill("solid", fgColor="F3F4F6")
-    thin = Side(style="thin", color="DDDDDD")
-    border = Border(left=thin, right=thin, top=thin, bottom=thin)
-    center = Alignment(horizontal="center", vertical="center")
-    right  = Alignment(horizontal="right",  vertical="center")
-
-    # Título
-    ws.merge_cells(start_row=1, start_column=1, end_row=1, end_column=9)
-    ws.cell(row=1, column=1).value = f"Consolidado do Período — {restaurante.nome}"
-    ws.cell(row=1, column=1).font = Font(size=14, bold=True)
-
-    ws.merge_cells(start_row=2, start_column=1, end_row=2, end_column=9)
-    ws.cell(row=2, column=1).value = (
-        f"Intervalo: {ini_date.strftime('%d/%m/%Y')} {ini_time.strftime('%H:%M')} "
-        f"→ {fim_date.strftime('%d/%m/%Y')} {fim_time.strftime('%H:%M')} "
-        f"| Incluir central: {'Sim' if incluir_central else 'Não'}"
-    )
-    ws.cell(row=2, column=1).font = Font(size=11)
-
-    # Cabeçalhos
-    ws.append(["Produto", "Início", "", "Entradas", "", "Final", "", "Saída", ""])
-    ws.append(["",        "G", "D",   "G", "D",       "G", "D",   "G",   "D"])
-
-    ws.merge_cells(start_row=3, start_column=1, end_row=4, end_column=1)  # Produto
-    ws.merge_cells(start_row=3, start_column=2, end_row=3, end_column=3)  # Início
-    ws.merge_cells(start_row=3, start_column=4, end_row=3, end_column=5)  # Entradas
-    ws.merge_cells(start_row=3, start_column=6, end_row=3, end_column=7)  # Final
-    ws.merge_cells(start_row=3, start_column=8, end_row=3, end_column=9)  # Saída
-
-    for r in (3, 4):
-        for c in range(1, 10):
-            cell = ws.cell(row=r, column=c)
-            cell.fill = head_fill
-            cell.font = Font(bold=True)
-            cell.alignment = center
-            cell.border = border
-
-    # Dados
-    row = 5
-    for l in linhas:
-        ws.cell(row=row, column=1, value=l['produto']).alignment = Alignment(vertical="center")
-        ws.cell(row=row, column=2, value=float(l['inicio_g'])).alignment  = right
-        ws.cell(row=row, column=3, value=float(l['inicio_d'])).alignment  = right
-        ws.cell(row=row, column=4, value=float(l['entradas_g'])).alignment= right
-        ws.cell(row=row, column=5, value=float(l['entradas_d'])).alignment= right
-        ws.cell(row=row, column=6, value=float(l['final_g'])).alignment   = right
-        ws.cell(row=row, column=7, value=float(l['final_d'])).alignment   = right
-        ws.cell(row=row, column=8, value=float(l['saida_g'])).alignment   = right
-        ws.cell(row=row, column=9, value=float(l['saida_d'])).alignment   = right
-        for c in range(1, 10):
-            ws.cell(row=row, column=c).border = border
-        row += 1
-
-    # Totais
-    if linhas:
-        ws.cell(row=row, column=1, value="Total").font = Font(bold=True)
-        ws.cell(row=row, column=2, value=float(totais['geral']['inicio_g'])).font  = Font(bold=True)
-        ws.cell(row=row, column=3, value=float(totais['geral']['inicio_d'])).font  = Font(bold=True)
-        ws.cell(row=row, column=4, value=float(totais['geral']['entradas_g'])).font= Font(bold=True)
-        ws.cell(row=row, column=5, value=float(totais['geral']['entradas_d'])).font= Font(bold=True)
-        ws.cell(row=row, column=6, value=float(totais['geral']['final_g'])).font   = Font(bold=True)
-        ws.cell(row=row, column=7, value=float(totais['geral']['final_d'])).font   = Font(bold=True)
-        ws.cell(row=row, column=8, value=float(totais['geral']['saida_g'])).font   = Font(bold=True)
-        ws.cell(row=row, column=9, value=float(totais['geral']['saida_d'])).font   = Font(bold=True)
-        for c in range(1, 10):
-            ws.cell(row=row, column=c).border = border
-
-    # Formatação numérica
-    int_cols = [2, 4, 6, 8]   # garrafas
-    dec_cols = [3, 5, 7, 9]   # doses
-    for r in range(5, row + 1):
-        for c in int_cols: ws.cell(row=r, column=c).number_format = '0'
-        for c in dec_cols: ws.cell(row=r, column=c).number_format = '#,##0.00'
-
-    # Auto-largura
-    for col in range(1, 10):
-        max_len = 0
-        for r in range(1, row + 1):
-            val = ws.cell(row=r, column=col).value
-            s = str(val) if val is not None else ""
-            max_len = max(max_len, len(s))
-        ws.column_dimensions[get_column_letter(col)].width = max(10, min(45, max_len + 2))
-
-    # Resposta
-    filename = (
-        f"consolidado_{ini_date.strftime('%Y%m%d')}_{ini_time.strftime('%H%M')}"
-        f"__{fim_date.strftime('%Y%m%d')}_{fim_time.strftime('%H%M')}.xlsx"
-    )
-    resp = HttpResponse(
-        content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    )
-    resp['Content-Disposition'] = f'attachment; filename="{filename}"'
-    wb.save(resp)
-    return resp
+    get_object_or_404(Restaurante, id=restaurante_id)
+    planilha, nome_arquivo = exportacoes.gerar('consolidado_periodo', request.GET, restaurante_id=restaurante_id)
+    return planilha.resposta(nome_arquivo)
 
 
 
@@ -2861,6 +2060,7 @@ def exportar_consolidado_periodo_excel(request):
 
 
 @login_required
+@condicional('consolidado_atual', permissao='relatorios', guardar=True)
 def exportar_consolidado_atual_excel(request):
     if not PermissaoPagina.objects.filter(user=request.user, nome_pagina='relatorios').exists():
         messages.error(request, "Você não tem permissão para exportar relatórios.")
@@ -2873,20 +2073,8 @@ def exportar_consolidado_atual_excel(request):
 
     restaurante = get_object_or_404(Restaurante, id=restaurante_id)
 
-    # Sempre inclui TODOS os bares, inclusive o central
-    qs = EstoqueBar.objects.filter(bar__restaurante=restaurante)
-
-    agreg = defaultdict(lambda: {'g': Decimal('0'), 'd': Decimal('0')})
-    for eb in qs:
-        agreg[eb.produto_id]['g'] += Decimal(eb.quantidade_garrafas or 0)
-        agreg[eb.produto_id]['d'] += Decimal(eb.quantidade_doses or 0)
-
-    prod_ids = list(agreg.keys())
-    nomes = {p.id: p.nome for p in Produto.objects.filter(id__in=prod_ids)}
-    linhas = sorted(
-        [{'produto': nomes.get(pid, f'ID {pid}'), 'g': agreg[pid]['g'], 'd': agreg[pid]['d']} for pid in prod_ids],
-        key=lambda x: x['produto'].lower()
-    )
+    # Sempre inclui TODOS os bares, inclusive o central (mesmos dados da tela)
+    linhas = relatorios.obter('consolidado_atual', restaurante_id=restaurante.id).linhas
 
     # ===== Excel =====
     wb = Workbook()
@@ -2922,7 +2110,7 @@ def exportar_consolidado_atual_excel(request):
     total_d = Decimal('0')
 
     for l in linhas:
-        ws.cell(row=row, column=1, value=l['produto'])
+        ws.cell(row=row, column=1, value=l['produto'].nome)
         ws.cell(row=row, column=2, value=float(l['g'])).alignment = right
         ws.cell(row=row, column=3, value=float(l['d'])).alignment = right
         total_g += l['g']; total_d += l['d']
@@ -2964,433 +2152,13 @@ def exportar_consolidado_atual_excel(request):
 
 DOSE_ML = Decimal("50")  # ml por dose
 
-def auto_fit(ws, min_w=10, max_w=45):
-    """Ajusta a largura das colunas pelo maior conteúdo renderizado."""
-    for col in ws.columns:
-        length = 0
-        idx = col[0].column
-        for cell in col:
-            s = '' if cell.value is None else str(cell.value)
-            length = max(length, len(s))
-        ws.column_dimensions[get_column_letter(idx)].width = max(min_w, min(max_w, length + 2))
-
-def style_header_row(ws, row_idx, fill_color="F1F5FF"):
-    """Aplica estilo de cabeçalho na linha indicada (ws[row_idx])."""
-    fill = PatternFill("solid", fgColor=fill_color)
-    border = Border(
-        left=Side(style="thin", color="DDDDDD"),
-        right=Side(style="thin", color="DDDDDD"),
-        top=Side(style="thin", color="DDDDDD"),
-        bottom=Side(style="thin", color="DDDDDD"),
-    )
-    for c in ws[row_idx]:
-        c.font = Font(bold=True)
-        c.alignment = Alignment(horizontal="center", vertical="center")
-        c.fill = fill
-        c.border = border
-    ws.row_dimensions[row_idx].height = 20
-
-def style_body_borders(ws, r1, r2, c1, c2):
-    """Borda fininha no corpo da tabela (inclusive totais)."""
-    border = Border(
-        left=Side(style="thin", color="EEEEEE"),
-        right=Side(style="thin", color="EEEEEE"),
-        top=Side(style="thin", color="EEEEEE"),
-        bottom=Side(style="thin", color="EEEEEE"),
-    )
-    for r in range(r1, r2 + 1):
-        for c in range(c1, c2 + 1):
-            ws.cell(row=r, column=c).border = border
-
-
 # ===================== View =====================
 
 @login_required
 def exportar_relatorio_eventos_excel(request):
-    data_inicio_str = request.GET.get('data_inicio') or ""
-    data_fim_str    = request.GET.get('data_fim') or ""
-    nome_evento     = (request.GET.get('nome_evento') or "").strip()
-
-    # 🔹 filtro por restaurante
-    restaurante_param = (request.GET.get('restaurante') or '').strip()
-    try:
-        restaurante_filtro_id = int(restaurante_param) if restaurante_param else None
-    except ValueError:
-        restaurante_filtro_id = None
-
-    # Período padrão (mês atual)
-    if data_inicio_str and data_fim_str:
-        try:
-            data_inicio = datetime.strptime(data_inicio_str, "%Y-%m-%d").date()
-            data_fim    = datetime.strptime(data_fim_str, "%Y-%m-%d").date()
-        except (TypeError, ValueError):
-            data_inicio = date.today().replace(day=1)
-            data_fim    = date.today()
-    else:
-        data_inicio = date.today().replace(day=1)
-        data_fim    = date.today()
-
-    # ✅ USANDO DATA DO EVENTO
-    eventos_qs = (
-        Evento.objects
-        .filter(data_evento__range=(data_inicio, data_fim))
-        .prefetch_related('produtos__produto', 'alimentos__alimento')
-        .select_related('responsavel', 'restaurante')
-        .order_by('-data_evento', '-finalizado_em', '-data_criacao')
-    )
-    if nome_evento:
-        eventos_qs = eventos_qs.filter(nome__icontains=nome_evento)
-    if restaurante_filtro_id:
-        eventos_qs = eventos_qs.filter(restaurante_id=restaurante_filtro_id)
-
-    # Texto do filtro
-    filtro_txt = f"Período: {data_inicio.strftime('%d/%m/%Y')} a {data_fim.strftime('%d/%m/%Y')}"
-    if nome_evento:
-        filtro_txt += f" | Evento contém: {nome_evento}"
-    if restaurante_filtro_id:
-        try:
-            rnome = Restaurante.objects.only('nome').get(id=restaurante_filtro_id).nome
-            filtro_txt += f" | Restaurante: {rnome}"
-        except Restaurante.DoesNotExist:
-            filtro_txt += " | Restaurante: (inválido)"
-
-    # Consolidações
-    consolidado_bebidas   = defaultdict(lambda: {'garrafas': 0, 'doses': Decimal('0'), 'ml': Decimal('0')})
-    consolidado_alimentos = defaultdict(lambda: {'quantidade': Decimal('0.00'), 'unidade': ''})
-
-    # Linhas detalhadas (Data agora = data_evento)
-    detalhado = []  # Evento, Restaurante, Data, Pessoas, Horas, Tipo, Item, Garrafas, Doses, ML, Quantidade, Unidade
-
-    # Agrupado por evento (para as abas "Por Evento" e "Eventos (lista)")
-    eventos_group = []
-
-    for ev in eventos_qs:
-        total_g = 0
-        total_d = Decimal('0')
-        total_ml = Decimal('0')
-        total_qtd_alimentos_evento = Decimal('0')
-        itens_ev_bebidas = []
-        itens_ev_alimentos = []
-        rnome = ev.restaurante.nome if getattr(ev, 'restaurante', None) else None
-
-        # ---- Bebidas
-        for item in ev.produtos.all():
-            prod = item.produto.nome
-            gar  = int(item.garrafas or 0)
-            dos  = Decimal(item.doses or 0)
-            ml   = dos * DOSE_ML
-
-            consolidado_bebidas[prod]['garrafas'] += gar
-            consolidado_bebidas[prod]['doses']    += dos
-            consolidado_bebidas[prod]['ml']       += ml
-
-            detalhado.append({
-                'evento': ev.nome,
-                'restaurante': rnome,
-                'data': ev.data_evento,  # ✅ DATA DO EVENTO
-                'pessoas': ev.numero_pessoas,
-                'horas': ev.horas,
-                'tipo': 'Bebida',
-                'item': prod,
-                'garrafas': gar,
-                'doses': dos,
-                'ml': ml,
-                'quantidade': None,
-                'unidade': None,
-            })
-
-            itens_ev_bebidas.append({'produto': prod, 'garrafas': gar, 'doses': dos, 'ml': ml})
-            total_g += gar
-            total_d += dos
-            total_ml += ml
-
-        # ---- Alimentos
-        for ali in ev.alimentos.all():
-            nome = ali.alimento.nome
-            qtd  = Decimal(ali.quantidade or 0)
-            uni  = ali.alimento.unidade or ''
-
-            consolidado_alimentos[nome]['quantidade'] += qtd
-            consolidado_alimentos[nome]['unidade']     = uni
-
-            detalhado.append({
-                'evento': ev.nome,
-                'restaurante': rnome,
-                'data': ev.data_evento,  # ✅ DATA DO EVENTO
-                'pessoas': ev.numero_pessoas,
-                'horas': ev.horas,
-                'tipo': 'Alimento',
-                'item': nome,
-                'garrafas': None,
-                'doses': None,
-                'ml': None,
-                'quantidade': qtd,
-                'unidade': uni,
-            })
-
-            itens_ev_alimentos.append({'alimento': nome, 'quantidade': qtd, 'unidade': uni})
-            total_qtd_alimentos_evento += qtd
-
-        eventos_group.append({
-            'nome': ev.nome,
-            'data': ev.data_evento,  # ✅ DATA DO EVENTO
-            'responsavel': getattr(ev, 'responsavel', ''),
-            'pessoas': ev.numero_pessoas,
-            'horas': ev.horas,
-            'restaurante_nome': rnome,
-            'status': ev.status,
-            'baixado': ev.baixado_estoque,
-            'itens_bebidas': itens_ev_bebidas,
-            'totais_bebidas': {'garrafas': total_g, 'doses': total_d, 'ml': total_ml},
-            'itens_alimentos': itens_ev_alimentos,
-            'total_alimentos_qtd': total_qtd_alimentos_evento,
-        })
-
-    # === Workbook
-    wb = Workbook()
-
-    # ===================== Aba 1: Consolidado Bebidas =====================
-    ws1 = wb.active
-    ws1.title = "Consolidado Bebidas"
-
-    ws1.merge_cells(start_row=1, start_column=1, end_row=1, end_column=4)
-    ws1.cell(row=1, column=1, value="Relatório de Eventos — Consolidado de Bebidas").font = Font(bold=True, size=14)
-
-    ws1.merge_cells(start_row=2, start_column=1, end_row=2, end_column=4)
-    ws1.cell(row=2, column=1, value=filtro_txt).font = Font(italic=True, size=11)
-
-    ws1.append([])
-    ws1.append(["Produto", "Garrafas", "Doses", "Doses (ML)"])
-    style_header_row(ws1, 4)
-
-    r = 5
-    tot_g, tot_d, tot_ml = 0, Decimal('0'), Decimal('0')
-    for prod in sorted(consolidado_bebidas.keys(), key=lambda s: s.lower()):
-        d = consolidado_bebidas[prod]
-        ws1.cell(row=r, column=1, value=prod)
-        ws1.cell(row=r, column=2, value=int(d['garrafas'])).number_format = "0"
-        ws1.cell(row=r, column=3, value=float(d['doses'])).number_format = "0.00"
-        ws1.cell(row=r, column=4, value=float(d['ml'])).number_format = "0.00"
-        tot_g += int(d['garrafas']); tot_d += d['doses']; tot_ml += d['ml']
-        r += 1
-
-    ws1.cell(row=r, column=1, value="Total").font = Font(bold=True)
-    ws1.cell(row=r, column=2, value=tot_g).number_format = "0"
-    ws1.cell(row=r, column=3, value=float(tot_d)).number_format = "0.00"
-    ws1.cell(row=r, column=4, value=float(tot_ml)).number_format = "0.00"
-
-    ws1.freeze_panes = "A5"
-    style_body_borders(ws1, 5, r, 1, 4)
-    auto_fit(ws1)
-
-    # ===================== Aba 2: Consolidado Alimentos =====================
-    wsA = wb.create_sheet("Consolidado Alimentos")
-
-    wsA.merge_cells(start_row=1, start_column=1, end_row=1, end_column=3)
-    wsA.cell(row=1, column=1, value="Relatório de Eventos — Consolidado de Alimentos").font = Font(bold=True, size=14)
-
-    wsA.merge_cells(start_row=2, start_column=1, end_row=2, end_column=3)
-    wsA.cell(row=2, column=1, value=filtro_txt).font = Font(italic=True, size=11)
-
-    wsA.append([])
-    wsA.append(["Alimento", "Quantidade", "Unidade"])
-    style_header_row(wsA, 4)
-
-    rA = 5
-    for ali in sorted(consolidado_alimentos.keys(), key=lambda s: s.lower()):
-        d = consolidado_alimentos[ali]
-        wsA.cell(row=rA, column=1, value=ali)
-        wsA.cell(row=rA, column=2, value=float(d['quantidade'])).number_format = "0.00"
-        wsA.cell(row=rA, column=3, value=d['unidade'])
-        rA += 1
-
-    wsA.freeze_panes = "A5"
-    style_body_borders(wsA, 5, rA - 1, 1, 3)
-    auto_fit(wsA)
-
-    # ===================== Aba 3: Detalhado =====================
-    ws2 = wb.create_sheet("Detalhado")
-    ws2.merge_cells(start_row=1, start_column=1, end_row=1, end_column=12)
-    ws2.cell(row=1, column=1, value="Relatório de Eventos — Detalhado (Bebidas e Alimentos)").font = Font(bold=True, size=14)
-
-    ws2.merge_cells(start_row=2, start_column=1, end_row=2, end_column=12)
-    ws2.cell(row=2, column=1, value=filtro_txt).font = Font(italic=True, size=11)
-
-    ws2.append([])
-    ws2.append([
-        "Evento", "Restaurante", "Data", "Pessoas", "Horas", "Tipo", "Item",
-        "Garrafas", "Doses", "Doses (ML)", "Quantidade", "Unidade"
-    ])
-    style_header_row(ws2, 4)
-
-    r2 = 5
-    for linha in detalhado:
-        ws2.cell(row=r2, column=1, value=linha['evento'])
-        ws2.cell(row=r2, column=2, value=linha['restaurante'] or "-")
-        # ✅ data_evento (somente data)
-        ws2.cell(row=r2, column=3, value=linha['data'].strftime("%d/%m/%Y"))
-
-        if linha['pessoas'] is not None:
-            ws2.cell(row=r2, column=4, value=int(linha['pessoas'])).number_format = "0"
-        if linha['horas'] is not None:
-            try:
-                ws2.cell(row=r2, column=5, value=float(linha['horas'])).number_format = "0.00"
-            except Exception:
-                pass
-
-        ws2.cell(row=r2, column=6, value=linha['tipo'])
-        ws2.cell(row=r2, column=7, value=linha['item'])
-
-        if linha['garrafas'] is not None:
-            ws2.cell(row=r2, column=8, value=int(linha['garrafas'])).number_format = "0"
-        if linha['doses'] is not None:
-            ws2.cell(row=r2, column=9, value=float(linha['doses'])).number_format = "0.00"
-        if linha['ml'] is not None:
-            ws2.cell(row=r2, column=10, value=float(linha['ml'])).number_format = "0.00"
-
-        if linha['quantidade'] is not None:
-            ws2.cell(row=r2, column=11, value=float(linha['quantidade'])).number_format = "0.00"
-        if linha['unidade'] is not None:
-            ws2.cell(row=r2, column=12, value=linha['unidade'])
-
-        r2 += 1
-
-    ws2.freeze_panes = "A5"
-    style_body_borders(ws2, 5, r2 - 1, 1, 12)
-    auto_fit(ws2)
-
-    # ===================== Aba 4: Por Evento =====================
-    ws3 = wb.create_sheet("Por Evento")
-
-    col_count   = 8
-    current_row = 1
-
-    ws3.merge_cells(start_row=current_row, start_column=1, end_row=current_row, end_column=col_count)
-    ws3.cell(row=current_row, column=1, value="Relatório de Eventos — Por Evento").font = Font(bold=True, size=14)
-    current_row += 1
-    ws3.merge_cells(start_row=current_row, start_column=1, end_row=current_row, end_column=col_count)
-    ws3.cell(row=current_row, column=1, value=filtro_txt).font = Font(italic=True, size=11)
-    current_row += 2
-
-    for ev in eventos_group:
-        ws3.merge_cells(start_row=current_row, start_column=1, end_row=current_row, end_column=col_count)
-        # ✅ data_evento (somente data)
-        cab = f"Evento: {ev['nome']}  |  Data: {ev['data'].strftime('%d/%m/%Y')}"
-        if ev['responsavel']:
-            cab += f"  |  Resp.: {ev['responsavel']}"
-        if ev.get('pessoas') is not None:
-            cab += f"  |  Pessoas: {ev['pessoas']}"
-        if ev.get('horas') is not None:
-            try:
-                cab += f"  |  Horas: {float(ev['horas']):.2f}"
-            except Exception:
-                cab += "  |  Horas: -"
-        if ev.get('restaurante_nome'):
-            cab += f"  |  Restaurante: {ev['restaurante_nome']}"
-        ws3.cell(row=current_row, column=1, value=cab).font = Font(bold=True, size=12)
-        current_row += 1
-
-        ws3.append([]); current_row += 1
-        ws3.append(["🍹 Bebidas", "", "", "", "", "", "", ""]); style_header_row(ws3, current_row); current_row += 1
-        ws3.append(["Produto", "Garrafas", "Doses", "Doses (ML)", "", "", "", ""]); style_header_row(ws3, current_row)
-        first_data_beb = current_row + 1
-
-        for it in ev['itens_bebidas']:
-            current_row += 1
-            ws3.cell(row=current_row, column=1, value=it['produto'])
-            ws3.cell(row=current_row, column=2, value=int(it['garrafas'])).number_format = "0"
-            ws3.cell(row=current_row, column=3, value=float(it['doses'])).number_format = "0.00"
-            ws3.cell(row=current_row, column=4, value=float(it['ml'])).number_format = "0.00"
-
-        current_row += 1
-        ws3.cell(row=current_row, column=1, value="Subtotal (bebidas)").font = Font(bold=True)
-        ws3.cell(row=current_row, column=2, value=int(ev['totais_bebidas']['garrafas'])).number_format = "0"
-        ws3.cell(row=current_row, column=3, value=float(ev['totais_bebidas']['doses'])).number_format = "0.00"
-        ws3.cell(row=current_row, column=4, value=float(ev['totais_bebidas']['ml'])).number_format = "0.00"
-        style_body_borders(ws3, first_data_beb, current_row, 1, 4)
-
-        current_row += 2
-        ws3.append([]); style_header_row(ws3, current_row); current_row += 1
-        ws3.append(["Alimento", "Quantidade", "Unidade", "", "", "", "", ""]); style_header_row(ws3, current_row)
-        first_data_ali = current_row + 1
-
-        if ev['itens_alimentos']:
-            for it in ev['itens_alimentos']:
-                current_row += 1
-                ws3.cell(row=current_row, column=1, value=it['alimento'])
-                ws3.cell(row=current_row, column=2, value=float(it['quantidade'])).number_format = "0.00"
-                ws3.cell(row=current_row, column=3, value=it['unidade'])
-            style_body_borders(ws3, first_data_ali, current_row, 1, 3)
-        else:
-            current_row += 1
-            ws3.cell(row=current_row, column=1, value="Sem lançamentos de alimentos.").font = Font(italic=True)
-
-        current_row += 2
-
-    auto_fit(ws3)
-
-    # ===================== Aba 5: Eventos (lista) =====================
-    wsL = wb.create_sheet("Eventos (lista)")
-
-    wsL.merge_cells(start_row=1, start_column=1, end_row=1, end_column=12)
-    wsL.cell(row=1, column=1, value="Relatório de Eventos — Lista").font = Font(bold=True, size=14)
-
-    wsL.merge_cells(start_row=2, start_column=1, end_row=2, end_column=12)
-    wsL.cell(row=2, column=1, value=filtro_txt).font = Font(italic=True, size=11)
-
-    wsL.append([])
-    wsL.append([
-        "Evento", "Restaurante", "Data", "Status", "Baixado?",
-        "Responsável", "Pessoas", "Horas",
-        "Garrafas (tot)", "Doses (tot)", "ML (tot)", "Alimentos (qtd tot)"
-    ])
-    style_header_row(wsL, 4)
-
-    rL = 5
-    for ev in eventos_group:
-        wsL.cell(row=rL, column=1, value=ev['nome'])
-        wsL.cell(row=rL, column=2, value=ev['restaurante_nome'] or "-")
-        # ✅ data_evento (somente data)
-        wsL.cell(row=rL, column=3, value=ev['data'].strftime("%d/%m/%Y"))
-        wsL.cell(row=rL, column=4, value=ev['status'])
-        wsL.cell(row=rL, column=5, value="Sim" if ev['baixado'] else "Não")
-        wsL.cell(row=rL, column=6, value=str(ev['responsavel']) if ev['responsavel'] else "-")
-
-        if ev.get('pessoas') is not None:
-            wsL.cell(row=rL, column=7, value=int(ev['pessoas'])).number_format = "0"
-        if ev.get('horas') is not None:
-            try:
-                wsL.cell(row=rL, column=8, value=float(ev['horas'])).number_format = "0.00"
-            except Exception:
-                pass
-
-        wsL.cell(row=rL, column=9,  value=int(ev['totais_bebidas']['garrafas'])).number_format = "0"
-        wsL.cell(row=rL, column=10, value=float(ev['totais_bebidas']['doses'])).number_format = "0.00"
-        wsL.cell(row=rL, column=11, value=float(ev['totais_bebidas']['ml'])).number_format = "0.00"
-        wsL.cell(row=rL, column=12, value=float(ev['total_alimentos_qtd'])).number_format = "0.00"
-
-        rL += 1
-
-    wsL.append([])
-    wsL.cell(row=rL + 1, column=1, value="Total de eventos").font = Font(bold=True)
-    wsL.cell(row=rL + 1, column=2, value=len(eventos_group)).number_format = "0"
-
-    wsL.freeze_panes = "A5"
-    style_body_borders(wsL, 5, rL - 1, 1, 12)
-    auto_fit(wsL)
-
-    # === Output
-    output = BytesIO()
-    wb.save(output)
-    output.seek(0)
-
-    fname = f"relatorio_eventos_{slugify(data_inicio)}_a_{slugify(data_fim)}.xlsx"
-    resp = HttpResponse(
-        output.getvalue(),
-        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-    )
-    resp['Content-Disposition'] = f'attachment; filename="{fname}"'
-    return resp
+    # mesmos filtros da tela (DATA DO EVENTO); montagem em core/exportacoes.py
+    planilha, nome_arquivo = exportacoes.gerar('eventos', request.GET)
+    return planilha.resposta(nome_arquivo)
 
 
 
@@ -3453,7 +2221,7 @@ def exportar_consolidado_eventos_excel(request):
 
     # Apenas eventos FINALIZADOS hoje (espelha a página)
     eventos = (
-        Evento.objects.filter(status='FINALIZADO', finalizado_em__date=hoje)
+        Evento.objects.filter(status='FINALIZADO', **janelas.dia(hoje).filtro('finalizado_em'))
         .prefetch_related('produtos__produto', 'alimentos__alimento')
         .select_related('responsavel', 'supervisor_finalizou')
         .order_by('finalizado_em', 'nome')
@@ -3599,41 +2367,23 @@ def exportar_consolidado_eventos_excel(request):
 
 
 @login_required
+@condicional('saida_estoque', guardar=True)
 def exportar_saida_estoque_excel(request):
     bar_id = request.session.get('bar_id')
     if not bar_id:
         return render(request, 'erro.html', {'mensagem': 'Nenhum bar selecionado.'})
 
-    mes = request.GET.get('mes')
-    ano = request.GET.get('ano')
-    produto_nome = request.GET.get('produto', '').strip().lower()
-
-    requisicoes = RequisicaoProduto.objects.filter(
-        bar_id=bar_id,
-        status__in=['APROVADA', 'NEGADA', 'FALHA_ESTOQUE']
-    )
-
-    # Aplicar filtros
-    if mes and ano:
-        requisicoes = requisicoes.filter(data_solicitacao__month=int(mes), data_solicitacao__year=int(ano))
-    elif mes:
-        requisicoes = requisicoes.filter(data_solicitacao__month=int(mes))
-    elif ano:
-        requisicoes = requisicoes.filter(data_solicitacao__year=int(ano))
-
-    if produto_nome:
-        requisicoes = requisicoes.filter(produto__nome__icontains=produto_nome)
-
-    # Ordenar por data (mais recentes primeiro)
-    requisicoes = requisicoes.order_by('-data_solicitacao')
-
-    # Criar planilha
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Saída Estoque Bar"
+    # Mesmo conjunto de dados da tela (sem o corte das 50 últimas) se ela acabou de
+    # montá-lo; senão lê em streaming direto do banco (cursor no servidor)
+    filtros = relatorios.ler_filtros('saida_estoque', request)
+    dados = relatorios.em_cache('saida_estoque', bar_id=bar_id, **filtros)
+    requisicoes = (dados.requisicoes if dados is not None
+                   else relatorios.saida_estoque_queryset(bar_id, **filtros).iterator(chunk_size=2000))
 
-    headers = ['Produto', 'Quantidade', 'Status', 'Data', 'Solicitado por', 'Aprovado/Negado por']
-    ws.append(headers)
+    # Planilha escrita linha a linha (memória constante)
+    planilha = PlanilhaStream()
+    ws = planilha.aba("Saída Estoque Bar", largura_min=8, largura_max=60)
+    ws.escrever(['Produto', 'Quantidade', 'Status', 'Data', 'Solicitado por', 'Aprovado/Negado por'])
 
     total_quantidade = 0
 
@@ -3641,7 +2391,7 @@ def exportar_saida_estoque_excel(request):
         quantidade = float(req.quantidade_solicitada or 0)
         total_quantidade += quantidade
 
-        ws.append([
+        ws.escrever([
             req.produto.nome,
             f"{quantidade:.2f}",
             req.get_status_display(),
@@ -3650,73 +2400,29 @@ def exportar_saida_estoque_excel(request):
             req.usuario_aprovador.username if req.usuario_aprovador else '-',
         ])
 
-    # Linha extra de separação
-    ws.append([])
-
-    # Linha de total
-    ws.append(['TOTAL', f"{total_quantidade:.2f}", '', '', '', ''])
+    # Linha extra de separação e total
+    ws.pular()
+    ws.escrever(['TOTAL', f"{total_quantidade:.2f}", '', '', '', ''])
 
-    # Auto ajuste de colunas
-    for col in ws.columns:
-        max_length = 0
-        col_letter = get_column_letter(col[0].column)
-        for cell in col:
-            if cell.value:
-                max_length = max(max_length, len(str(cell.value)))
-        ws.column_dimensions[col_letter].width = max_length + 2
-
-    # Gerar resposta HTTP
-    response = HttpResponse(
-        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-    )
-    response['Content-Disposition'] = 'attachment; filename=relatorio_saida_estoque.xlsx'
-    wb.save(response)
-    return response
+    return planilha.resposta('relatorio_saida_estoque.xlsx')
 
 
 
 @login_required
+@condicional('consolidado_diferenca', guardar=True)
 def relatorio_consolidado_excel_view(request):
     bar_id = request.session.get('bar_id')
     if not bar_id:
         return HttpResponse("Nenhum bar selecionado.", status=400)
 
-    hoje = timezone.now()
+    hoje = timezone.localdate()
     mes = request.GET.get('mes', f"{hoje.month:02}")
     ano = request.GET.get('ano', str(hoje.year))
 
-    requisicoes = RequisicaoProduto.objects.filter(
-        bar_id=bar_id,
-        status='APROVADA',
-        data_solicitacao__month=int(mes),
-        data_solicitacao__year=int(ano)
-    )
-
-    dados_agrupados = defaultdict(lambda: defaultdict(dict))
-
-    for req in requisicoes:
-        data_str = req.data_solicitacao.date().strftime('%d/%m/%Y')
-        produto = req.produto
-
-        dados_agrupados[data_str][produto]['quantidade_requisitada'] = \
-            dados_agrupados[data_str][produto].get('quantidade_requisitada', 0) + float(req.quantidade_solicitada)
-        
-        contagem = ContagemBar.objects.filter(
-            bar_id=bar_id,
-            produto=produto,
-            data_contagem__date=req.data_solicitacao.date()
-        ).order_by('-data_contagem').first()
-
-        if contagem:
-            dados_agrupados[data_str][produto]['cheias'] = contagem.quantidade_garrafas_cheias
-            dados_agrupados[data_str][produto]['doses'] = float(contagem.quantidade_doses_restantes)
-        else:
-            dados_agrupados[data_str][produto]['cheias'] = 0
-            dados_agrupados[data_str][produto]['doses'] = 0.0
-
-        requisitado = dados_agrupados[data_str][produto]['quantidade_requisitada']
-        cheias = dados_agrupados[data_str][produto]['cheias']
-        dados_agrupados[data_str][produto]['diferenca'] = abs(cheias - requisitado)
+    # Mesmo conjunto de dados da tela
+    dados_agrupados = relatorios.obter(
+        'consolidado_diferenca', bar_id=bar_id, **relatorios.ler_filtros('consolidado_diferenca', request),
+    ).por_dia
 
     # Criar o Excel
     wb = openpyxl.Workbook()
@@ -3729,8 +2435,8 @@ def relatorio_consolidado_excel_view(request):
     for cell in ws["1:1"]:
         cell.font = bold_font
 
-    for data in sorted(dados_agrupados.keys(), reverse=True):
-        for produto, dados in dados_agrupados[data].items():
+    for data, produtos in dados_agrupados.items():
+        for produto, dados in produtos.items():
             ws.append([
                 data,
                 produto.nome,
@@ -3752,6 +2458,7 @@ def relatorio_consolidado_excel_view(request):
 SHIFT_START_HOUR = 19  # mantenha igual à view da tela
 
 @login_required
+@condicional('contagem_atual', guardar=True)
 def exportar_contagem_atual_excel(request):
     bar_id = request.session.get('bar_id')
     if not bar_id:
@@ -3760,64 +2467,15 @@ def exportar_contagem_atual_excel(request):
     bar_atual = get_object_or_404(Bar, id=bar_id)
     restaurante = bar_atual.restaurante
 
-    # --------- Filtros (iguais à view) ---------
-    filtro_data_str = (request.GET.get('data') or '').strip()   # YYYY-MM-DD
-    modo = (request.GET.get('modo') or 'operacional').lower()   # 'operacional' | 'calendario'
-
-    use_range = False
-    inicio = fim = None
-    tz = timezone.get_current_timezone()
-
-    if filtro_data_str:
-        try:
-            dia = datetime.strptime(filtro_data_str, '%Y-%m-%d').date()
-            if modo == 'calendario':
-                inicio = timezone.make_aware(datetime.combine(dia, time(0, 0, 0)), tz)
-                fim    = inicio + timedelta(days=1)
-            else:
-                start_naive = datetime.combine(dia, time(SHIFT_START_HOUR, 0, 0))
-                inicio = timezone.make_aware(start_naive, tz)
-                fim    = inicio + timedelta(days=1)
-            use_range = True
-        except ValueError:
-            pass
-
-    # --------- Montagem dos dados ---------
-    bares = Bar.objects.filter(restaurante=restaurante).only('id', 'nome').order_by('nome')
-
-    dados_por_bar = {}
-    somatorio_total = defaultdict(lambda: {
-        'produto': None,
-        'garrafas': 0,
-        'doses': 0.0,
-        'total_ml': 0.0,
-        'doses_equivalentes': 0.0,
-    })
-
-    for bar in bares:
-        qs = ContagemBar.objects.filter(bar=bar).order_by('-data_contagem', '-id')
-        if use_range:
-            qs = qs.filter(data_contagem__gte=inicio, data_contagem__lt=fim)
-
-        ultima_contagem_por_produto = {}
-        for contagem in qs:
-            if contagem.produto_id not in ultima_contagem_por_produto:
-                ultima_contagem_por_produto[contagem.produto_id] = contagem
+    # --------- Filtros e dados: os mesmos da tela ---------
+    filtros = relatorios.ler_filtros('contagem_atual', request)
+    dia, modo = filtros['dia'], filtros['modo']
+    use_range = dia is not None
 
-        contagens_finais = list(ultima_contagem_por_produto.values())
-        dados_por_bar[bar.nome] = contagens_finais
-
-        for c in contagens_finais:
-            doses = float(c.quantidade_doses_restantes or 0)
-            garrafas = c.quantidade_garrafas_cheias or 0
-            total_ml, doses_eq, _ = calcular_totais_ml_e_doses(c.produto, garrafas, doses)
-
-            pid = c.produto_id
-            somatorio_total[pid]['produto'] = c.produto
-            somatorio_total[pid]['garrafas'] += garrafas
-            somatorio_total[pid]['doses']    += doses
-            somatorio_total[pid]['total_ml'] += float(total_ml)
-            somatorio_total[pid]['doses_equivalentes'] += float(doses_eq)
+    dados = relatorios.obter('contagem_atual', restaurante_id=restaurante.id, **filtros)
+    dados_por_bar = dados.dados_por_bar
+    somatorio_total = dados.somatorio_total
+    inicio, fim = dados.inicio, dados.fim
 
     # --------- Excel ---------
     output = io.BytesIO()
@@ -3871,7 +2529,7 @@ def exportar_contagem_atual_excel(request):
     row += 2  # espaço
 
     # ===== Por bar =====
-    for bar_nome, contagens in dados_por_bar.items():
+    for bar_nome, linhas in dados_por_bar.items():
         ws.write(row, 0, f"Bar: {bar_nome}", f_bold); row += 1
 
         headers = ["Produto", "Garrafas", "Doses Avulsas", "Total (mL)", "Doses Equiv.", "Data da Contagem", "Usuário"]
@@ -3879,10 +2537,11 @@ def exportar_contagem_atual_excel(request):
             ws.write(row, col, h, f_head2)
         row += 1
 
-        for c in contagens:
+        for linha in linhas:
+            c = linha['contagem']
             doses = float(c.quantidade_doses_restantes or 0)
             garrafas = c.quantidade_garrafas_cheias or 0
-            total_ml, doses_eq, _ = calcular_totais_ml_e_doses(c.produto, garrafas, doses)
+            total_ml, doses_eq = linha['total_ml'], linha['doses_equivalentes']
 
             ws.write(row, 0, c.produto.nome, f_cell)
             ws.write(row, 1, garrafas, f_cell)
@@ -3968,6 +2627,7 @@ def _fmt_local(dt):
 
 
 @login_required
+@condicional('diferenca_contagens', guardar=True)
 def exportar_diferenca_contagens_excel(request):
     bar_id = request.session.get('bar_id')
     if not bar_id:
@@ -3975,76 +2635,12 @@ def exportar_diferenca_contagens_excel(request):
 
     bar_atual = get_object_or_404(Bar, id=bar_id)
     restaurante = bar_atual.restaurante
-    bares = Bar.objects.filter(restaurante=restaurante).order_by('nome')
-
-    # ===== Montagem dos dados (2 últimas por produto/bar) =====
-    dados_por_bar = {}
-    # Agora vamos acumular também penúltima e última para o CONSOLIDADO
-    somatorio_total = defaultdict(lambda: {
-        'produto': None,
-        'p_g': Decimal('0'), 'u_g': Decimal('0'),
-        'p_d': Decimal('0'), 'u_d': Decimal('0'),
-    })
-
-    for bar in bares:
-        contagens = (
-            ContagemBar.objects
-            .filter(bar=bar)
-            .select_related('produto', 'usuario')
-            .order_by('-data_contagem')
-        )
-
-        duas_ultimas_por_produto = {}
-        for c in contagens:
-            pid = c.produto_id
-            if pid not in duas_ultimas_por_produto:
-                duas_ultimas_por_produto[pid] = [c]            # última
-            elif len(duas_ultimas_por_produto[pid]) == 1:
-                duas_ultimas_por_produto[pid].append(c)        # penúltima
-
-        linhas_bar = []
-        for pid, lista in duas_ultimas_por_produto.items():
-            ultimo = lista[0]
-            penultimo = lista[1] if len(lista) > 1 else None
-
-            u_g = Decimal(ultimo.quantidade_garrafas_cheias or 0)
-            u_d = Decimal(ultimo.quantidade_doses_restantes or 0)
-
-            p_g = Decimal(penultimo.quantidade_garrafas_cheias or 0) if penultimo else None
-            p_d = Decimal(penultimo.quantidade_doses_restantes or 0) if penultimo else None
-
-            # Diferenças por linha (se houver penúltima)
-            diff_g = (u_g - p_g) if p_g is not None else None
-            diff_d = (u_d - p_d) if p_d is not None else None
-
-            # Consolidado: somamos penúltima/última (tratando None como 0)
-            st = somatorio_total[pid]
-            st['produto'] = ultimo.produto
-            st['u_g'] += u_g
-            st['u_d'] += u_d
-            st['p_g'] += (p_g if p_g is not None else Decimal('0'))
-            st['p_d'] += (p_d if p_d is not None else Decimal('0'))
-
-            linhas_bar.append({
-                'bar': bar.nome,
-                'produto': ultimo.produto,
-                'u_g': u_g, 'u_d': u_d,
-                'p_g': p_g, 'p_d': p_d,
-                'diff_g': diff_g, 'diff_d': diff_d,
-                'data_p': (penultimo.data_contagem if penultimo else None),
-                'user_p': (penultimo.usuario.username if (penultimo and penultimo.usuario) else None),
-                'data_u': ultimo.data_contagem,
-                'user_u': (ultimo.usuario.username if ultimo.usuario else None),
-            })
-
-        linhas_bar.sort(key=lambda x: x['produto'].nome.lower())
-        dados_por_bar[bar.nome] = linhas_bar
-
-    # Para o consolidado, a diferença é (Última - Penúltima) agregadas
-    somatorio_total = dict(sorted(
-        somatorio_total.items(),
-        key=lambda kv: kv[1]['produto'].nome.lower() if kv[1]['produto'] else ''
-    ))
+    # ===== Mesmos dados da tela (consolidado: penúltima/última somadas) =====
+    filtros = relatorios.ler_filtros('diferenca_contagens', request)
+    profundidade = filtros['n']
+    dados = relatorios.obter('diferenca_contagens', restaurante_id=restaurante.id, **filtros)
+    dados_por_bar = dados.dados_por_bar
+    somatorio_total = dados.somatorio_contagens
 
     # ===== Excel =====
     wb = Workbook()
@@ -4194,6 +2790,39 @@ def exportar_diferenca_contagens_excel(request):
         ws2.column_dimensions[get_column_letter(i)].width = w
     _auto_fit_columns(ws2)
 
+    # -------- Sheet 3: HISTÓRICO (só quando pedidas mais de 2 contagens) --------
+    if profundidade > 2:
+        ws3 = wb.create_sheet(title="Histórico")
+        ws3.merge_cells(start_row=1, start_column=1, end_row=1, end_column=8)
+        ws3.cell(row=1, column=1, value=f"Últimas {profundidade} contagens por produto — {restaurante.nome}") \
+            .font = Font(bold=True, size=14)
+        ws3.append([])
+        ws3.append([
+            "Bar", "Produto", "Data", "Usuário",
+            "Garrafas", "Doses", "Variação (Garrafas)", "Variação (Doses)",
+        ])
+        _apply_header_style(ws3[3])
+
+        r3 = first_data_row3 = 4
+        for bar_nome, linhas in dados_por_bar.items():
+            for L in linhas:
+                for c in L['historico']:
+                    ws3.cell(row=r3, column=1, value=bar_nome)
+                    ws3.cell(row=r3, column=2, value=L['produto'].nome)
+                    ws3.cell(row=r3, column=3, value=_fmt_local(c.data_contagem))
+                    ws3.cell(row=r3, column=4, value=c.usuario.username if c.usuario else None)
+                    ws3.cell(row=r3, column=5, value=c.quantidade_garrafas_cheias).number_format = "0"
+                    ws3.cell(row=r3, column=6, value=float(c.quantidade_doses_restantes or 0)).number_format = "0.00"
+                    ws3.cell(row=r3, column=7, value=c.diff_g).number_format = "0"
+                    ws3.cell(row=r3, column=8, value=float(c.diff_d) if c.diff_d is not None else None) \
+                        .number_format = "0.00"
+                    r3 += 1
+
+        if r3 > first_data_row3:
+            _apply_body_borders(ws3, first_data_row3, r3 - 1, 1, 8)
+            ws3.freeze_panes = "A4"
+        _auto_fit_columns(ws3)
+
     # ===== Resposta =====
     from django.utils.text import slugify
     filename = f"dif-contagens-{slugify(restaurante.nome)}-{now.strftime('%Y%m%d-%H%M')}.xlsx"
@@ -4207,261 +2836,147 @@ def exportar_diferenca_contagens_excel(request):
 
 
 
-# ===== helpers simples p/ Excel =====
-_THIN = Side(style="thin", color="DDDDDD")
-_BORDER_ALL = Border(left=_THIN, right=_THIN, top=_THIN, bottom=_THIN)
-_FILL_HEADER = PatternFill("solid", fgColor="F2F2F2")
-
-
-def _x_style_header(ws, row=1):
-    for c in range(1, ws.max_column + 1):
-        cell = ws.cell(row=row, column=c)
-        cell.font = Font(bold=True)
-        cell.alignment = Alignment(horizontal="center", vertical="center")
-        cell.fill = _FILL_HEADER
-        cell.border = _BORDER_ALL
-
-
-def _x_style_table(ws, start_row=2):
-    if ws.max_row < start_row:
-        return
-    for r in range(start_row, ws.max_row + 1):
-        for c in range(1, ws.max_column + 1):
-            ws.cell(row=r, column=c).border = _BORDER_ALL
-
+@login_required
+@condicional('perdas', permissao='relatorios', guardar=True)
+def exportar_relatorio_perdas_excel(request):
+    # 🔒 mesma permissão dos relatórios
+    if not PermissaoPagina.objects.filter(user=request.user, nome_pagina='relatorios').exists():
+        return HttpResponse("Sem permissão para exportar.", status=403)
 
-def _x_auto_fit(ws, extra=2, max_width=60):
-    widths = defaultdict(int)
-    for row in ws.iter_rows(values_only=True):
-        for idx, val in enumerate(row, start=1):
-            val_str = "" if val is None else str(val)
-            widths[idx] = max(widths[idx], len(val_str))
-    for idx, w in widths.items():
-        ws.column_dimensions[get_column_letter(idx)].width = min(w + extra, max_width)
+    restaurante_id = request.session.get('restaurante_id')
 
+    # mesmos filtros do relatório; montagem em core/exportacoes.py
+    planilha, nome_arquivo = exportacoes.gerar('perdas', request.GET, restaurante_id=restaurante_id)
+    return planilha.resposta(nome_arquivo)
 
-def _parse_date_or_none(s):
-    try:
-        return datetime.strptime(s, "%Y-%m-%d").date()
-    except Exception:
-        return None
 
+# ---- CSV / Parquet (mesmo conjunto de dados da tela, sem formatação: core/tabelas.py) ----
 
 @login_required
-def exportar_relatorio_perdas_excel(request):
-    # 🔒 mesma permissão dos relatórios
+def exportar_dados_relatorio(request, nome, formato):
     if not PermissaoPagina.objects.filter(user=request.user, nome_pagina='relatorios').exists():
         return HttpResponse("Sem permissão para exportar.", status=403)
+    if not tabelas.existe(nome) or formato not in ('csv', 'parquet'):
+        raise Http404("Relatório ou formato desconhecido.")
 
     restaurante_id = request.session.get('restaurante_id')
+    bar_id = request.session.get('bar_id')
+    escopo = tabelas.escopo(nome)
+    if (escopo not in ('global', 'grupo') and not restaurante_id) or (escopo == 'bar' and not bar_id):
+        request.session['next_after_select'] = request.get_full_path()
+        return redirect('selecionar-bar')
+    if formato == 'parquet' and not tabelas.parquet_disponivel():
+        return HttpResponse("Exportação Parquet indisponível: o pacote pyarrow não está instalado.", status=501)
+
+    params = _params_do_grupo(request.user, request.GET) if escopo == 'grupo' else request.GET
+    tabela = tabelas.montar(nome, params, restaurante_id=restaurante_id, bar_id=bar_id)
+    nome_arquivo = f"{nome}_{timezone.localdate():%Y%m%d}.{formato}"
+    if formato == 'csv':
+        return tabelas.resposta_csv(tabela, nome_arquivo)
+    return tabelas.resposta_parquet(tabela, nome_arquivo)
+
+
+# ---- Exportações em segundo plano (fila + worker: manage.py processar_exportacoes) ----
+
+def _tarefa_json(tarefa):
+    dados = {
+        'id': tarefa.id,
+        'status': tarefa.status,
+        'status_display': tarefa.get_status_display(),
+        'progresso': tarefa.progresso,
+        'url_status': reverse('status_exportacao', args=[tarefa.id]),
+    }
+    if tarefa.status == 'CONCLUIDA':
+        dados['url_arquivo'] = reverse('baixar_exportacao', args=[tarefa.id])
+    elif tarefa.status == 'ERRO':
+        dados['erro'] = "Não foi possível gerar o arquivo. Tente novamente."
+    return dados
 
-    # ===== filtros (iguais ao relatório) =====
-    bar_id = (request.GET.get('bar') or "").strip()
-    q = (request.GET.get('q') or "").strip()                  # nome/código do produto
-    motivo = (request.GET.get('motivo') or "").strip()        # código do motivo
-    di_param = request.GET.get('data_inicio')
-    df_param = request.GET.get('data_fim')
 
-    hoje = timezone.localdate()
-    data_inicio = _parse_date_or_none(di_param) or hoje.replace(day=1)
-    data_fim = _parse_date_or_none(df_param) or hoje
+def _tarefa_do_usuario(request, tarefa_id):
+    """Tarefa visível para o usuário: precisa da permissão de relatórios e, se a
+       exportação for de um restaurante ou bar, estar com ele selecionado e ter acesso
+       ao restaurante (no grupo, a todos os restaurantes dela)."""
+    if not PermissaoPagina.objects.filter(user=request.user, nome_pagina='relatorios').exists():
+        return None
+    tarefa = get_object_or_404(TarefaExportacao, id=tarefa_id)
+    if tarefa.restaurante_id and tarefa.restaurante_id != request.session.get('restaurante_id'):
+        return None
+    if tarefa.bar_id and (
+            tarefa.bar_id != request.session.get('bar_id')
+            or not Bar.objects.filter(id=tarefa.bar_id,
+                                      restaurante__in=Restaurante.do_usuario(request.user)).exists()):
+        return None
+    if exportacoes.existe(tarefa.tipo) and exportacoes.por_grupo(tarefa.tipo):
+        pedidos = relatorios.filtros_consolidado_grupo(QueryDict(tarefa.parametros))['restaurante_ids']
+        if Restaurante.do_usuario(request.user).filter(id__in=pedidos).count() != len(pedidos):
+            return None
+    return tarefa
 
-    qs = (PerdaProduto.objects
-          .select_related("bar", "produto", "usuario", "restaurante")
-          .filter(data_registro__date__range=(data_inicio, data_fim))
-          .order_by("data_registro"))
 
-    if restaurante_id:
-        qs = qs.filter(restaurante_id=restaurante_id)
-    if bar_id:
-        qs = qs.filter(bar_id=bar_id)
-    if q:
-        qs = qs.filter(Q(produto__nome__icontains=q) | Q(produto__codigo__icontains=q))
-    if motivo:
-        qs = qs.filter(motivo=motivo)
-
-    # ===== agregações =====
-    por_produto = defaultdict(lambda: {"garrafas": 0, "doses": 0})
-    por_bar = defaultdict(lambda: {"garrafas": 0, "doses": 0})
-    por_motivo = defaultdict(lambda: {"registros": 0, "garrafas": 0, "doses": 0})
-
-    total_registros = 0
-    total_garrafas = 0
-    total_doses = 0
-
-    for p in qs:
-        total_registros += 1
-        g = int(p.garrafas or 0)
-        d = int(p.doses or 0)
-        total_garrafas += g
-        total_doses += d
-
-        # produto
-        nome_prod = f"[{getattr(p.produto, 'codigo', '')}] {p.produto.nome}" if getattr(p.produto, 'codigo', None) else p.produto.nome
-        por_produto[nome_prod]["garrafas"] += g
-        por_produto[nome_prod]["doses"] += d
-
-        # bar
-        por_bar[p.bar.nome]["garrafas"] += g
-        por_bar[p.bar.nome]["doses"] += d
-
-        # motivo
-        por_motivo[p.motivo]["registros"] += 1
-        por_motivo[p.motivo]["garrafas"] += g
-        por_motivo[p.motivo]["doses"] += d
-
-    # map de rótulo do motivo
-    motivos_map = dict(PerdaProduto.MOTIVOS)
-
-    # ===== monta workbook =====
-    wb = Workbook()
+@login_required
+@require_POST
+def solicitar_exportacao(request):
+    if not PermissaoPagina.objects.filter(user=request.user, nome_pagina='relatorios').exists():
+        return JsonResponse({'erro': "Sem permissão para exportar."}, status=403)
+
+    tipo = request.POST.get('tipo', '')
+    if not exportacoes.existe(tipo):
+        return JsonResponse({'erro': "Exportação desconhecida."}, status=400)
+
+    restaurante_id, bar_id = exportacoes.escopo(
+        tipo, request.session.get('restaurante_id'), request.session.get('bar_id'))
+    if exportacoes.exige_restaurante(tipo) and not restaurante_id:
+        return JsonResponse({'erro': "Restaurante não selecionado."}, status=400)
+
+    # os mesmos parâmetros GET do link de exportação direta
+    params = QueryDict(request.POST.get('parametros', ''))
+    if exportacoes.por_grupo(tipo):
+        params = _params_do_grupo(request.user, params)
+    tarefa, _ = TarefaExportacao.solicitar(
+        tipo=tipo,
+        chave=exportacoes.chave(tipo, params, restaurante_id=restaurante_id, bar_id=bar_id),
+        parametros=params.urlencode(),
+        usuario=request.user,
+        restaurante_id=restaurante_id,
+        bar_id=bar_id,
+    )
+    return JsonResponse(_tarefa_json(tarefa), status=202)
 
-    # --- Resumo ---
-    ws = wb.active
-    ws.title = "Resumo"
 
-    titulo = f"Relatório de Perdas — {data_inicio.strftime('%d/%m/%Y')} a {data_fim.strftime('%d/%m/%Y')}"
-    ws.merge_cells("A1:D1")
-    ws["A1"] = titulo
-    ws["A1"].font = Font(size=14, bold=True)
-    ws["A1"].alignment = Alignment(horizontal="center")
+@login_required
+def status_exportacao(request, tarefa_id):
+    tarefa = _tarefa_do_usuario(request, tarefa_id)
+    if tarefa is None:
+        return JsonResponse({'erro': "Sem permissão."}, status=403)
+    return JsonResponse(_tarefa_json(tarefa))
 
-    # filtros ativos
-    filtros = []
-    if restaurante_id:
-        filtros.append(f"Restaurante ID: {restaurante_id}")
-    if bar_id:
-        filtros.append(f"Bar ID: {bar_id}")
-    if q:
-        filtros.append(f"Produto: {q}")
-    if motivo:
-        filtros.append(f"Motivo: {motivos_map.get(motivo, motivo)}")
 
-    ws.append([])
-    ws.append(["Filtros aplicados", (", ".join(filtros) or "Nenhum")])
-    ws.append(["Total de registros", total_registros])
-    ws.append(["Total de garrafas", total_garrafas])
-    ws.append(["Total de doses", total_doses])
-
-    # negrito nas métricas
-    for r in range(3, ws.max_row + 1):
-        ws.cell(row=r, column=1).font = Font(bold=True)
-        ws.cell(row=r, column=2).alignment = Alignment(horizontal="right")
-
-    _x_auto_fit(ws)
-
-    # por motivo
-    ws_m = wb.create_sheet("Por Motivo")
-    ws_m.append(["Motivo", "Registros", "Garrafas", "Doses"])
-    _x_style_header(ws_m, 1)
-
-    for cod, d in sorted(por_motivo.items(), key=lambda kv: motivos_map.get(kv[0], kv[0])):
-        ws_m.append([motivos_map.get(cod, cod), d["registros"], d["garrafas"], d["doses"]])
-
-    # total linha final
-    if ws_m.max_row > 1:
-        ws_m.append(["TOTAL",
-                     sum(d["registros"] for d in por_motivo.values()),
-                     sum(d["garrafas"] for d in por_motivo.values()),
-                     sum(d["doses"] for d in por_motivo.values())])
-        for c in range(1, ws_m.max_column + 1):
-            cell = ws_m.cell(row=ws_m.max_row, column=c)
-            cell.font = Font(bold=True)
-            cell.fill = PatternFill("solid", fgColor="EFEFEF")
-
-    _x_style_table(ws_m, start_row=2)
-    for col in ("B", "C", "D"):
-        for cell in ws_m[col][1:]:
-            cell.alignment = Alignment(horizontal="right")
-            cell.number_format = "0"
-    _x_auto_fit(ws_m)
-
-    # --- Por Produto ---
-    ws_p = wb.create_sheet("Por Produto")
-    ws_p.append(["Produto", "Garrafas", "Doses"])
-    _x_style_header(ws_p, 1)
-
-    for nome, d in sorted(por_produto.items(), key=lambda kv: kv[0].lower()):
-        ws_p.append([nome, d["garrafas"], d["doses"]])
-
-    if ws_p.max_row > 1:
-        ws_p.append(["TOTAL",
-                     sum(v["garrafas"] for v in por_produto.values()),
-                     sum(v["doses"] for v in por_produto.values())])
-        last = ws_p.max_row
-        for c in range(1, ws_p.max_column + 1):
-            cell = ws_p.cell(row=last, column=c)
-            cell.font = Font(bold=True)
-            cell.fill = PatternFill("solid", fgColor="EFEFEF")
-
-    _x_style_table(ws_p, start_row=2)
-    for col in ("B", "C"):
-        for cell in ws_p[col][1:]:
-            cell.alignment = Alignment(horizontal="right")
-            cell.number_format = "0"
-    _x_auto_fit(ws_p)
-
-    # --- Por Bar ---
-    ws_b = wb.create_sheet("Por Bar")
-    ws_b.append(["Bar", "Garrafas", "Doses"])
-    _x_style_header(ws_b, 1)
-
-    for nome_bar, d in sorted(por_bar.items(), key=lambda kv: kv[0].lower()):
-        ws_b.append([nome_bar, d["garrafas"], d["doses"]])
-
-    if ws_b.max_row > 1:
-        ws_b.append(["TOTAL",
-                     sum(v["garrafas"] for v in por_bar.values()),
-                     sum(v["doses"] for v in por_bar.values())])
-        last = ws_b.max_row
-        for c in range(1, ws_b.max_column + 1):
-            cell = ws_b.cell(row=last, column=c)
-            cell.font = Font(bold=True)
-            cell.fill = PatternFill("solid", fgColor="EFEFEF")
-
-    _x_style_table(ws_b, start_row=2)
-    for col in ("B", "C"):
-        for cell in ws_b[col][1:]:
-            cell.alignment = Alignment(horizontal="right")
-            cell.number_format = "0"
-    _x_auto_fit(ws_b)
-
-    # --- Detalhe ---
-    ws_d = wb.create_sheet("Detalhe")
-    ws_d.append(["Data", "Hora", "Restaurante", "Bar", "Produto", "Garrafas", "Doses", "Motivo", "Usuário", "Observação"])
-    _x_style_header(ws_d, 1)
-
-    for p in qs:
-        data_local = timezone.localtime(p.data_registro)
-        prod_label = f"[{getattr(p.produto, 'codigo', '')}] {p.produto.nome}" if getattr(p.produto, 'codigo', None) else p.produto.nome
-        ws_d.append([
-            data_local.date().strftime("%d/%m/%Y"),
-            data_local.time().strftime("%H:%M"),
-            getattr(p.restaurante, "nome", ""),
-            p.bar.nome,
-            prod_label,
-            int(p.garrafas or 0),
-            int(p.doses or 0),
-            motivos_map.get(p.motivo, p.motivo),
-            getattr(p.usuario, "username", ""),
-            p.observacao or "",
-        ])
+@login_required
+def baixar_exportacao(request, tarefa_id):
+    tarefa = _tarefa_do_usuario(request, tarefa_id)
+    if tarefa is None:
+        return HttpResponse("Sem permissão para exportar.", status=403)
+    if tarefa.status != 'CONCLUIDA' or not tarefa.arquivo:
+        raise Http404("Arquivo não disponível.")
+    return FileResponse(tarefa.arquivo.open('rb'), as_attachment=True, filename=tarefa.nome_arquivo,
+                        content_type=CONTENT_TYPE_XLSX)
 
-    _x_style_table(ws_d, start_row=2)
-    for col in ("F", "G"):
-        for cell in ws_d[col][1:]:
-            cell.alignment = Alignment(horizontal="right")
-            cell.number_format = "0"
-    _x_auto_fit(ws_d)
 
-    # ===== resposta =====
-    response = HttpResponse(
-        content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    )
-    nome_arquivo = f"relatorio_perdas_{data_inicio:%Y-%m-%d}_a_{data_fim:%Y-%m-%d}.xlsx"
-    response["Content-Disposition"] = f'attachment; filename="{nome_arquivo}"'
-    wb.save(response)
-    return response
+# ---- Catálogo para o autocomplete dos formulários (core/catalogo.py) ----
+
+@login_required
+def catalogo_json(request, tipo):
+    if not catalogo.existe(tipo):
+        raise Http404("Catálogo desconhecido.")
+    dados = catalogo.obter(tipo)
+    # o navegador guarda e revalida a cada uso: se nada mudou, 304 sem corpo
+    resp = get_conditional_response(request, etag=dados.etag)
+    if resp is None:
+        resp = HttpResponse(dados.corpo, content_type='application/json; charset=utf-8')
+    resp['ETag'] = dados.etag
+    resp['Cache-Control'] = 'private, no-cache'
+    return resp
 
 
 